@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+#Core libraries
+import os
+import pandas as pd
+import numpy as np
+
+#Custom imports
+from money_robot_code import data_engineering
+from money_robot_code import instrumentation
+from money_robot_code import pipeline
+
+
+'''
+Local walk-forward backtester used to pre-screen the configuration grid before any DataRobot project is
+created. For every ticker, a ridge-regularized linear model is fitted on the technical indicators for all
+(strategy, shift_period, move_value) targets at once - the features are shared, so one solve covers the whole
+grid - and its signals are scored on the following, unseen window. Training rows whose target looks past the
+start of the test window are purged, so no fold sees the future.
+'''
+
+
+#Columns of the ranking table, in order
+RANKING_COLUMNS = ['ticker', 'strategy', 'shift_period', 'move_value', 'rank', 'signals', 'precision', 'base_rate',\
+    'lift', 'mean_return', 'benchmark_return', 'sharpe']
+
+
+def walk_forward_splits(row_count: int, n_splits: int = 5, min_train_rows: int = 500, purge: int = 0) -> list:
+    '''
+    Expanding-window walk-forward splits
+    args:
+        row_count: rows in the dataset, oldest first
+        n_splits: number of test windows; the rows after min_train_rows are cut into this many equal windows
+        min_train_rows: rows in the first training window
+        purge: rows dropped from the end of each training window - the longest target horizon, so no
+        training target is computed from prices inside the test window
+    rtypes:
+        splits: list of (train_end, test_start, test_end) row positions; training rows are [0, train_end)
+    '''
+    if row_count <= min_train_rows:
+        return []
+    boundaries = np.linspace(min_train_rows, row_count, n_splits + 1).astype(int)
+    splits = []
+    for test_start, test_end in zip(boundaries[:-1], boundaries[1:]):
+        train_end = test_start - purge
+        if train_end > 0 and test_end > test_start:
+            splits.append((int(train_end), int(test_start), int(test_end)))
+    return splits
+
+
+def forward_returns(close: np.ndarray, shift_period_list: list) -> np.ndarray:
+    '''
+    Return from each bar to shift_period bars later, one column per horizon; NaN where the later bar doesn't exist
+    '''
+    close = np.asarray(close, dtype=np.float64)
+    returns = np.full((len(close), len(shift_period_list)), np.nan)
+    for position, shift_period in enumerate(shift_period_list):
+        if shift_period < len(close):
+            returns[:len(close) - shift_period, position] = close[shift_period:] / close[:-shift_period] - 1.0
+    return returns
+
+
+def _fit_ridge(features: np.ndarray, targets: np.ndarray, ridge: float) -> tuple:
+    #Standardize on the training rows only, then solve (X'X + ridge*I) W = X'Y for every target column at once
+    mean = features.mean(axis=0)
+    std = features.std(axis=0)
+    std[std == 0] = 1.0
+    standardized = (features - mean) / std
+    design = np.column_stack([np.ones(len(standardized)), standardized])
+    penalty = ridge * np.eye(design.shape[1])
+    penalty[0, 0] = 0.0
+    weights = np.linalg.solve(design.T @ design + penalty, design.T @ targets)
+    return mean, std, weights
+
+
+def _predict_ridge(model: tuple, features: np.ndarray) -> np.ndarray:
+    mean, std, weights = model
+    standardized = (features - mean) / std
+    return np.column_stack([np.ones(len(standardized)), standardized]) @ weights
+
+
+@instrumentation.traced('backtest')
+def backtest_ticker(ticker: str, feature_dataframe: pd.DataFrame, target_matrix: pd.DataFrame, n_splits: int = 5,\
+     min_train_rows: int = 500, ridge: float = 10.0, verbose=True) -> pd.DataFrame:
+    '''
+    Walk-forward backtest of every configuration of one ticker
+    args:
+        ticker: ticker symbol, copied into the ranking
+        feature_dataframe: output of data_engineering.build_feature_matrix
+        target_matrix: output of data_engineering.build_target_matrix for the same ticker
+        n_splits, min_train_rows: walk-forward settings, see walk_forward_splits
+        ridge: L2 penalty of the baseline model
+        verbose: choose whether to add prints and logs
+    rtypes:
+        ranking: one row per configuration with RANKING_COLUMNS, best first
+    dependencies:
+        signals go long for buy strategies and short for sell strategies, each held for shift_period bars
+    '''
+    if verbose: print('\nBacktesting {} configurations for ticker {}...'.format(len(target_matrix.columns), ticker))
+    configurations = list(target_matrix.columns)
+    shift_period_list = sorted(set(shift_period for _, shift_period, _ in configurations))
+    indicator_columns = [column for column in feature_dataframe.columns if column.startswith(data_engineering.INDICATOR_PREFIXES)]
+    features = feature_dataframe[indicator_columns].to_numpy(dtype=np.float64)
+    features[~np.isfinite(features)] = 0.0
+    targets = target_matrix.to_numpy(dtype=np.float64, na_value=np.nan)
+    returns = forward_returns(feature_dataframe['Close'].to_numpy(), shift_period_list)
+
+    #Signal returns for every configuration: the horizon's forward return, negated for sell strategies
+    horizon_positions = np.array([shift_period_list.index(shift_period) for _, shift_period, _ in configurations])
+    directions = np.array([1.0 if strategy == 'buy' else -1.0 for strategy, _, _ in configurations])
+    configuration_returns = returns[:, horizon_positions] * directions[None, :]
+
+    signals = np.zeros(targets.shape, dtype=bool)
+    tested = np.zeros(len(targets), dtype=bool)
+    for train_end, test_start, test_end in walk_forward_splits(len(targets), n_splits= n_splits,\
+        min_train_rows= min_train_rows, purge= max(shift_period_list)):
+        train_targets = targets[:train_end]
+        #Every target is known on the purged training rows; fill any gap with the column's positive rate
+        positive_rate = np.nanmean(train_targets, axis=0)
+        train_targets = np.where(np.isnan(train_targets), positive_rate[None, :], train_targets)
+        model = _fit_ridge(features[:train_end], train_targets, ridge)
+
+        #Signal on the test rows scoring above the training score quantile that matches the training positive rate
+        train_scores = np.sort(_predict_ridge(model, features[:train_end]), axis=0)
+        cutoff_positions = np.clip(((1.0 - positive_rate) * train_end).astype(int), 0, train_end - 1)
+        cutoffs = np.take_along_axis(train_scores, cutoff_positions[None, :], axis=0)[0]
+        signals[test_start:test_end] = _predict_ridge(model, features[test_start:test_end]) > cutoffs[None, :]
+        tested[test_start:test_end] = True
+
+    #Score the signals, counting only rows whose outcome is known
+    known = tested[:, None] & ~np.isnan(targets) & ~np.isnan(configuration_returns)
+    signals &= known
+    signal_count = signals.sum(axis=0)
+    known_count = known.sum(axis=0)
+    hits = (signals & (targets == 1)).sum(axis=0)
+    signal_returns = np.where(signals, configuration_returns, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        precision = hits / signal_count
+        base_rate = np.where(known, targets == 1, False).sum(axis=0) / known_count
+        mean_return = signal_returns.sum(axis=0) / signal_count
+        variance = np.where(signals, (configuration_returns - mean_return[None, :]) ** 2, 0.0).sum(axis=0) / signal_count
+        benchmark_return = np.where(known, configuration_returns, 0.0).sum(axis=0) / known_count
+        holding_periods = np.array([shift_period for _, shift_period, _ in configurations], dtype=np.float64)
+        sharpe = mean_return / np.sqrt(variance) * np.sqrt(252.0 / holding_periods)
+
+    ranking = pd.DataFrame({'ticker': ticker,\
+        'strategy': [strategy for strategy, _, _ in configurations],\
+        'shift_period': [shift_period for _, shift_period, _ in configurations],\
+        'move_value': [move_value for _, _, move_value in configurations],\
+        'signals': signal_count, 'precision': precision, 'base_rate': base_rate, 'lift': precision / base_rate,\
+        'mean_return': mean_return, 'benchmark_return': benchmark_return, 'sharpe': sharpe})
+    ranking = ranking.sort_values(by='sharpe', ascending=False, na_position='last', kind='mergesort').reset_index(drop=True)
+    ranking['rank'] = np.arange(1, len(ranking) + 1)
+    if verbose: print('Backtest for ticker {} done.'.format(ticker))
+    return ranking[RANKING_COLUMNS]
+
+
+def _backtest_ticker_star(arguments):
+    ticker, feature_dataframe, target_matrix, settings = arguments
+    return backtest_ticker(ticker, feature_dataframe, target_matrix, **settings)
+
+
+def backtest_tickers(ticker_data: dict, n_splits: int = 5, min_train_rows: int = 500, ridge: float = 10.0,\
+     workers=None, verbose=True) -> pd.DataFrame:
+    '''
+    Backtest several tickers in parallel
+    args:
+        ticker_data: dict of ticker -> (feature_dataframe, target_matrix)
+        n_splits, min_train_rows, ridge: see backtest_ticker
+        workers: worker processes; None uses every core, 1 runs in this process
+        verbose: choose whether to add prints and logs
+    rtypes:
+        ranking: rankings of every ticker, in ticker_data order, each best first
+    '''
+    settings = dict(n_splits= n_splits, min_train_rows= min_train_rows, ridge= ridge, verbose= verbose)
+    arguments = [(ticker, feature_dataframe, target_matrix, settings) for ticker, (feature_dataframe, target_matrix) in ticker_data.items()]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(arguments)))
+    if workers == 1:
+        rankings = [_backtest_ticker_star(argument) for argument in arguments]
+    else:
+        with pipeline.process_pool(workers, preload= ['money_robot_code.backtest']) as executor:
+            rankings = list(executor.map(_backtest_ticker_star, arguments))
+    if not rankings:
+        return pd.DataFrame(columns=RANKING_COLUMNS)
+    return pd.concat(rankings, ignore_index=True)
+
+
+def top_configurations(ranking: pd.DataFrame, top_k: int, min_signals: int = 1) -> set:
+    '''
+    The top_k configurations of every ticker in a ranking
+    args:
+        ranking: output of backtest_ticker or backtest_tickers
+        top_k: configurations to keep per ticker
+        min_signals: configurations with fewer test signals than this are never kept
+    rtypes:
+        configurations: set of (ticker, strategy, shift_period, move_value)
+    '''
+    eligible = ranking[(ranking['signals'] >= min_signals) & ranking['sharpe'].notna()]
+    selected = eligible.sort_values(by=['ticker', 'rank']).groupby('ticker', sort=False).head(top_k)
+    return set(zip(selected['ticker'], selected['strategy'], selected['shift_period'], selected['move_value']))
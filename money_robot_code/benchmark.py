@@ -0,0 +1,473 @@
+# -*- coding: utf-8 -*-
+
+#Core libraries
+import os
+import sys
+import json
+import time
+import zlib
+import shutil
+import argparse
+import platform
+import tempfile
+import warnings
+import tracemalloc
+import statistics
+import pandas as pd
+import numpy as np
+import requests
+
+#Custom imports
+from money_robot_code import data_engineering
+from money_robot_code import indicator_engine
+from money_robot_code import database_operations
+from money_robot_code import scoring_client
+from money_robot_code import model_factory
+from money_robot_code.price_store import PriceStore, normalize_price_frame
+from money_robot_code.online_indicators import OnlineIndicatorState
+from money_robot_code.sqlite_connector import SQLiteConnector
+from money_robot_code.fake_datarobot import FakeDataRobot
+
+
+'''
+Offline benchmark suite. Every stage of the pipeline is run on seeded synthetic OHLCV data, with Yahoo,
+Snowflake, DataRobot and the prediction API replaced by local stand-ins (SyntheticDataSource, sqlite_connector,
+fake_datarobot and StubPredictionSession), and timed and memory-profiled. Results can be saved as a baseline
+and later runs compared against it, flagging every stage that got slower or bigger than a threshold allows:
+
+    python -m money_robot_code.benchmark --rows 5000 --tickers 3 --save-baseline
+    python -m money_robot_code.benchmark --rows 5000 --tickers 3 --threshold 0.25
+    python -m money_robot_code.benchmark --check-parity
+
+Each stage is run once to warm up and then repeat times; its time is the median of the repeats and its memory
+the peak traced allocation of one extra run under tracemalloc, which is kept out of the timed runs.
+'''
+
+
+#Bump when stages or measurements change, so an old baseline isn't compared against new numbers
+BENCHMARK_VERSION = 1
+
+DEFAULT_BASELINE_PATH = 'data/benchmarks/baseline.json'
+
+#Configuration grid the target and load stages are run over
+BENCHMARK_STRATEGIES = ['buy', 'sell']
+BENCHMARK_SHIFT_PERIODS = [1, 5, 20]
+BENCHMARK_MOVE_VALUES = [0.5, 0.9]
+
+
+def synthetic_ohlcv(ticker: str, rows: int, seed: int = 0, end: str = '2020-12-31') -> pd.DataFrame:
+    '''
+    Seeded synthetic daily bars in the layout pull_yahoo_data returns: a geometric random walk for the close,
+    open/high/low scattered around it, and integer volumes. The same ticker, rows and seed always give the
+    same frame.
+    args:
+        ticker: ticker symbol, mixed into the seed so every ticker gets its own series
+        rows: number of business days of history
+        seed: base seed
+        end: date of the last bar
+    rtypes:
+        price_dataframe: normalized price frame, oldest bar first
+    '''
+    generator = np.random.default_rng([seed, zlib.crc32(ticker.encode('utf-8'))])
+    close = 100.0 * np.exp(np.cumsum(generator.normal(0.0003, 0.015, rows)))
+    open_ = close * np.exp(generator.normal(0.0, 0.005, rows))
+    high = np.maximum(open_, close) * np.exp(np.abs(generator.normal(0.0, 0.01, rows)))
+    low = np.minimum(open_, close) * np.exp(-np.abs(generator.normal(0.0, 0.01, rows)))
+    price_dataframe = pd.DataFrame({'Date': pd.bdate_range(end=end, periods=rows), 'Open': open_, 'High': high,\
+        'Low': low, 'Close': close, 'Volume': generator.integers(100000, 10000000, rows), 'Dividends': 0.0,\
+        'Stock Splits': 0.0})
+    return normalize_price_frame(price_dataframe)
+
+
+class SyntheticDataSource:
+    '''
+    Data source for a PriceStore serving synthetic_ohlcv bars instead of downloading them
+    args:
+        rows: bars of history per ticker
+        seed: base seed passed to synthetic_ohlcv
+    '''
+
+    def __init__(self, rows: int, seed: int = 0):
+        self.rows = rows
+        self.seed = seed
+
+    def fetch(self, ticker: str, start=None) -> pd.DataFrame:
+        price_dataframe = synthetic_ohlcv(ticker, self.rows, seed= self.seed)
+        if start is not None:
+            price_dataframe = price_dataframe[price_dataframe['Date'] >= pd.Timestamp(start)]
+        return price_dataframe
+
+    def fetch_many(self, tickers: list, start=None) -> dict:
+        return {ticker: self.fetch(ticker, start=start) for ticker in tickers}
+
+
+class StubPredictionResponse:
+    def __init__(self, body: dict):
+        self.status_code = 200
+        self.headers = {}
+        self.body = body
+
+    def raise_for_status(self) -> None:
+        pass
+
+    def json(self) -> dict:
+        return self.body
+
+
+class StubPredictionSession(requests.Session):
+    '''
+    requests.Session for a PredictionClient whose every post is answered with one prediction per
+    row of the payload, without any network traffic. The payload is parsed, so decoding costs are measured as
+    they would be on the server.
+    '''
+
+    def post(self, url: str, data=None, headers=None, timeout=None) -> StubPredictionResponse:
+        if headers is not None and headers.get('Content-Type', '').startswith('text/plain'):
+            row_count = max(data.count(b'\n') - 1, 0)
+        else:
+            row_count = len(json.loads(data))
+        return StubPredictionResponse({'data': [{'rowId': row_id, 'prediction': 0,\
+            'predictionValues': [{'label': 1, 'value': 0.5}, {'label': 0, 'value': 0.5}]} for row_id in range(row_count)]})
+
+
+def measure(function, setup=None, repeat: int = 5, warmup: int = 1, profile_memory=True) -> dict:
+    '''
+    Time and memory-profile one stage
+    args:
+        function: the stage, called as function(setup()) - or function() without a setup
+        setup: optional callable building fresh inputs for every run, outside the timed section
+        repeat: timed runs
+        warmup: untimed runs before the timed ones
+        profile_memory: also run once under tracemalloc for the peak allocation
+    rtypes:
+        measurement: dict with median_s, min_s, max_s, repeat and peak_mb (None when not profiled)
+    '''
+    def _run():
+        arguments = setup() if setup is not None else None
+        start = time.perf_counter()
+        if setup is not None:
+            function(arguments)
+        else:
+            function()
+        return time.perf_counter() - start
+
+    for _ in range(warmup):
+        _run()
+    timings = [_run() for _ in range(max(1, repeat))]
+
+    peak_mb = None
+    if profile_memory:
+        arguments = setup() if setup is not None else None
+        tracemalloc.start()
+        try:
+            if setup is not None:
+                function(arguments)
+            else:
+                function()
+            peak_mb = tracemalloc.get_traced_memory()[1] / 1e6
+        finally:
+            tracemalloc.stop()
+    return {'median_s': statistics.median(timings), 'min_s': min(timings), 'max_s': max(timings),\
+        'repeat': len(timings), 'peak_mb': peak_mb}
+
+
+def environment() -> dict:
+    '''
+    Versions that move the numbers - recorded with every result so a regression can be traced to an upgrade
+    '''
+    #ta is optional with the native engine
+    try:
+        import ta
+        ta_version = getattr(ta, '__version__', 'unknown')
+    except ImportError:
+        ta_version = None
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'pandas': pd.__version__,\
+        'numpy': np.__version__, 'ta': ta_version, 'cpu_count': os.cpu_count()}
+
+
+def check_indicator_parity(rows: int = 300, seed: int = 0, zero_volume_bars: int = 5, online_bars: int = 50,\
+     rtol: float = 1e-6, atol: float = 1e-9) -> pd.DataFrame:
+    '''
+    Compare the native indicator engine, in batch and online mode, with ta on synthetic bars, some of them with
+    zero volume (volume_em is infinite on those, which every engine must treat as missing)
+    args:
+        rows: bars of history
+        seed: seed of the synthetic data
+        zero_volume_bars: length of each run of zero-volume bars; one run is placed early in the history and
+        one among the online bars
+        online_bars: last bars of the history fed to an OnlineIndicatorState built from the ones before them
+        rtol, atol: tolerance of the comparison, as in np.isclose
+    rtypes:
+        parity: one row per indicator column and engine with the largest absolute difference from ta and
+        whether it matches
+    '''
+    price_dataframe = synthetic_ohlcv('PARITY', rows, seed= seed)
+    for start in [rows // 10, rows - online_bars // 2]:
+        price_dataframe.loc[start:start + zero_volume_bars - 1, 'Volume'] = 0
+    reference_dataframe = data_engineering.engineer_technical_indicators(price_dataframe.copy(), verbose=False, engine='ta')
+    native_dataframe = data_engineering.engineer_technical_indicators(price_dataframe.copy(), verbose=False, engine='native')
+    state = OnlineIndicatorState.from_history(price_dataframe.iloc[:rows - online_bars])
+    online_dataframe = state.update(price_dataframe.iloc[rows - online_bars:])
+    parity = []
+    for engine, engine_dataframe in [('native', native_dataframe), ('online', online_dataframe)]:
+        for column in indicator_engine.ALL_INDICATOR_COLUMNS:
+            values = engine_dataframe[column].to_numpy(dtype=np.float64)
+            reference = reference_dataframe[column].to_numpy(dtype=np.float64)[-len(values):]
+            with np.errstate(invalid='ignore'):
+                difference = np.abs(reference - values)
+            parity.append({'engine': engine, 'column': column,\
+                'max_abs_diff': float(np.nanmax(difference)) if np.isfinite(difference).any() else 0.0,\
+                'matches': bool(np.isclose(reference, values, rtol= rtol, atol= atol, equal_nan=True).all())})
+    return pd.DataFrame(parity, columns=['engine', 'column', 'max_abs_diff', 'matches'])
+
+
+def run_benchmarks(rows: int = 5000, tickers: int = 3, seed: int = 0, repeat: int = 5, engine: str = None,\
+     stages=None, verbose=True) -> dict:
+    '''
+    Run the benchmark suite
+    args:
+        rows: bars of history per ticker
+        tickers: number of synthetic tickers
+        seed: base seed of the synthetic data
+        repeat: timed runs per stage
+        engine: indicator engine of the feature stages after "indicators", 'ta' or 'native'; None uses ta when it
+        is installed and the native engine otherwise
+        stages: names of the stages to run, None for all of them
+        verbose: choose whether to add prints and logs
+    rtypes:
+        results: dict with the settings, the environment and one measurement per stage
+    '''
+    run_environment = environment()
+    if engine is None:
+        engine = 'ta' if run_environment['ta'] is not None else 'native'
+    ticker_list = ['SYN{}'.format(position) for position in range(tickers)]
+    work_directory = tempfile.mkdtemp(prefix='benchmark_')
+    data_source = SyntheticDataSource(rows, seed= seed)
+    stock_dataframes = {ticker: data_engineering.pull_yahoo_data(ticker, verbose=False,\
+        price_store= PriceStore(os.path.join(work_directory, 'prices'), data_source= data_source, verbose=False))\
+        for ticker in ticker_list}
+    feature_dataframes = {ticker: data_engineering.build_feature_matrix(stock_dataframe, verbose=False, engine= engine,\
+        dtype='float32') for ticker, stock_dataframe in stock_dataframes.items()}
+    table_dataframes = {ticker: data_engineering.attach_target_feature(feature_dataframe, BENCHMARK_SHIFT_PERIODS[0],\
+        BENCHMARK_MOVE_VALUES[0], BENCHMARK_STRATEGIES[0], verbose=False).rename(columns={'Stock Splits': 'STOCK_SPLITS'})\
+        for ticker, feature_dataframe in feature_dataframes.items()}
+    for table_dataframe in table_dataframes.values():
+        table_dataframe.columns = [column.upper() for column in table_dataframe.columns]
+    col_types = {ticker: database_operations.get_col_types(table_dataframe, verbose=False)\
+        for ticker, table_dataframe in table_dataframes.items()}
+    scoring_jobs = [('{}_TEST'.format(ticker), scoring_client.prepare_scoring_frame(feature_dataframe), ticker, 'key')\
+        for ticker, feature_dataframe in feature_dataframes.items()]
+
+    def _fetch_setup():
+        return PriceStore(tempfile.mkdtemp(prefix='prices_', dir= work_directory), data_source= data_source, verbose=False)
+
+    def _fetch(price_store):
+        for ticker in ticker_list:
+            data_engineering.pull_yahoo_data(ticker, verbose=False, price_store= price_store)
+
+    def _targets():
+        for stock_dataframe in stock_dataframes.values():
+            for strategy in BENCHMARK_STRATEGIES:
+                for shift_period in BENCHMARK_SHIFT_PERIODS:
+                    for move_value in BENCHMARK_MOVE_VALUES:
+                        data_engineering.create_target_feature(stock_dataframe, shift_period, move_value, strategy, verbose=False)
+
+    def _target_matrix():
+        for stock_dataframe in stock_dataframes.values():
+            data_engineering.build_target_matrix(stock_dataframe['Close'], BENCHMARK_SHIFT_PERIODS, BENCHMARK_MOVE_VALUES,\
+                BENCHMARK_STRATEGIES, verbose=False)
+
+    def _indicators(engine_name):
+        def _run():
+            for stock_dataframe in stock_dataframes.values():
+                data_engineering.engineer_technical_indicators(stock_dataframe, verbose=False, engine= engine_name)
+        return _run
+
+    def _col_types():
+        for table_dataframe in table_dataframes.values():
+            database_operations.get_col_types(table_dataframe, verbose=False)
+
+    def _create_table_setup():
+        #A fresh database per run, so every run creates its tables from scratch
+        database_path = os.path.join(tempfile.mkdtemp(prefix='sqlite_', dir= work_directory), 'benchmark.db')
+        return database_operations.SnowflakeSessionPool(settings={}, connector= SQLiteConnector(database_path), verbose=False)
+
+    def _create_table(session_pool):
+        with session_pool:
+            for ticker, table_dataframe in table_dataframes.items():
+                database_operations.create_table(table='BENCHMARK_{}_TRAIN'.format(ticker), action='create_replace',\
+                    col_type= col_types[ticker], df= table_dataframe, verbose=False, session_pool= session_pool)
+
+    def _scoring_client():
+        return scoring_client.PredictionClient('token', api_url='http://localhost/{deployment_id}', backoff=0.0,\
+            session= StubPredictionSession(), verbose=False)
+
+    def _scoring_payload(client):
+        client._build_requests(scoring_jobs)
+
+    def _scoring(client):
+        client.score_many(scoring_jobs)
+
+    def _factory_setup():
+        manifest = model_factory.ProjectManifest(os.path.join(tempfile.mkdtemp(prefix='factory_', dir= work_directory), 'manifest.json'))
+        return model_factory.ModelFactoryScheduler(manifest, dr_client= FakeDataRobot(), verbose=False)
+
+    def _factory(scheduler):
+        with scheduler:
+            for ticker, table_dataframe in table_dataframes.items():
+                scheduler.submit(table_dataframe, 'BENCHMARK_{}_TRAIN'.format(ticker))
+            scheduler.wait()
+
+    #Stage name -> (function, setup), in pipeline order
+    stage_functions = {
+        'fetch': (_fetch, _fetch_setup),
+        'create_target_feature': (_targets, None),
+        'build_target_matrix': (_target_matrix, None),
+        'indicators_ta': (_indicators('ta'), None),
+        'indicators_native': (_indicators('native'), None),
+        'get_col_types': (_col_types, None),
+        'create_table': (_create_table, _create_table_setup),
+        'scoring_payload': (_scoring_payload, _scoring_client),
+        'scoring': (_scoring, _scoring_client),
+        'model_factory': (_factory, _factory_setup),
+    }
+    if stages is None and run_environment['ta'] is None:
+        #Without ta installed only the native engine can run
+        del stage_functions['indicators_ta']
+    if stages is not None:
+        unknown_stages = [stage for stage in stages if stage not in stage_functions]
+        if unknown_stages:
+            raise ValueError('Unknown benchmark stages {}, expected some of {}'.format(unknown_stages, list(stage_functions)))
+        stage_functions = {stage: stage_functions[stage] for stage in stage_functions if stage in stages}
+
+    results = {'version': BENCHMARK_VERSION, 'created_at': pd.Timestamp.now().isoformat(),\
+        'settings': {'rows': rows, 'tickers': tickers, 'seed': seed, 'engine': engine}, 'environment': run_environment,\
+        'stages': {}}
+    try:
+        for stage, (function, setup) in stage_functions.items():
+            if verbose: print('Benchmarking {}...'.format(stage))
+            results['stages'][stage] = measure(function, setup= setup, repeat= repeat)
+            if verbose: print('  {:.4f}s median, {:.1f} MB peak'.format(results['stages'][stage]['median_s'],\
+                results['stages'][stage]['peak_mb']))
+    finally:
+        shutil.rmtree(work_directory, ignore_errors=True)
+    return results
+
+
+def save_results(results: dict, path: str = DEFAULT_BASELINE_PATH) -> None:
+    #Write to a temp file and swap it in, so an interrupted run never leaves a truncated baseline
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w') as results_file:
+        json.dump(results, results_file, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def load_results(path: str = DEFAULT_BASELINE_PATH) -> dict:
+    with open(path, 'r') as results_file:
+        return json.load(results_file)
+
+
+def compare_results(results: dict, baseline: dict, threshold: float = 0.25, memory_threshold: float = None,\
+     min_time_delta: float = 0.005) -> pd.DataFrame:
+    '''
+    Compare a run against a baseline
+    args:
+        results: output of run_benchmarks
+        baseline: an earlier run_benchmarks output, e.g. from load_results
+        threshold: a stage regressed when its median time grew by more than this fraction
+        memory_threshold: same for peak memory; None uses threshold
+        min_time_delta: slowdowns smaller than this many seconds are timer noise and never flagged
+    rtypes:
+        comparison: one row per stage in both runs, with the baseline and current numbers, their ratios and a
+        regression flag
+    '''
+    if baseline.get('version') != results.get('version'):
+        raise ValueError('Baseline has benchmark version {}, expected {}'.format(baseline.get('version'), results.get('version')))
+    if baseline['settings'] != results['settings']:
+        raise ValueError('Baseline was run with {}, this run with {} - re-run with the same settings or save a new baseline'.\
+            format(baseline['settings'], results['settings']))
+    memory_threshold = threshold if memory_threshold is None else memory_threshold
+
+    rows = []
+    for stage, measurement in results['stages'].items():
+        if stage not in baseline['stages']:
+            continue
+        baseline_measurement = baseline['stages'][stage]
+        time_ratio = measurement['median_s'] / baseline_measurement['median_s'] if baseline_measurement['median_s'] else np.nan
+        memory_ratio = np.nan
+        if measurement['peak_mb'] is not None and baseline_measurement['peak_mb']:
+            memory_ratio = measurement['peak_mb'] / baseline_measurement['peak_mb']
+        rows.append({'stage': stage, 'baseline_s': baseline_measurement['median_s'], 'current_s': measurement['median_s'],\
+            'time_ratio': time_ratio, 'baseline_mb': baseline_measurement['peak_mb'], 'current_mb': measurement['peak_mb'],\
+            'memory_ratio': memory_ratio,\
+            'regression': bool((time_ratio > 1.0 + threshold and measurement['median_s'] - baseline_measurement['median_s'] > min_time_delta)\
+                or memory_ratio > 1.0 + memory_threshold)})
+    return pd.DataFrame(rows, columns=['stage', 'baseline_s', 'current_s', 'time_ratio', 'baseline_mb', 'current_mb',\
+        'memory_ratio', 'regression'])
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Offline benchmark of every pipeline stage on synthetic data')
+    parser.add_argument('--rows', type=int, default=5000, help='bars of history per ticker')
+    parser.add_argument('--tickers', type=int, default=3, help='number of synthetic tickers')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic data')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per stage')
+    parser.add_argument('--engine', default=None, choices=['ta', 'native'],\
+        help='indicator engine of the feature matrix; ta when it is installed, native otherwise')
+    parser.add_argument('--stages', nargs='+', default=None, help='stages to run, all of them by default')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_PATH, help='baseline results file')
+    parser.add_argument('--save-baseline', action='store_true', help='save this run as the new baseline')
+    parser.add_argument('--output', default=None, help='also save this run to this file')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown, as a fraction of the baseline')
+    parser.add_argument('--memory-threshold', type=float, default=None, help='allowed peak memory growth; defaults to --threshold')
+    parser.add_argument('--min-time-delta', type=float, default=0.005, help='slowdowns under this many seconds are never flagged')
+    parser.add_argument('--check-parity', action='store_true', help='only check the native indicator engine, batch and online, against ta')
+    arguments = parser.parse_args(argv)
+
+    #ta warns on every run about its own divisions by zero and deprecated pandas calls
+    warnings.simplefilter('ignore', category=RuntimeWarning)
+    warnings.simplefilter('ignore', category=FutureWarning)
+    if arguments.check_parity:
+        if environment()['ta'] is None:
+            print('The parity check compares with ta, which is not installed.')
+            return 1
+        parity = check_indicator_parity(seed= arguments.seed)
+        mismatches = parity[~parity['matches']]
+        if len(mismatches):
+            print('{} indicator column(s) differ from ta:'.format(len(mismatches)))
+            print(mismatches.to_string(index=False))
+            return 1
+        print('All {} indicators match ta, in batch and online mode.'.format(parity['column'].nunique()))
+        return 0
+    results = run_benchmarks(rows= arguments.rows, tickers= arguments.tickers, seed= arguments.seed,\
+        repeat= arguments.repeat, engine= arguments.engine, stages= arguments.stages)
+    if arguments.output is not None:
+        save_results(results, arguments.output)
+    if arguments.save_baseline:
+        save_results(results, arguments.baseline)
+        print('\nBaseline saved to {}.'.format(arguments.baseline))
+        return 0
+    if not os.path.exists(arguments.baseline):
+        print('\nNo baseline at {} - run with --save-baseline to create one.'.format(arguments.baseline))
+        return 0
+
+    baseline = load_results(arguments.baseline)
+    comparison = compare_results(results, baseline, threshold= arguments.threshold, memory_threshold= arguments.memory_threshold,\
+        min_time_delta= arguments.min_time_delta)
+    print('\nCompared with the baseline from {}:'.format(baseline['created_at']))
+    print(comparison.to_string(index=False))
+    changed_versions = {name: (baseline['environment'].get(name), version) for name, version in results['environment'].items()\
+        if baseline['environment'].get(name) != version}
+    if changed_versions:
+        print('\nEnvironment changed since the baseline: {}'.format(changed_versions))
+    regressions = comparison[comparison['regression']]
+    if len(regressions):
+        print('\n{} stage(s) regressed: {}'.format(len(regressions), ', '.join(regressions['stage'])))
+        return 1
+    print('\nNo regressions.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
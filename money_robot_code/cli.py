@@ -0,0 +1,421 @@
+# -*- coding: utf-8 -*-
+
+#Core libraries
+import os
+import argparse
+import datetime
+
+#Custom imports - only the settings are imported up front; each command imports the backends it needs when it
+#runs, so a scoring run never loads datarobot or snowflake, loads yfinance only when there are new bars to fetch
+#and ta only with the ta indicator engine
+from money_robot_code import settings as settings_operations
+
+
+'''
+Command line entry point:
+
+    python main.py [--config config.yaml] [command] [--tickers AAPL MSFT]
+
+commands:
+    fetch: bring the local price store up to date
+    build: fetch, then build the features and targets of every configuration, run the backtest if it is
+    enabled and save the data locally if app.save_data_locally is set
+    load: build, then load the tables into Snowflake
+    factory: build, then create the DataRobot projects; with --wait, wait until Autopilot is done on all of them
+    score: bring the tickers the scoring jobs need up to date, roll their saved indicator states forward and
+    score each job's latest bar on its deployment; with --daemon, ask a running scoring daemon instead, which
+    is one local HTTP call
+    serve: run the scoring daemon (see scoring_daemon)
+    run: every step turned on in the app section of the config file - the default
+
+config.yaml is read and validated once, before anything else runs, and the settings are handed to every step.
+'''
+
+
+COMMANDS = ['fetch', 'build', 'load', 'factory', 'score', 'serve', 'run']
+
+
+def configure_instrumentation(settings) -> None:
+    '''
+    Turn tracing on when the instrumentation section enables it - every stage run is written to a JSON-lines trace,
+    tagged with this run's id so a fixed trace_path can collect many runs
+    '''
+    if settings.instrumentation.enabled:
+        from money_robot_code import instrumentation
+        instrumentation.configure(path= settings.instrumentation.trace_path or os.path.join('data', 'traces',\
+            datetime.datetime.now().strftime('%Y%m%d_%H%M%S') + '.jsonl'))
+
+
+def print_stage_summary(settings) -> None:
+    '''
+    Print where the time went, when tracing is on
+    '''
+    if not settings.instrumentation.enabled:
+        return
+    from money_robot_code import instrumentation
+    if instrumentation.get_tracer().enabled:
+        print('\nStage summary of run {} (trace {}): '.format(instrumentation.get_tracer().run_id, instrumentation.get_tracer().path))
+        print(instrumentation.summary().to_string(index=False))
+
+
+def open_stage_cache(settings):
+    '''
+    The stage cache from the stage_cache section, or None when it is disabled
+    '''
+    if not settings.stage_cache.enabled:
+        return None
+    from money_robot_code import stage_cache as stage_cache_operations
+    return stage_cache_operations.StageCache(directory= settings.stage_cache.directory,\
+        max_size_mb= settings.stage_cache.max_size_mb, max_age_days= settings.stage_cache.max_age_days)
+
+
+def fetch(settings, tickers=None):
+    '''
+    Bring the local price store up to date for every ticker in one bulk fetch
+    args:
+        settings: settings.Settings
+        tickers: tickers to fetch; defaults to data.ticker_list
+    rtypes:
+        price_store: the PriceStore, ready to be read from
+    '''
+    from money_robot_code.price_store import PriceStore
+    price_store = PriceStore(directory= settings.data.price_store_dir)
+    price_store.update_many(tickers if tickers is not None else settings.data.ticker_list)
+    return price_store
+
+
+def scoring_tickers(settings) -> list:
+    '''
+    Tickers whose dataframes the scoring jobs score, in data.ticker_list order
+    '''
+    from money_robot_code import pipeline
+    settings.require('datarobot_api_scoring_settings')
+    data = settings.data
+    names = pipeline.configuration_names(table_prefix= data.table_prefix, ticker_list= data.ticker_list,\
+        strategy_list= data.strategy_list, shift_period_list= data.shift_period_list, move_value_list= data.move_value_list)
+    unknown_names = [job.dataframe_name for job in settings.scoring.jobs if job.dataframe_name not in names]
+    if unknown_names:
+        raise ValueError('Scoring jobs name dataframes outside the configuration grid: {}'.format(unknown_names))
+    job_tickers = set(names[job.dataframe_name][0] for job in settings.scoring.jobs)
+    return [ticker for ticker in data.ticker_list if ticker in job_tickers]
+
+
+def load_table(stage_cache, table_key: str, **load_settings) -> None:
+    '''
+    Load a table with database_operations.create_table, unless the stage cache recorded this exact load and the
+    table still holds it - a table dropped or replaced outside the pipeline since is loaded again
+    args:
+        stage_cache: StageCache the loads are recorded in
+        table_key: stage_key of the load
+        load_settings: arguments of create_table
+    '''
+    from money_robot_code import database_operations
+    if stage_cache.contains('table', table_key):
+        row_count = database_operations.get_table_row_count(load_settings['table'], session_pool= load_settings['session_pool'])
+        #Other runs add rows to an append table, so for those it only has to exist
+        if row_count == len(load_settings['df']) or (load_settings['action'] == 'append' and row_count is not None):
+            return
+        print('\nTable {} changed since it was loaded, loading it again.'.format(load_settings['table']))
+    database_operations.create_table(**load_settings)
+    stage_cache.put('table', table_key, None)
+
+
+def score_locally(settings) -> dict:
+    '''
+    Score the configured jobs in this process, as a one-shot scoring daemon: only the bars missing from the
+    price store are fetched, and the saved indicator states of the scoring tickers are rolled forward over them
+    instead of building every configuration's dataset.
+    args:
+        settings: settings.Settings
+    rtypes:
+        response: same layout as the scoring daemon's /score response
+    '''
+    from money_robot_code import scoring_daemon
+    daemon = scoring_daemon.ScoringDaemon(settings, verbose=False)
+    try:
+        daemon.warm(refresh=True, tickers= scoring_tickers(settings))
+        return {'predictions': daemon.score_jobs()}
+    finally:
+        daemon.close()
+
+
+def print_predictions(response: dict) -> None:
+    for prediction in response['predictions']:
+        print('{} on {} ({}): {}'.format(prediction['dataframe_name'], prediction['date'], prediction['deployment_id'],\
+            [row.get('predictionValues', row.get('prediction')) for row in prediction['predictions']]))
+
+
+def score_with_daemon(settings, refresh=False, timeout: float = 300) -> dict:
+    '''
+    Score the configured jobs on a running scoring daemon. Uses urllib rather than requests, so the call
+    doesn't import anything heavy.
+    args:
+        settings: settings.Settings
+        refresh: have the daemon download the bars missing from its price store first
+        timeout: seconds to wait for the answer
+    rtypes:
+        response: the daemon's /score response
+    '''
+    import json
+    import urllib.request
+    import urllib.error
+    url = 'http://{}:{}/score'.format(settings.scoring_daemon.host, settings.scoring_daemon.port)
+    request = urllib.request.Request(url, data= json.dumps({'refresh': refresh}).encode('utf-8'),\
+        headers= {'Content-Type': 'application/json'}, method='POST')
+    try:
+        with urllib.request.urlopen(request, timeout= timeout) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as error:
+        raise RuntimeError('The scoring daemon at {} answered {}: {}'.format(url, error.code, error.read().decode('utf-8'))) from None
+
+
+def run_pipeline(settings, tickers=None, load=False, factory=False, score=False, backtest=False, save=False,\
+     wait_for_autopilot=False):
+    '''
+    Build the dataframes of every configuration and run the selected steps on them
+    args:
+        settings: settings.Settings
+        tickers: tickers to run; defaults to data.ticker_list
+        load: load every table into Snowflake
+        factory: create a DataRobot project for every training table
+        score: score the configured deployments
+        backtest: backtest every configuration locally first; with factory, only the top_k configurations of
+        each ticker get a project
+        save: save the dataframes locally, as app.save_format
+        wait_for_autopilot: with factory, poll until Autopilot is done on every project instead of checking once
+    rtypes:
+        all_dataframes_dict: DatasetCatalog of every dataframe of the run
+    '''
+    from money_robot_code import pipeline
+    from money_robot_code.dataset_catalog import DatasetCatalog
+    from money_robot_code import stage_cache as stage_cache_operations
+    data = settings.data
+    app = settings.app
+    ticker_list = tickers if tickers is not None else data.ticker_list
+    stage_cache = open_stage_cache(settings)
+
+    if factory:
+        settings.require('datarobot_settings')
+        import datarobot as dr
+        from money_robot_code import model_factory as model_factory_operations
+        print('\nConnecting to DataRobot...')
+        dr.Client(endpoint= settings.datarobot.endpoint, token= settings.datarobot.token)
+        print('Connection successful.')
+
+        #Projects are uploaded in the background and tracked in a manifest per factory run - re-running the same
+        #run (by default, the same day) picks up where it stopped instead of creating the projects again
+        factory_run_id = settings.datarobot.factory_run_id or str(datetime.date.today())
+        project_manifest = model_factory_operations.ProjectManifest(path= os.path.join(settings.datarobot.manifest_dir,\
+            factory_run_id + '.json'))
+        model_factory_scheduler = model_factory_operations.ModelFactoryScheduler(manifest= project_manifest, dr_client= dr,\
+            max_in_flight_uploads= settings.datarobot.max_in_flight_uploads or app.io_workers, verbose=True)
+
+    #Open Snowflake connections once for the whole run - every table load reuses them
+    if load:
+        settings.require('snowflake')
+        from money_robot_code import database_operations
+        snowflake_session_pool = database_operations.SnowflakeSessionPool(settings= settings.snowflake.connect_settings(),\
+            max_connections= settings.snowflake.max_connections)
+        table_load_state = database_operations.TableLoadStateStore(directory= settings.snowflake.load_state_dir)
+
+    #Define place to store name of dataframes, and dataframes themselves - the catalog keeps one feature matrix per
+    #ticker and builds each named dataframe when it is asked for. Snowflake tables use upper case column names.
+    all_dataframe_names_list = []
+    all_dataframes_dict = DatasetCatalog(table_prefix= data.table_prefix, strategy_list= data.strategy_list,\
+        shift_period_list= data.shift_period_list, move_value_list= data.move_value_list, upper_case_columns= load)
+    projects = {}
+    project_cache_keys = {}
+
+    #Bring the local price store up to date - the pipeline below reads from disk
+    price_store = fetch(settings, tickers= ticker_list)
+
+    #Fetch and engineer every ticker in parallel - results come back in ticker_list order, so the names list
+    #and the tables are built in the same order as a sequential run
+    ticker_results = pipeline.run_ticker_pipeline(ticker_list= ticker_list, price_store= price_store,\
+        shift_period_list= data.shift_period_list, move_value_list= data.move_value_list, strategy_list= data.strategy_list,\
+        engine= data.indicator_engine, indicators= data.indicator_list, dtype= data.indicator_dtype,\
+        target_settings= data.target_settings, cpu_workers= app.cpu_workers, io_workers= app.io_workers,\
+        stage_cache= stage_cache, verbose=True)
+
+    #Pre-screen every configuration with the local walk-forward backtest, the tickers in parallel on the same
+    #number of worker processes as the features - the factory below needs each ticker's top_k first
+    if backtest:
+        from money_robot_code import backtest as backtest_operations
+        ticker_results = list(ticker_results)
+        backtest_ranking = backtest_operations.backtest_tickers(ticker_data= {ticker: (feature_dataframe, target_matrix)\
+            for ticker, feature_dataframe, target_matrix in ticker_results}, n_splits= settings.backtest.n_splits,\
+            min_train_rows= settings.backtest.min_train_rows, ridge= settings.backtest.ridge, workers= app.cpu_workers, verbose=True)
+        selected_configurations = backtest_operations.top_configurations(ranking= backtest_ranking,\
+            top_k= settings.backtest.top_k, min_signals= settings.backtest.min_signals)
+
+    #Loop through all settings
+    for ticker, feature_dataframe, target_matrix in ticker_results:
+
+        #Register every configuration of the ticker - append its names to names list
+        all_dataframe_names_list.extend(all_dataframes_dict.add_ticker(ticker= ticker, feature_dataframe= feature_dataframe,\
+            target_matrix= target_matrix))
+
+        if not (load or factory):
+            continue
+
+        for strategy, shift_period, move_value in pipeline.iterate_configurations(strategy_list= data.strategy_list,\
+            shift_period_list= data.shift_period_list, move_value_list= data.move_value_list):
+
+            #Create the names of the training and testing tables
+            stock_dataframe_training_table_string = pipeline.table_name(table_prefix= data.table_prefix, ticker= ticker,\
+                strategy= strategy, shift_period= shift_period, move_value= move_value, split= 'TRAIN')
+            stock_dataframe_testing_table_string = pipeline.table_name(table_prefix= data.table_prefix, ticker= ticker,\
+                strategy= strategy, shift_period= shift_period, move_value= move_value, split= 'TEST')
+
+            #Create training and testing dataframes - the shared feature matrix with this configuration's target
+            stock_dataframe_training = all_dataframes_dict[stock_dataframe_training_table_string]
+            stock_dataframe_testing = all_dataframes_dict[stock_dataframe_testing_table_string]
+
+            #Load data into snowflake
+            if load:
+                for table_string, table_dataframe in [(stock_dataframe_training_table_string, stock_dataframe_training),\
+                    (stock_dataframe_testing_table_string, stock_dataframe_testing)]:
+                    #Load data into database for TRAINING and TESTING - skipped when this exact table was already loaded
+                    #and is still there
+                    query_string = database_operations.get_col_types(df= table_dataframe)
+                    load_settings = dict(table= table_string, action= settings.snowflake.load_action, col_type = query_string,\
+                        df= table_dataframe, session_pool= snowflake_session_pool, load_state= table_load_state)
+                    #Merges are left to the load-state store, which already sends only the changed rows and rebuilds
+                    #a table that no longer matches what was loaded
+                    if stage_cache is None or settings.snowflake.load_action == 'merge':
+                        snowflake_session_pool.submit(database_operations.create_table, **load_settings)
+                        continue
+                    table_key = stage_cache_operations.stage_key('table', pipeline.STAGE_MODULES['table'], table_string,\
+                        settings.snowflake.load_action, query_string, table_dataframe)
+                    snowflake_session_pool.submit(load_table, stage_cache, table_key, **load_settings)
+
+            #IF model factory is turned on, create projects for each dataset in DataRobot
+            if factory:
+
+                #Only the configurations that made the backtest's top_k get a project
+                if backtest and (ticker, strategy, shift_period, move_value) not in selected_configurations:
+                    continue
+
+                #Reuse the project of an earlier run that was trained on exactly this data
+                if stage_cache is not None:
+                    project_key = stage_cache_operations.stage_key('project', pipeline.STAGE_MODULES['project'],\
+                        stock_dataframe_training_table_string, stock_dataframe_training)
+                    cached_project_id = stage_cache.get('project', project_key)
+                    if cached_project_id is not stage_cache_operations.MISSING:
+                        projects[stock_dataframe_training_table_string] = cached_project_id
+                        #Track it in this run's manifest too, so its Autopilot status is polled with the others
+                        if project_manifest.get(stock_dataframe_training_table_string) is None:
+                            project_manifest.update(stock_dataframe_training_table_string, project_id= cached_project_id,\
+                                state= model_factory_operations.MODELING)
+                        continue
+                    project_cache_keys[stock_dataframe_training_table_string] = project_key
+
+                #Queue a DataRobot project for every single iteration - uploads and Autopilot kickoffs run in the background
+                model_factory_scheduler.submit(dataframe= stock_dataframe_training, project_name_prefix= stock_dataframe_training_table_string)
+
+    #Save the backtest ranking of every configuration
+    if backtest and len(backtest_ranking):
+        backtest_ranking.to_csv(settings.backtest.ranking_path, index=False)
+        print('\nBacktest ranking (top configurations per ticker): ')
+        print(backtest_ranking[backtest_ranking['rank'] <= settings.backtest.top_k])
+
+    #Wait for the DataRobot uploads and record the project ids - failures are kept in the manifest
+    if factory:
+        projects.update(model_factory_scheduler.wait())
+        #Record which projects finished Autopilot - including the ones of an earlier, resumed run of the same manifest
+        if wait_for_autopilot:
+            print('\nWaiting for Autopilot...')
+            project_states = model_factory_scheduler.wait_for_autopilot(poll_interval= settings.datarobot.autopilot_poll_interval,\
+                timeout= settings.datarobot.autopilot_timeout)
+        else:
+            project_states = model_factory_scheduler.poll()
+        model_factory_scheduler.close()
+        #Remember the projects whose Autopilot started, so a later run with the same data doesn't create them again
+        for project_name_prefix, project_key in project_cache_keys.items():
+            entry = project_manifest.get(project_name_prefix)
+            if entry is not None and entry['state'] in [model_factory_operations.MODELING, model_factory_operations.COMPLETED]:
+                stage_cache.put('project', project_key, entry['project_id'])
+        state_counts = {state: list(project_states.values()).count(state) for state in sorted(set(project_states.values()))}
+        print('\n{} DataRobot projects {}, manifest {}.'.format(len(projects), state_counts, project_manifest.path))
+
+    #Wait for the remaining table loads and close the Snowflake connections
+    if load:
+        snowflake_session_pool.close()
+
+    #Keep the stage cache within its size and age limits
+    if stage_cache is not None:
+        stage_cache.evict()
+
+    #Score every dataframe/deployment pair set in the config file (the buy and sell deployments by default)
+    if score:
+        from money_robot_code import datarobot_operations
+        predictions_df = datarobot_operations.score_configured_deployments(all_dataframes_dict= all_dataframes_dict, settings= settings)
+        print('\nPrediction Values: ')
+        print(predictions_df[['dataframe_name', 'deployment_id', 'predictionValues']])
+
+    #Save data locally
+    if save and app.save_format != 'csv':
+        from money_robot_code import dataset_export
+        dataset_export.write_dataset(dataset_catalog= all_dataframes_dict, directory= app.dataset_dir, file_format= app.save_format, verbose=True)
+    elif save:
+        for dataframe_name in all_dataframe_names_list:
+            selected_dataframe = all_dataframes_dict[dataframe_name]
+            selected_dataframe.to_csv('data/' + dataframe_name + '.csv')
+
+    return all_dataframes_dict
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='MoneyRobot: build, load, model and score equity datasets')
+    parser.add_argument('--config', default= settings_operations.DEFAULT_CONFIG_PATH, help='path to the config file')
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    help_strings = {'fetch': 'bring the local price store up to date',\
+        'build': 'build the features and targets of every configuration',\
+        'load': 'build, then load the tables into Snowflake',\
+        'factory': 'build, then create the DataRobot projects',\
+        'score': 'score the configured deployments',\
+        'serve': 'run the resident scoring daemon',\
+        'run': 'every step turned on in the app section of the config file (the default)'}
+    for command in COMMANDS:
+        subparser = subparsers.add_parser(command, help= help_strings[command])
+        #Accepted after the command too; SUPPRESS keeps the subparser from overwriting the value given before it
+        subparser.add_argument('--config', default= argparse.SUPPRESS, help='path to the config file')
+        if command not in ['score', 'serve']:
+            subparser.add_argument('--tickers', nargs='+', default=None, help='tickers to run, instead of data.ticker_list')
+        if command in ['factory', 'run']:
+            subparser.add_argument('--wait', action='store_true', help='wait until Autopilot is done on every project')
+        if command == 'score':
+            subparser.add_argument('--daemon', action='store_true', help='score on the running scoring daemon')
+            subparser.add_argument('--refresh', action='store_true', help='with --daemon: download new bars first')
+    return parser
+
+
+def main(argv=None) -> int:
+    '''
+    Parse the command line, load the settings and run the command
+    '''
+    arguments = build_parser().parse_args(argv)
+    command = arguments.command or 'run'
+    settings = settings_operations.load_settings(arguments.config)
+    tickers = getattr(arguments, 'tickers', None)
+    configure_instrumentation(settings)
+
+    if command == 'fetch':
+        fetch(settings, tickers= tickers)
+    elif command == 'score' and arguments.daemon:
+        print_predictions(score_with_daemon(settings, refresh= arguments.refresh))
+    elif command == 'score':
+        print_predictions(score_locally(settings))
+    elif command == 'serve':
+        from money_robot_code import scoring_daemon
+        scoring_daemon.serve(settings)
+    else:
+        app = settings.app
+        run_pipeline(settings, tickers= tickers,\
+            load= command == 'load' or (command == 'run' and app.load_data_into_snowflake),\
+            factory= command == 'factory' or (command == 'run' and app.model_factory),\
+            score= command == 'run' and app.api_scoring,\
+            backtest= settings.backtest.enabled, save= app.save_data_locally, wait_for_autopilot= getattr(arguments, 'wait', False))
+
+    print_stage_summary(settings)
+    return 0
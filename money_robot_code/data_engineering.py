@@ -4,12 +4,21 @@
 import pandas as pd
 import numpy as np 
 import datetime
+import warnings
 from datetime import date
 from dateutil.relativedelta import relativedelta
 
-#Custom Impports
-import yfinance as yf
-import ta
+#Custom Impports - yfinance and ta are imported where they're used, so runs that don't download prices or use
+#the ta engine don't pay for importing them
+from money_robot_code import indicator_engine
+from money_robot_code import quantile_engine
+from money_robot_code import schema
+from money_robot_code import instrumentation
+from money_robot_code.online_indicators import OnlineIndicatorState
+
+
+#Prefixes of every column ta adds - everything before the first of these is raw price data
+INDICATOR_PREFIXES = ('volume_', 'volatility_', 'trend_', 'momentum_', 'others_')
 
 
 def clean_dataframe_column_names(): 
@@ -19,22 +28,31 @@ def clean_dataframe_column_names():
     return None
 
 
-def pull_yahoo_data(ticker: str, verbose=True) -> pd.DataFrame:
+def pull_yahoo_data(ticker: str, verbose=True, price_store=None) -> pd.DataFrame:
     '''
     Function to get data from yahoo finance initially, and format as a dataframe. Automatically
     gets the maxiumum amount of data available for that stock. 
     args: 
         ticker: the stock ticker you want to pull data for
         verbose: choose whether to add print statements and logs
+        price_store: optional PriceStore; when given, bars are served from the local store and only
+        the bars newer than the last stored date are downloaded
     rtypes: 
-        stock_dataframe: dataframe for a given stock based on the ticker selected. Note that 
-        the date is represented by a string here for specific reasons...
+        stock_dataframe: dataframe for a given stock based on the ticker selected, with the date
+        as a naive datetime64 "Date" column
     '''
     if verbose: print('\nGetting yahoo finance data for ticker {}...'.format(ticker))
-    stock_dataframe = yf.Ticker(ticker)
-    stock_dataframe = stock_dataframe.history(period='max')
-    stock_dataframe = stock_dataframe.reset_index()
-    stock_dataframe['Date'] = stock_dataframe['Date'].astype(str)
+    with instrumentation.stage('fetch', ticker= ticker) as record:
+        if price_store is not None:
+            stock_dataframe = price_store.get(ticker)
+        else:
+            import yfinance as yf
+            stock_dataframe = yf.Ticker(ticker)
+            stock_dataframe = stock_dataframe.history(period='max')
+            stock_dataframe = stock_dataframe.reset_index()
+        record.rows, record.bytes = instrumentation.frame_size(stock_dataframe)
+    stock_dataframe = stock_dataframe.copy(deep=False)
+    stock_dataframe['Date'] = schema.normalize_dates(stock_dataframe['Date'])
     # stock_dataframe = stock_dataframe.sort_values(by='Date', ascending=False)
     stock_dataframe = stock_dataframe.reset_index(drop=True)
     if verbose: print('Data loaded into memory for ticker {}.'.format(ticker))
@@ -43,7 +61,8 @@ def pull_yahoo_data(ticker: str, verbose=True) -> pd.DataFrame:
 
 
 def create_target_feature(stock_dataframe: pd.DataFrame, shift_periods: int,\
-     move_value: float, strategy: str, verbose=True) -> pd.DataFrame:
+     move_value: float, strategy: str, verbose=True, threshold_mode='global', threshold_window=None,\
+     threshold_min_periods=None) -> pd.DataFrame:
     '''
     Create a target feature determining whether you should have 1) bought or sold today, based on...
     ...the % move a certain number of days into the future. 
@@ -52,9 +71,10 @@ def create_target_feature(stock_dataframe: pd.DataFrame, shift_periods: int,\
         move_value: what quantile the stock move needs to be in for a "buy" or "sell" signal
         strategy: whether you're trying to run a buy, sell
         verbose: choose whether to add print statements and logs
+        threshold_mode, threshold_window, threshold_min_periods: how the quantile threshold is taken, see
+        "build_target_matrix"; 'expanding' and 'rolling' don't look ahead
     rtypes: 
-        buy_dataframe: dataframe with buy target created
-        sell_dataframe: dataframe with sell target created
+        target_dataframe: copy of the dataframe with the TARGET column created for the strategy
     dependencies: 
         Requires data specifically from the "pull_yahoo_data" function, otherwise
         it will create breaking changes in the data formatting
@@ -62,42 +82,107 @@ def create_target_feature(stock_dataframe: pd.DataFrame, shift_periods: int,\
     if verbose: print('\nEngineering target variable: looking {} periods ahead for a {} quantile move...'.\
         format(shift_periods, move_value))
 
-    #Split out two dataframes, one for buying, and one for selling
-    buy_dataframe = stock_dataframe.copy()
-    sell_dataframe = stock_dataframe.copy()
+    #Engineer the target - same kernel as the batched builder, for a single configuration
+    target_matrix = build_target_matrix(close= stock_dataframe['Close'], shift_period_list= [shift_periods],\
+        move_value_list= [move_value], strategy_list= [strategy], verbose= False, threshold_mode= threshold_mode,\
+        threshold_window= threshold_window, threshold_min_periods= threshold_min_periods)
+    target_dataframe = stock_dataframe.copy()
+    target_dataframe['TARGET'] = target_matrix[(strategy, shift_periods, move_value)]
+    if verbose: print('Target variable for strategy {} has been engineered.'.format(strategy))
+    return target_dataframe
+
+
+@instrumentation.traced('targets')
+def build_target_matrix(close: pd.Series, shift_period_list: list, move_value_list: list,\
+     strategy_list: list, verbose=True, threshold_mode='global', threshold_window=None, threshold_min_periods=None) -> pd.DataFrame:
+    '''
+    Build the targets for every strategy/shift/move configuration in one pass over the close prices.
+    A forward-return matrix is computed once for all horizons, the quantile thresholds for all move
+    values are taken per horizon in a single call, and the targets are stored as nullable int8 columns.
+    args: 
+        close: close price series, oldest bar first
+        shift_period_list: how many days in the future to look, one entry per horizon
+        move_value_list: what quantiles the stock move needs to be in for a "buy" or "sell" signal
+        strategy_list: strategies to build targets for - "buy" and/or "sell"
+        verbose: choose whether to add print statements and logs
+        threshold_mode: how the move_value quantile is taken - 'global' over the whole history (the original
+        behaviour, which lets each threshold see future moves), or 'expanding' / 'rolling' over only the moves
+        already known on each day, i.e. those that ended on or before it
+        threshold_window: rolling mode only - number of known moves in the window
+        threshold_min_periods: fewest known moves a threshold needs, days with fewer get a missing target;
+        defaults to threshold_window for rolling and 20 for expanding
+    rtypes: 
+        target_matrix: dataframe with the same index as close and one Int8 column per configuration,
+        keyed by (strategy, shift_period, move_value); the last shift_period rows of each horizon are
+        missing since their future move isn't known yet
+    '''
+    if verbose: print('\nEngineering {} target variables...'.format(len(strategy_list) * len(shift_period_list) * len(move_value_list)))
+    for strategy in strategy_list: 
+        if strategy not in ('buy', 'sell'):
+            raise ValueError('Unknown strategy {}, expected "buy" or "sell"'.format(strategy))
+    if threshold_mode not in ('global', 'expanding', 'rolling'):
+        raise ValueError('Unknown threshold mode {}, expected "global", "expanding" or "rolling"'.format(threshold_mode))
+    if threshold_mode == 'rolling' and threshold_window is None:
+        raise ValueError('The rolling threshold mode needs a threshold_window')
+
+    #Forward returns for every horizon: percent_difference[i, j] = (close[i + shift_j] - close[i]) / close[i]
+    close_values = np.asarray(close, dtype=np.float64)
+    shift_periods = np.asarray(shift_period_list, dtype=np.int64)
+    later_positions = np.arange(len(close_values))[:, None] + shift_periods[None, :]
+    has_later_value = later_positions < len(close_values)
+    later_values = close_values[np.minimum(later_positions, len(close_values) - 1)]
+    percent_difference = np.where(has_later_value, (later_values - close_values[:, None]) / close_values[:, None], np.nan)
+
+    #Quantile thresholds for every (move value, horizon) pair, matching pandas' Series.quantile
+    missing = np.isnan(percent_difference)
+    if threshold_mode == 'global':
+        with warnings.catch_warnings():
+            #A horizon longer than the history has no returns at all - its thresholds (and targets) are just missing
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            move_percentages = np.nanpercentile(percent_difference, np.asarray(move_value_list, dtype=np.float64) * 100.0, axis=0)
+        move_thresholds = move_percentages.T[None, :, :]
+    else:
+        #Day i only knows the moves that ended by day i: the move starting shift_period days earlier and before
+        if threshold_min_periods is None:
+            threshold_min_periods = threshold_window if threshold_mode == 'rolling' else 20
+        move_thresholds = np.full((len(close_values), len(shift_period_list), len(move_value_list)), np.nan)
+        for shift_position, shift_period in enumerate(shift_period_list): 
+            known_moves = np.full(len(close_values), np.nan)
+            known_moves[shift_period:] = percent_difference[:len(close_values) - shift_period, shift_position]
+            move_thresholds[:, shift_position, :] = quantile_engine.rolling_quantiles(known_moves, move_value_list,\
+                window= threshold_window if threshold_mode == 'rolling' else None, min_periods= threshold_min_periods)
 
-    #Engineer the target
-    if strategy == 'buy':
-        buy_dataframe['later_value'] = buy_dataframe['Close'].shift(periods=-shift_periods)
-        buy_dataframe['percent_difference'] = ((buy_dataframe['later_value'] - buy_dataframe['Close']) / buy_dataframe['Close'])
-        move_percentage = buy_dataframe['percent_difference'].quantile(move_value)
-        buy_dataframe.loc[buy_dataframe['percent_difference'] >= move_percentage, 'TARGET'] = 1
-        buy_dataframe.loc[buy_dataframe['percent_difference'] < move_percentage, 'TARGET'] = 0
-        buy_dataframe = buy_dataframe.drop(['later_value', 'percent_difference'], axis=1)
-        if verbose: print('Target variable for strategy {} has been engineered.'.format(strategy))
-        return buy_dataframe
-        # buy_dataframe = buy_dataframe[buy_dataframe['TARGET'].notna()]
+    #Compare every horizon against all of its thresholds at once: shape (rows, horizons, move values)
+    above_threshold = percent_difference[:, :, None] >= move_thresholds
+    below_threshold = percent_difference[:, :, None] <= move_thresholds
+    missing_target = missing[:, :, None] | np.isnan(move_thresholds)
 
-    #Engineer the target
-    if strategy == 'sell':
-        sell_dataframe['later_value'] = sell_dataframe['Close'].shift(periods=-shift_periods)
-        sell_dataframe['percent_difference'] = ((sell_dataframe['later_value'] - sell_dataframe['Close']) / sell_dataframe['Close'])
-        move_percentage = sell_dataframe['percent_difference'].quantile(move_value)
-        sell_dataframe.loc[sell_dataframe['percent_difference'] > move_percentage, 'TARGET'] = 0
-        sell_dataframe.loc[sell_dataframe['percent_difference'] <= move_percentage, 'TARGET'] = 1
-        sell_dataframe = sell_dataframe.drop(['later_value', 'percent_difference'], axis=1)
-        if verbose: print('Target variable for strategy {} has been engineered.'.format(strategy))
-        return sell_dataframe
+    target_columns = {}
+    for strategy in strategy_list: 
+        strategy_targets = (above_threshold if strategy == 'buy' else below_threshold).astype(np.int8)
+        for shift_position, shift_period in enumerate(shift_period_list): 
+            for move_position, move_value in enumerate(move_value_list): 
+                target_columns[(strategy, shift_period, move_value)] = pd.arrays.IntegerArray(\
+                    strategy_targets[:, shift_position, move_position].copy(),\
+                    missing_target[:, shift_position, move_position].copy())
+    target_matrix = pd.DataFrame(target_columns, index=close.index)
+    if verbose: print('Target variables have been engineered.')
+    return target_matrix
 
 
 
 
-def engineer_technical_indicators(dataframe: pd.DataFrame, verbose=True) -> pd.DataFrame: 
+def engineer_technical_indicators(dataframe: pd.DataFrame, verbose=True, engine='ta', indicators=None,\
+     dtype='float64') -> pd.DataFrame: 
     '''
     Engineer technical indicator features for a stock dataframe.
     args: 
         dataframe: dataframe with stock data and all the relevant columns (Opoen, High, Low, Close, Volume) 
         verbose: choose whether to add prints and logs 
+        engine: 'ta' to use ta.add_all_ta_features, or 'native' to use the NumPy engine in indicator_engine,
+        which produces the same columns and values (to floating-point tolerance) many times faster
+        indicators: native engine only - list of indicator columns to compute; None computes all of them
+        dtype: native engine only - dtype of the indicator columns, e.g. 'float32'
     rtypes: 
         dataframe: dataframe with all the technical indicators as engineered features
     dependencies: 
@@ -105,11 +190,127 @@ def engineer_technical_indicators(dataframe: pd.DataFrame, verbose=True) -> pd.D
     '''
     if verbose: print('\nEngineering technical indicators...')
     #Engineer technical indicators
-    dataframe = ta.add_all_ta_features(dataframe, open="Open", high="High", low="Low",\
-         close = "Close", volume="Volume", fillna=True)
+    with instrumentation.stage('indicators', engine= engine) as record:
+        if engine == 'native':
+            indicator_dataframe = indicator_engine.compute_indicators(dataframe, indicators= indicators, dtype= dtype,\
+                open="Open", high="High", low="Low", close="Close", volume="Volume")
+            dataframe = pd.concat([dataframe, indicator_dataframe], axis=1)
+        elif engine == 'ta':
+            import ta
+            dataframe = ta.add_all_ta_features(dataframe, open="Open", high="High", low="Low",\
+                 close = "Close", volume="Volume", fillna=True)
+        else:
+            raise ValueError('Unknown indicator engine {}, expected "ta" or "native"'.format(engine))
+        record.rows, record.bytes = instrumentation.frame_size(dataframe)
     
     #Create a list of features to drop - these features weren't present for the most recent day, and thus...
     #...were not considered useful 
     if verbose: print('\nTechnical indicators created.')
     return dataframe
-    
\ No newline at end of file
+
+
+
+def build_feature_matrix(stock_dataframe: pd.DataFrame, verbose=True, engine='ta', indicators=None,\
+     dtype='float64') -> pd.DataFrame: 
+    '''
+    Build the target-independent feature matrix for a ticker: the raw price data plus every technical
+    indicator. None of the indicators depend on the target, so this is computed once per ticker and
+    each strategy/shift/move configuration only attaches its own target with "attach_target_feature".
+    args: 
+        stock_dataframe: dataframe from the "pull_yahoo_data" function
+        verbose: choose whether to add prints and logs 
+        engine, indicators: passed through to "engineer_technical_indicators"
+        dtype: float dtype of the price and indicator columns, see schema.DatasetSchema
+    rtypes: 
+        feature_dataframe: dataframe with the price data and all the technical indicators, cast to the schema
+    '''
+    feature_dataframe = engineer_technical_indicators(dataframe= stock_dataframe, verbose=verbose, engine= engine,\
+        indicators= indicators, dtype= dtype)
+    return schema.DatasetSchema(feature_dtype= dtype).apply(feature_dataframe)
+
+
+def feature_rows(price_rows: pd.DataFrame, indicator_dataframe: pd.DataFrame, dtype='float64') -> pd.DataFrame:
+    '''
+    Join price rows with their indicator rows into feature rows, in the layout and dtypes of "build_feature_matrix"
+    args:
+        price_rows: rows of the price data
+        indicator_dataframe: indicator rows of the same bars, in the same order
+        dtype: float dtype of the price and indicator columns, see schema.DatasetSchema
+    '''
+    feature_dataframe = pd.concat([price_rows, indicator_dataframe.set_axis(price_rows.index)], axis=1)
+    return schema.DatasetSchema(feature_dtype= dtype).apply(feature_dataframe)
+
+
+def update_feature_rows(ticker: str, stock_dataframe: pd.DataFrame, state_store, verbose=True, indicators=None,\
+     dtype='float64') -> pd.DataFrame: 
+    '''
+    Online version of "build_feature_matrix" for daily scoring: only the bars that aren't in the ticker's
+    saved indicator state yet are computed, and the state is saved again afterwards. The first call for a
+    ticker, or the first one after its history was re-adjusted for a split or dividend, builds the state from
+    the full history and returns the full feature matrix. When there are no new bars, the latest bar's row is
+    returned from the state, so the last row is always the one to score.
+    args: 
+        ticker: the stock ticker the dataframe belongs to
+        stock_dataframe: full price history from the "pull_yahoo_data" function
+        state_store: OnlineIndicatorStore holding the per-ticker indicator states
+        verbose: choose whether to add prints and logs 
+        indicators, dtype: native engine settings, see "engineer_technical_indicators"
+    rtypes: 
+        feature_dataframe: price data and technical indicators for the new bars (at least the latest one), same
+        layout as "build_feature_matrix"
+    '''
+    state = state_store.read(ticker)
+    if state is not None and not state.matches_history(stock_dataframe):
+        if verbose: print('\nPrice history of ticker {} was re-adjusted since its indicator state was saved.'.format(ticker))
+        state = None
+    if state is None or state.columns != OnlineIndicatorState(indicators= indicators).columns or state.dtype != dtype\
+        or getattr(state, 'last_indicators', None) is None:
+        if verbose: print('\nBuilding online indicator state for ticker {}...'.format(ticker))
+        state = OnlineIndicatorState.from_history(stock_dataframe, indicators= indicators, dtype= dtype)
+        indicator_dataframe = state.history_features
+        del state.history_features
+        price_rows = stock_dataframe
+    else:
+        if verbose: print('\nUpdating online indicator state for ticker {}...'.format(ticker))
+        #matches_history checked that the state's bars are the first bar_count rows
+        indicator_dataframe = state.update(stock_dataframe.iloc[state.bar_count:])
+        price_rows = stock_dataframe.loc[indicator_dataframe.index]
+        if len(indicator_dataframe) == 0:
+            #Already at the last bar - serve its row again
+            indicator_dataframe = state.last_indicators
+            price_rows = stock_dataframe.iloc[state.bar_count - 1:state.bar_count]
+    state_store.write(ticker, state)
+    feature_dataframe = feature_rows(price_rows, indicator_dataframe, dtype= dtype)
+    if verbose: print('{} feature rows for ticker {}.'.format(len(feature_dataframe), ticker))
+    return feature_dataframe
+
+
+def attach_target_feature(feature_dataframe: pd.DataFrame, shift_periods: int,\
+     move_value: float, strategy: str, target_matrix=None, verbose=True, copy=True) -> pd.DataFrame: 
+    '''
+    Attach the target for one configuration to a feature matrix from "build_feature_matrix". The
+    TARGET column is placed between the price data and the indicators, the same layout you get from
+    running "create_target_feature" and then "engineer_technical_indicators".
+    args: 
+        feature_dataframe: dataframe from the "build_feature_matrix" function - it is not modified
+        shift_periods: how many days in the future you want to look to determine what to do today
+        move_value: what quantile the stock move needs to be in for a "buy" or "sell" signal
+        strategy: whether you're trying to run a buy, sell
+        target_matrix: optional output of "build_target_matrix" for this ticker; when given the target
+        is taken from it instead of being computed again from the Close column (kept at float64 by the schema)
+        verbose: choose whether to add prints and logs 
+        copy: set to False to share the feature columns with feature_dataframe instead of copying them
+    rtypes: 
+        dataframe: copy of the feature matrix with the TARGET column added
+    '''
+    if target_matrix is None:
+        target_matrix = build_target_matrix(close= feature_dataframe['Close'], shift_period_list= [shift_periods],\
+            move_value_list= [move_value], strategy_list= [strategy], verbose= verbose)
+    indicator_positions = [position for position, column in enumerate(feature_dataframe.columns)\
+        if column.startswith(INDICATOR_PREFIXES)]
+    target_position = indicator_positions[0] if indicator_positions else len(feature_dataframe.columns)
+    #A shallow copy keeps the feature blocks shared - insert adds the target as a block of its own
+    dataframe = feature_dataframe.copy(deep= copy)
+    dataframe.insert(loc= target_position, column= 'TARGET',\
+        value= target_matrix[(strategy, shift_periods, move_value)].astype('Int8', copy=False))
+    return dataframe
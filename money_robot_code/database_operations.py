@@ -1,102 +1,417 @@
-import numpy as np
+import os
+import atexit
+import queue
+import pickle
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
-import yaml
-import snowflake.connector as snow
-from snowflake.connector.pandas_tools import write_pandas  
-from snowflake.connector.pandas_tools import pd_writer
+
+#Custom imports
+from money_robot_code import schema
+from money_robot_code import instrumentation
+from money_robot_code import settings as settings_operations
+
+
+#Keys of the "snowflake" section of config.yaml that are passed to snowflake.connector.connect
+SNOWFLAKE_SETTINGS = ['account', 'user', 'password', 'warehouse', 'database', 'schema', 'role']
+
+#Session pool used by create_table when the caller doesn't pass one
+_default_session_pool = None
+_default_session_pool_lock = threading.Lock()
+
+
+def load_snowflake_settings(config_path: str = 'config.yaml') -> dict:
+    '''
+    Snowflake connection settings from the config file, which settings.load_settings reads once per process
+    args:
+        config_path: path to the config file
+    rtypes:
+        settings: dict of keyword arguments for snowflake.connector.connect
+    '''
+    return settings_operations.load_settings(config_path).require('snowflake').snowflake.connect_settings()
+
+
+class SnowflakeSessionPool:
+    '''
+    Pool of open Snowflake connections shared by every table load. Connections are opened on first use
+    and handed back to the pool after each load instead of being thrown away, at most max_connections
+    are in use at once, and everything is closed by close() (or when the pool is used as a context manager).
+    Loads can also be queued with submit, which runs them on max_connections background threads.
+    args:
+        settings: keyword arguments for connector.connect; defaults to the "snowflake" section of config.yaml
+        connector: object with a connect(**settings) method, e.g. sqlite_connector.SQLiteConnector to run
+        without Snowflake; defaults to snowflake.connector
+        max_connections: most connections open at the same time, which also bounds concurrent loads
+        verbose: choose whether to add prints or logs
+    '''
+
+    def __init__(self, settings: dict = None, connector=None, max_connections: int = 4, verbose=True):
+        if connector is None:
+            import snowflake.connector
+            connector = snowflake.connector
+        self.settings = settings if settings is not None else load_snowflake_settings()
+        self.connector = connector
+        self.max_connections = max_connections
+        self.verbose = verbose
+        self.idle_connections = queue.LifoQueue()
+        self.open_connections = []
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(max_connections)
+        self.executor = None
+        self.futures = []
+        self.closed = False
+
+    def _connect(self):
+        if self.verbose: print('\nSetting up Snowflake connection...')
+        connection = self.connector.connect(**self.settings)
+        with self.lock:
+            self.open_connections.append(connection)
+        if self.verbose: print('Connection established.')
+        return connection
+
+    def _discard(self, connection) -> None:
+        with self.lock:
+            if connection in self.open_connections:
+                self.open_connections.remove(connection)
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    @contextlib.contextmanager
+    def connection(self):
+        '''
+        Check a connection out of the pool for the duration of a with block. Blocks while max_connections
+        are already checked out.
+        '''
+        if self.closed:
+            raise RuntimeError('The Snowflake session pool has been closed')
+        self.slots.acquire()
+        try:
+            try:
+                connection = self.idle_connections.get_nowait()
+            except queue.Empty:
+                connection = self._connect()
+            try:
+                yield connection
+            finally:
+                #A connection that was closed underneath us (network drop, session expiry) is not reused
+                is_closed = getattr(connection, 'is_closed', None)
+                if self.closed or (is_closed is not None and is_closed()):
+                    self._discard(connection)
+                else:
+                    self.idle_connections.put(connection)
+        finally:
+            self.slots.release()
+
+    def write_pandas(self, connection, df: pd.DataFrame, table_name: str):
+        '''
+        Bulk load a dataframe into an existing table, with the connector's own write_pandas if it has one
+        '''
+        writer = getattr(self.connector, 'write_pandas', None)
+        if writer is None:
+            from snowflake.connector.pandas_tools import write_pandas as writer
+        with instrumentation.stage('write_pandas', table= table_name) as record:
+            record.rows, record.bytes = instrumentation.frame_size(df)
+            return writer(connection, df, table_name)
+
+    def submit(self, function, *args, **kwargs):
+        '''
+        Run function(*args, **kwargs) on one of the pool's load threads; errors are raised by wait()
+        '''
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.max_connections, thread_name_prefix='snowflake-load')
+        future = self.executor.submit(function, *args, **kwargs)
+        self.futures.append(future)
+        return future
+
+    def wait(self) -> None:
+        '''
+        Wait for every submitted load to finish, raising the first error if any of them failed
+        '''
+        futures, self.futures = self.futures, []
+        errors = [future.exception() for future in futures]
+        errors = [error for error in errors if error is not None]
+        if errors:
+            raise errors[0]
+
+    def close(self) -> None:
+        '''
+        Wait for queued loads and close every connection. Safe to call more than once.
+        '''
+        if self.closed:
+            return
+        try:
+            self.wait()
+        finally:
+            self.closed = True
+            if self.executor is not None:
+                self.executor.shutdown(wait=True)
+            with self.lock:
+                connections, self.open_connections = self.open_connections, []
+            for connection in connections:
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+            if self.verbose and connections: print('\nClosed {} Snowflake connection(s).'.format(len(connections)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def get_session_pool() -> SnowflakeSessionPool:
+    '''
+    Session pool used by create_table when none is passed in: created from config.yaml on first use and
+    closed when the interpreter exits
+    '''
+    global _default_session_pool
+    with _default_session_pool_lock:
+        if _default_session_pool is None or _default_session_pool.closed:
+            _default_session_pool = SnowflakeSessionPool()
+            atexit.register(_default_session_pool.close)
+    return _default_session_pool
 
 
 def get_col_types(df: pd.DataFrame, verbose= True) -> str:
     '''
-        Helper function to create/modify Snowflake tables; gets the column and dtype pair for each item in the dataframe
+        Helper function to create/modify Snowflake tables; gets the column and Snowflake type pair for each column
+        in the dataframe, using the fixed dtype -> type mapping in schema.ddl_type
         
         args:
             df: dataframe to evaluate
             verbose: choose whether to add prints or logs
     '''    
-    # get dtypes and convert to df
-    ct = df.dtypes.reset_index().rename(columns={0:'col'})
-    ct = ct.apply(lambda x: x.astype(str).str.upper()) # case matching as snowflake needs it in uppers
-        
-    # only considers objects at this point
-    # only considers objects and ints at this point
-    ct['col'] = np.where(ct['col']=='OBJECT', 'VARCHAR', ct['col'])
-    ct['col'] = np.where(ct['col'].str.contains('DATE'), 'VARCHAR', ct['col'])
-    ct['col'] = np.where(ct['col'].str.contains('INT'), 'NUMERIC', ct['col'])
-    ct['col'] = np.where(ct['col'].str.contains('FLOAT'), 'FLOAT', ct['col'])
-    
-    # get the column dtype pair
-    l = []
-    for index, row in ct.iterrows():
-        l.append(row['index'] + ' ' + row['col'])
-    string = ', '.join(l) # convert from list to a string object
-    string = string.strip()
-    
-    return string
-
-
-def create_table(table: str, action: str, col_type: str, df: pd.DataFrame, verbose=True) -> None:
-    '''
-        Function to create/replace and append to tables in Snowflake
+    return schema.col_types(df)
+
+
+def schema_fingerprint(col_type: str) -> str:
+    '''
+    Fingerprint of a table schema string from get_col_types() and the schema version - Snowflake folds unquoted
+    names to upper case, so the fingerprint does too
+    '''
+    return schema.fingerprint(col_type)
+
+
+def hash_rows(df: pd.DataFrame, key_column: str) -> pd.Series:
+    '''
+    One 64-bit hash per row of the dataframe, indexed by the row's key - used to find the rows that changed
+    since the last load
+    '''
+    return pd.Series(pd.util.hash_pandas_object(df, index=False).to_numpy(), index=df[key_column].to_numpy())
+
+
+class TableLoadStateStore:
+    '''
+    On-disk record of what was last loaded into each Snowflake table: the schema fingerprint and the hash of
+    every row, by key. Incremental loads compare against it to send only new or changed rows.
+    args:
+        directory: folder holding <table>.pkl files
+    '''
+
+    def __init__(self, directory: str = 'data/load_state'):
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, table: str) -> str:
+        return os.path.join(self.directory, table.upper() + '.pkl')
+
+    def read(self, table: str):
+        '''
+        Read the load state of a table as a dict with "fingerprint" and "row_hashes" (key -> hash), or None
+        '''
+        if not os.path.exists(self.path(table)):
+            return None
+        with open(self.path(table), 'rb') as state_file:
+            return pickle.load(state_file)
+
+    def write(self, table: str, fingerprint: str, row_hashes: pd.Series) -> None:
+        #Write to a temp file and swap it in, so an interrupted run never leaves a truncated file
+        temp_path = self.path(table) + '.tmp'
+        with open(temp_path, 'wb') as state_file:
+            pickle.dump({'fingerprint': fingerprint, 'row_hashes': row_hashes}, state_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self.path(table))
+
+    def delete(self, table: str) -> None:
+        if os.path.exists(self.path(table)):
+            os.remove(self.path(table))
+
+
+def insert_rows(cur, table: str, df: pd.DataFrame, chunk_size: int = 16384) -> int:
+    '''
+    Append a dataframe to a table as parameter-bound INSERT batches of at most chunk_size rows
+    args:
+        cur: open cursor
+        table: name of the table to append to
+        df: dataframe with the table's columns, in table order
+        chunk_size: rows per executemany call
+    rtypes:
+        row_count: number of rows sent
+    '''
+    statement = 'INSERT INTO {} ({}) VALUES ({})'.format(table, ', '.join(df.columns), ', '.join(['%s'] * len(df.columns)))
+    for chunk_start in range(0, len(df), chunk_size):
+        chunk = df.iloc[chunk_start:chunk_start + chunk_size]
+        #Plain Python values, with None for missing - what the DB-API binds as NULL
+        rows = chunk.astype(object).where(chunk.notna(), None).values.tolist()
+        cur.executemany(statement, rows)
+    return len(df)
+
+
+def _table_row_count(cur, table: str):
+    #None when the table doesn't exist - any other error is the caller's to see
+    cur.execute("SHOW TABLES LIKE '{}'".format(table.upper()))
+    #LIKE treats "_" as a wildcard - keep the exact name only; SHOW TABLES has the name in its second column
+    if not any(row[1].upper() == table.upper() for row in cur.fetchall()):
+        return None
+    cur.execute('SELECT COUNT(*) FROM {}'.format(table))
+    return cur.fetchone()[0]
+
+
+def get_table_row_count(table: str, session_pool=None):
+    '''
+    Number of rows in a table, or None when it doesn't exist (it was never created, or was dropped)
+    args:
+        table: name of the table
+        session_pool: SnowflakeSessionPool to run on; defaults to the module's shared pool
+    '''
+    if session_pool is None:
+        session_pool = get_session_pool()
+    with session_pool.connection() as conn:
+        cur = conn.cursor()
+        try:
+            return _table_row_count(cur, table)
+        finally:
+            cur.close()
+
+
+def build_merge_statement(table: str, stage_table: str, columns: list, key_column: str) -> str:
+    '''
+    MERGE that upserts every row of stage_table into table, matching rows on key_column
+    '''
+    update_columns = [column for column in columns if column != key_column]
+    return ('MERGE INTO {table} USING {stage} ON {table}.{key} = {stage}.{key}'
+        ' WHEN MATCHED THEN UPDATE SET {updates}'
+        ' WHEN NOT MATCHED THEN INSERT ({columns}) VALUES ({values})').format(table= table, stage= stage_table,\
+        key= key_column, updates= ', '.join('{}.{} = {}.{}'.format(table, column, stage_table, column) for column in update_columns),\
+        columns= ', '.join(columns), values= ', '.join('{}.{}'.format(stage_table, column) for column in columns))
+
+
+def _merge_rows(cur, table: str, col_type: str, df: pd.DataFrame, key_column: str, chunk_size: int) -> None:
+    #Stage the rows in a session-scoped table next to the target, then upsert them in one statement
+    stage_table = table + '_STAGE'
+    cur.execute('CREATE OR REPLACE TEMPORARY TABLE ' + stage_table + '(' + col_type + ')')
+    try:
+        insert_rows(cur, stage_table, df, chunk_size= chunk_size)
+        cur.execute(build_merge_statement(table= table, stage_table= stage_table, columns= list(df.columns), key_column= key_column))
+    finally:
+        cur.execute('DROP TABLE IF EXISTS ' + stage_table)
+
+
+def _delete_keys(cur, table: str, key_column: str, keys: list, chunk_size: int) -> None:
+    for chunk_start in range(0, len(keys), chunk_size):
+        chunk = keys[chunk_start:chunk_start + chunk_size]
+        cur.execute('DELETE FROM {} WHERE {} IN ({})'.format(table, key_column, ', '.join(['%s'] * len(chunk))), chunk)
+
+
+def create_table(table: str, action: str, col_type: str, df: pd.DataFrame, verbose=True, session_pool=None,\
+     load_state=None, key_column='DATE', chunk_size=16384) -> None:
+    '''
+        Function to create/replace, append to, or incrementally merge into tables in Snowflake
         
         args:
             table: name of the table to create/modify
-            action: whether do the initial create/replace or appending; key to control logic
+            action: whether do the initial create/replace, appending, or an incremental merge; key to control logic
             col_type: string with column name associated dtype, each pair separated by a comma; comes from get_col_types() func
             df: dataframe to load
             verbose: choose whether to add prints or logs
+            session_pool: SnowflakeSessionPool to take the connection from; defaults to a shared pool built from config.yaml
+            load_state: TableLoadStateStore, required for merge - records the schema and row hashes of the last load
+            key_column: column that identifies a row for merge
+            chunk_size: rows per bound INSERT batch for append and merge
             
         dependencies: function get_col_types(); helper function to get the col and dtypes to create a table
     '''
-    #Load config settings 
-    with open("config.yaml", "r") as ymlfile:
-        config = yaml.safe_load(ymlfile)
-    account = config['snowflake']['account']
-    user = config['snowflake']['user']
-    password = config['snowflake']['password']
-    warehouse = config['snowflake']['warehouse']
-    database = config['snowflake']['database']
-    schema = config['snowflake']['schema']
-    role = config['snowflake']['role']
-
-    # set up connection
-    conn = snow.connect(
-               account = account,
-               user = user,
-               password = password,
-               warehouse = warehouse,
-               database = database,
-               schema = schema,
-               role = role)    
-    # set up cursor
-    if verbose: print('\nSetting up Snowflake connection...')
-    cur = conn.cursor()
-    if verbose: print('Connection established.')
-
-    if action=='create_replace':
-        # set up execute
-        if verbose: print('Creating table {} using {} operation...'.format(table, action))
-        cur.execute(
-            """ CREATE OR REPLACE TABLE 
-            """ + table +"""(""" + col_type + """)""") 
-
-        #prep to ensure proper case
-        df.columns = [col.upper() for col in df.columns]
-
-        # write df to table
-        write_pandas(conn, df, table.upper())
-        if verbose: print('Table created.')
-        
-    elif action=='append':
-        # convert to a string list of tuples
-        df = str(list(df.itertuples(index=False, name=None)))
-        # get rid of the list elements so it is a string tuple list
-        df = df.replace('[','').replace(']','')
-        if verbose: print('Creating table {} using {} operation...'.format(table, action))
-        # set up execute
-        cur.execute(
-            """ INSERT INTO """ + table + """
-                VALUES """ + df + """
-
-            """) 
-        if verbose: print('Table created.')
+    with instrumentation.stage('snowflake_load', table= table, action= action) as record:
+        record.rows, record.bytes = instrumentation.frame_size(df)
+        _create_table(table, action, col_type, df, verbose, session_pool, load_state, key_column, chunk_size)
+
+
+def _create_table(table: str, action: str, col_type: str, df: pd.DataFrame, verbose, session_pool, load_state,\
+     key_column, chunk_size) -> None:
+    if session_pool is None:
+        session_pool = get_session_pool()
+    if action not in ['create_replace', 'append', 'merge']:
+        raise ValueError('Unknown table action {}, expected "create_replace", "append" or "merge"'.format(action))
+    if action == 'merge' and load_state is None:
+        raise ValueError('The merge action needs a TableLoadStateStore')
+
+    with session_pool.connection() as conn:
+        # set up cursor
+        cur = conn.cursor()
+        try:
+            if action!='append':
+                #prep to ensure proper case - on a shallow copy, the caller's frame may be loaded by other threads too
+                df = df.copy(deep=False)
+                df.columns = [col.upper() for col in df.columns]
+            #Dates go to Snowflake as DATE values
+            df = schema.to_load_frame(df)
+            if load_state is not None:
+                row_hashes = hash_rows(df, key_column= key_column)
+
+            if action=='merge':
+                fingerprint = schema_fingerprint(col_type)
+                state = load_state.read(table)
+                if state is not None and state['fingerprint'] == fingerprint:
+                    #Same schema as the last load - no DDL, only send the rows that are new or changed
+                    previous_hashes = state['row_hashes']
+                    known = row_hashes.index.isin(previous_hashes.index)
+                    changed = ~known
+                    changed[known] = previous_hashes.loc[row_hashes.index[known]].to_numpy() != row_hashes.to_numpy()[known]
+                    changed_rows = df[changed]
+                    removed_keys = previous_hashes.index[~previous_hashes.index.isin(row_hashes.index)].tolist()
+                    #A merge only sends differences, so the table must still hold the rows we loaded last time
+                    row_count = _table_row_count(cur, table)
+                    if row_count != len(previous_hashes):
+                        #Dropped, or changed outside the pipeline - rebuild it
+                        if verbose: print('Table {} has {} rows, expected {}, recreating it.'.format(table,\
+                            'no' if row_count is None else row_count, len(previous_hashes)))
+                        load_state.delete(table)
+                        action = 'create_replace'
+                    else:
+                        if verbose: print('Merging {} new or changed rows into table {} ({} removed)...'.format(len(changed_rows), table, len(removed_keys)))
+                        if len(changed_rows) > 0:
+                            _merge_rows(cur, table= table, col_type= col_type, df= changed_rows, key_column= key_column, chunk_size= chunk_size)
+                        if removed_keys:
+                            _delete_keys(cur, table= table, key_column= key_column, keys= removed_keys, chunk_size= chunk_size)
+                        load_state.write(table, fingerprint, row_hashes)
+                        if verbose: print('Table merged.')
+                        return
+                else:
+                    #First load, or the schema changed - the table has to be rebuilt
+                    action = 'create_replace'
+
+            if action=='create_replace':
+                # set up execute
+                if verbose: print('Creating table {} using {} operation...'.format(table, action))
+                cur.execute(
+                    """ CREATE OR REPLACE TABLE 
+                    """ + table +"""(""" + col_type + """)""") 
+
+                # write df to table
+                session_pool.write_pandas(conn, df, table.upper())
+                if load_state is not None:
+                    load_state.write(table, schema_fingerprint(col_type), row_hashes)
+                if verbose: print('Table created.')
+                
+            elif action=='append':
+                if verbose: print('Creating table {} using {} operation...'.format(table, action))
+                # send the rows as bound batches rather than one giant SQL literal
+                insert_rows(cur, table, df, chunk_size= chunk_size)
+                if verbose: print('Table created.')
+        finally:
+            cur.close()
@@ -1,10 +1,61 @@
 
-import datarobot as dr
 import pandas as pd
-import yaml
 import datetime
-import requests
-from yaml.loader import Loader
+import dataclasses
+from money_robot_code.scoring_client import PredictionClient, DEFAULT_API_URL, prepare_scoring_frame
+from money_robot_code import instrumentation
+from money_robot_code import settings as settings_operations
+
+
+def get_scoring_client(settings, verbose=True) -> PredictionClient:
+    '''
+    Build a PredictionClient from the config file settings
+    args: 
+        settings: settings.Settings with the datarobot_settings and datarobot_api_scoring_settings sections
+        verbose: Add useful prints and logs to the code
+    rtypes: 
+        client: PredictionClient
+    '''
+    settings.require('datarobot_settings', 'datarobot_api_scoring_settings')
+    scoring_settings = settings.scoring
+    return PredictionClient(token= settings.datarobot.token,\
+        api_url= scoring_settings.api_url or DEFAULT_API_URL,\
+        max_concurrency= scoring_settings.max_concurrency,\
+        max_retries= scoring_settings.max_retries,\
+        backoff= scoring_settings.backoff,\
+        max_rows_per_batch= scoring_settings.max_rows_per_batch,\
+        payload_format= scoring_settings.payload_format,\
+        timeout= scoring_settings.timeout, verbose= verbose)
+
+
+def get_scoring_jobs(settings) -> list:
+    '''
+    The (dataframe name, deployment id, deployment key) triples to score. They come from the "jobs" list of
+    the datarobot_api_scoring_settings section, or from its buy_/sell_ keys when there is no list.
+    '''
+    settings.require('datarobot_api_scoring_settings')
+    return [(job.dataframe_name, job.deployment_id, job.deployment_key) for job in settings.scoring.jobs]
+
+
+def score_configured_deployments(all_dataframes_dict: dict, settings=None, client=None, verbose=True) -> pd.DataFrame:
+    '''
+    Score every (dataframe, deployment) pair from the config file concurrently
+    args: 
+        all_dataframes_dict: an output from running the loop prior
+        settings: settings.Settings; loaded from config.yaml when not given
+        client: PredictionClient to use; built from the settings when not given
+        verbose: Add useful prints and logs to the code
+    rtypes: 
+        predictions_df: API responses of every pair, with dataframe_name and deployment_id columns
+    '''
+    if settings is None:
+        settings = settings_operations.load_settings()
+    jobs = [(dataframe_name, prepare_scoring_frame(all_dataframes_dict[dataframe_name]), deployment_id, deployment_key)\
+        for dataframe_name, deployment_id, deployment_key in get_scoring_jobs(settings)]
+    if client is None:
+        with get_scoring_client(settings, verbose= verbose) as client:
+            return client.score_many(jobs)
+    return client.score_many(jobs)
 
 
 def score_buy_and_sell_strategies(all_dataframes_dict: dict):
@@ -20,93 +71,34 @@ def score_buy_and_sell_strategies(all_dataframes_dict: dict):
         
     '''
 
-    with open("config.yaml", "r") as ymlfile:
-        config = yaml.safe_load(ymlfile)
-
-    strategy_list = config['data']['strategy_list']
+    settings = settings_operations.load_settings().require('datarobot_api_scoring_settings')
 
     #Get configuration settings
-    datarobot_endpoint = config['datarobot_settings']['endpoint']
-    datarobot_token = config['datarobot_settings']['token'] 
-    buy_dataframe_name_str= config['datarobot_api_scoring_settings']['buy_dataframe_name']
-    buy_deployment_id_str= config['datarobot_api_scoring_settings']['buy_deployment_id']
-    buy_deployment_key_str= config['datarobot_api_scoring_settings']['buy_deployment_key']
-    sell_dataframe_name_str= config['datarobot_api_scoring_settings']['sell_dataframe_name']
-    sell_deployment_id_str= config['datarobot_api_scoring_settings']['sell_deployment_id']
-    sell_deployment_key_str= config['datarobot_api_scoring_settings']['sell_deployment_key']
-
-    #Get dataframes to score
-    buy_df = all_dataframes_dict[buy_dataframe_name_str]
-    sell_df = all_dataframes_dict[sell_dataframe_name_str]
-
-    buy_df = buy_df.rename(columns={'Stock Splits': 'STOCK_SPLITS'})
-    sell_df = sell_df.rename(columns={'Stock Splits': 'STOCK_SPLITS'})
-    buy_df.columns = [col.upper() for col in buy_df.columns]
-    sell_df.columns = [col.upper() for col in sell_df.columns]
-
-
-    #Convert data to JSON 
-    buy_data = buy_df.to_json(orient='records')
-
-    #API Information
-    API_URL = 'https://cfds-ccm-prod.orm.datarobot.com/predApi/v1.0/deployments/{deployment_id}/predictions'    # noqa
-    url = API_URL.format(deployment_id=buy_deployment_id_str)
-    headers = {
-        'Authorization': 'Bearer {}'.format(datarobot_token),
-        'Content-Type': "application/json; charset=UTF-8",
-        'DataRobot-Key': buy_deployment_key_str,
-    }
-    params = {}
-
-    #Response Information
-    response = requests.post(
-            url, data=buy_data, headers=headers,)
-    response_object = response.json()
-    response_df = pd.json_normalize(response.json()["data"])
-    buy_response_df = response_df
+    strategy_jobs = settings.scoring.strategy_jobs
+    missing_strategies = [strategy for strategy in ['buy', 'sell'] if strategy not in strategy_jobs]
+    if missing_strategies:
+        raise ValueError('datarobot_api_scoring_settings has no {} job'.format(' or '.join(missing_strategies)))
+    settings = dataclasses.replace(settings, scoring= dataclasses.replace(settings.scoring,\
+        jobs= [strategy_jobs['buy'], strategy_jobs['sell']]))
+
+    #Score both deployments at once, on one session
+    predictions_df = score_configured_deployments(all_dataframes_dict= all_dataframes_dict, settings= settings)
+    buy_response_df = predictions_df[(predictions_df['dataframe_name'] == strategy_jobs['buy'].dataframe_name)\
+        & (predictions_df['deployment_id'] == strategy_jobs['buy'].deployment_id)]
+    sell_response_df = predictions_df[(predictions_df['dataframe_name'] == strategy_jobs['sell'].dataframe_name)\
+        & (predictions_df['deployment_id'] == strategy_jobs['sell'].deployment_id)]
+    buy_response_df = buy_response_df.drop(columns=['dataframe_name', 'deployment_id']).reset_index(drop=True)
+    sell_response_df = sell_response_df.drop(columns=['dataframe_name', 'deployment_id']).reset_index(drop=True)
 
     #Print response information 
-    print('\nBUY API RESPONSE')
-    print('\nResponse Content: ')
-    print(response.content)
-    print('\nPrediction Values: ')
-    print(print(response_df['predictionValues'][0]))
-
-    #Convert data to JSON
-    sell_data = sell_df.to_json(orient='records')
-
-    #API Information
-    API_URL = 'https://cfds-ccm-prod.orm.datarobot.com/predApi/v1.0/deployments/{deployment_id}/predictions'    # noqa
-    url = API_URL.format(deployment_id=sell_deployment_id_str)
-    headers = {
-        'Authorization': 'Bearer {}'.format(datarobot_token),
-        'Content-Type': "application/json; charset=UTF-8",
-        'DataRobot-Key': sell_deployment_key_str,
-    }
-    params = {}
-
-    #Response Information
-    response = requests.post(
-            url, data=sell_data, headers=headers, params = params
-        )
-    response_object = response.json()
-    response_df = pd.json_normalize(response.json()["data"])
-    sell_response_df = response_df
-
-    #Print response information
-    print('\nSELL API RESPONSE')
-    print('\nResponse Content: ')
-    print(response.content)
-    print('\nPrediction Values: ')
-    print(print(response_df['predictionValues'][0]))
+    for strategy_string, response_df in [('BUY', buy_response_df), ('SELL', sell_response_df)]:
+        print('\n{} API RESPONSE'.format(strategy_string))
+        print('\nPrediction Values: ')
+        print(response_df['predictionValues'][0])
 
     return buy_response_df, sell_response_df
 
 
-
-
-
-
 def run_datarobot_model_factory(dataframe: pd.DataFrame, project_name_prefix: str, verbose=True): 
     '''
     Run the DataRobot model factory within a loop to create multiple projects
@@ -135,8 +127,12 @@ def run_datarobot_model_factory(dataframe: pd.DataFrame, project_name_prefix: st
     #SET OUT OF TIME VALIDATION, 20 BACKTESTS, 30 DAYS EACH
 
 
-    temp_project = dr.Project.create(dataframe,\
-            project_name = project_name)
-    temp_project.set_target(target = 'TARGET', worker_count = -1)
+    import datarobot as dr
+    with instrumentation.stage('project_create', project= project_name_prefix) as record:
+        record.rows, record.bytes = instrumentation.frame_size(dataframe)
+        temp_project = dr.Project.create(dataframe,\
+                project_name = project_name)
+    with instrumentation.stage('set_target', project= project_name_prefix):
+        temp_project.set_target(target = 'TARGET', worker_count = -1)
 
     return None 
\ No newline at end of file
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+#Core libraries
+from collections.abc import Mapping
+import pandas as pd
+
+#Custom imports
+from money_robot_code import data_engineering
+from money_robot_code import pipeline
+
+
+'''
+Catalog of the training and testing dataframes of a run. It holds one feature matrix and one target matrix
+per ticker and resolves the _TRAIN/_TEST table names on demand, so memory grows with the number of tickers
+rather than with the size of the configuration grid. The dataframes it hands out share their feature columns
+with the ticker's feature matrix - only the TARGET column is new - so they should be treated as read-only, and
+nothing is kept once the caller is done with them.
+'''
+
+
+TRAIN = 'TRAIN'
+TEST = 'TEST'
+
+
+class DatasetCatalog(Mapping):
+    '''
+    Read-only dict of table name -> dataframe, with the same names and dataframes main.py used to keep in
+    all_dataframes_dict
+    args:
+        table_prefix: prefix of every table name
+        strategy_list, shift_period_list, move_value_list: the configuration grid
+        upper_case_columns: upper-case the column names of every dataframe, the layout Snowflake tables use
+    '''
+
+    def __init__(self, table_prefix: str, strategy_list: list, shift_period_list: list, move_value_list: list,\
+         upper_case_columns=False):
+        self.table_prefix = table_prefix
+        self.strategy_list = strategy_list
+        self.shift_period_list = shift_period_list
+        self.move_value_list = move_value_list
+        self.upper_case_columns = upper_case_columns
+        self.feature_dataframes = {}
+        self.target_matrices = {}
+        #Table name -> (ticker, strategy, shift_period, move_value, split), in the order the names were added
+        self.names = {}
+
+    def add_ticker(self, ticker: str, feature_dataframe: pd.DataFrame, target_matrix: pd.DataFrame) -> list:
+        '''
+        Register every configuration of a ticker. Adding a ticker again replaces its data.
+        args:
+            ticker: ticker symbol
+            feature_dataframe: output of data_engineering.build_feature_matrix
+            target_matrix: output of data_engineering.build_target_matrix for the same ticker
+        rtypes:
+            names: the ticker's table names, training table then testing table for each configuration
+        '''
+        self.feature_dataframes[ticker] = feature_dataframe
+        self.target_matrices[ticker] = target_matrix
+        names = []
+        for strategy, shift_period, move_value in pipeline.iterate_configurations(strategy_list= self.strategy_list,\
+            shift_period_list= self.shift_period_list, move_value_list= self.move_value_list):
+            for split in [TRAIN, TEST]:
+                name = pipeline.table_name(table_prefix= self.table_prefix, ticker= ticker, strategy= strategy,\
+                    shift_period= shift_period, move_value= move_value, split= split)
+                self.names[name] = (ticker, strategy, shift_period, move_value, split)
+                names.append(name)
+        return names
+
+    def resolve(self, name: str) -> tuple:
+        '''
+        Configuration of a table name, as (ticker, strategy, shift_period, move_value, split)
+        '''
+        return self.names[name]
+
+    def __getitem__(self, name: str) -> pd.DataFrame:
+        ticker, strategy, shift_period, move_value, split = self.names[name]
+        stock_dataframe = data_engineering.attach_target_feature(feature_dataframe= self.feature_dataframes[ticker],\
+            shift_periods= shift_period, move_value= move_value, strategy= strategy,\
+            target_matrix= self.target_matrices[ticker], verbose=False, copy=False)
+
+        #Create the training or testing dataframe - a shallow copy of the slice, so it is a frame of its own
+        #that still shares its data
+        if split == TRAIN:
+            dataframe = stock_dataframe.iloc[shift_period:].copy(deep=False)
+            dataframe.index = pd.RangeIndex(len(dataframe))
+        else:
+            dataframe = stock_dataframe.iloc[:1].copy(deep=False)
+
+        columns = ['STOCK_SPLITS' if column == 'Stock Splits' else column for column in dataframe.columns]
+        if self.upper_case_columns:
+            columns = [column.upper() for column in columns]
+        dataframe.columns = columns
+        return dataframe
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, name) -> bool:
+        return name in self.names
+
+    def memory_usage(self) -> int:
+        '''
+        Bytes held by the catalog: the feature and target matrices of every ticker
+        '''
+        return sum(int(dataframe.memory_usage(index=True, deep=True).sum())\
+            for dataframes in [self.feature_dataframes, self.target_matrices] for dataframe in dataframes.values())
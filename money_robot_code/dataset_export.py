@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+#Core libraries
+import os
+import json
+import shutil
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.feather as feather
+
+#Custom imports
+from money_robot_code.dataset_catalog import DatasetCatalog
+from money_robot_code import instrumentation
+
+
+'''
+Columnar export of a DatasetCatalog. Each ticker's feature matrix is written once and each configuration's
+target once, as a hive-partitioned dataset:
+
+    <directory>/features/ticker=<ticker>/part-0.<ext>
+    <directory>/targets/ticker=<ticker>/strategy=<strategy>/shift=<shift>/move=<move>/part-0.<ext>
+    <directory>/dataset.json
+
+dataset.json records the configuration grid and every table name, so the _TRAIN/_TEST dataframes can be
+rebuilt from the files exactly as the catalog built them. Files are read memory-mapped and only the requested
+columns are loaded.
+'''
+
+
+#Bump when the layout changes, so old exports are rejected instead of misread
+DATASET_FORMAT_VERSION = 1
+
+FILE_FORMATS = {'parquet': 'parquet', 'feather': 'arrow'}
+
+#Parquet is compressed with zstd; Feather is left uncompressed by default so reads can map the file without
+#decoding it
+DEFAULT_COMPRESSION = {'parquet': 'zstd', 'feather': 'uncompressed'}
+
+
+def _feature_path(directory: str, ticker: str, extension: str) -> str:
+    return os.path.join(directory, 'features', 'ticker={}'.format(ticker), 'part-0.' + extension)
+
+
+def _target_path(directory: str, ticker: str, strategy: str, shift_period: int, move_value: float, extension: str) -> str:
+    return os.path.join(directory, 'targets', 'ticker={}'.format(ticker), 'strategy={}'.format(strategy),\
+        'shift={}'.format(shift_period), 'move={}'.format(move_value), 'part-0.' + extension)
+
+
+def _write_table(table: pa.Table, path: str, file_format: str, compression: str) -> None:
+    #Write to a temp file and swap it in, so an interrupted export never leaves a truncated file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + '.tmp'
+    if file_format == 'parquet':
+        pq.write_table(table, temp_path, compression= compression)
+    else:
+        feather.write_feather(table, temp_path, compression= compression)
+    os.replace(temp_path, path)
+
+
+def _read_table(path: str, file_format: str, columns=None) -> pa.Table:
+    if file_format == 'parquet':
+        return pq.read_table(path, columns= columns, memory_map=True)
+    return feather.read_table(path, columns= columns, memory_map=True)
+
+
+@instrumentation.traced('dataset_export')
+def write_dataset(dataset_catalog: DatasetCatalog, directory: str, file_format='parquet', compression=None,\
+     verbose=True) -> int:
+    '''
+    Export every ticker of a catalog. An existing export in the directory is replaced.
+    args:
+        dataset_catalog: catalog holding the feature and target matrices
+        directory: folder to write the dataset to
+        file_format: 'parquet' or 'feather'
+        compression: codec passed to pyarrow; None uses DEFAULT_COMPRESSION for the format
+        verbose: choose whether to add prints and logs
+    rtypes:
+        size: bytes written
+    '''
+    if file_format not in FILE_FORMATS:
+        raise ValueError('Unknown file format {}, expected one of {}'.format(file_format, list(FILE_FORMATS)))
+    extension = FILE_FORMATS[file_format]
+    compression = compression if compression is not None else DEFAULT_COMPRESSION[file_format]
+    for subdirectory in ['features', 'targets']:
+        shutil.rmtree(os.path.join(directory, subdirectory), ignore_errors=True)
+    if verbose: print('\nExporting {} tickers to {}...'.format(len(dataset_catalog.feature_dataframes), directory))
+
+    paths = []
+    for ticker, feature_dataframe in dataset_catalog.feature_dataframes.items():
+        path = _feature_path(directory, ticker, extension)
+        _write_table(pa.Table.from_pandas(feature_dataframe, preserve_index=False), path, file_format, compression)
+        paths.append(path)
+        for (strategy, shift_period, move_value), target in dataset_catalog.target_matrices[ticker].items():
+            path = _target_path(directory, ticker, strategy, shift_period, move_value, extension)
+            target_table = pa.Table.from_pandas(pd.DataFrame({'TARGET': target.astype('Int8')}), preserve_index=False)
+            _write_table(target_table, path, file_format, compression)
+            paths.append(path)
+
+    manifest = {'version': DATASET_FORMAT_VERSION, 'file_format': file_format, 'table_prefix': dataset_catalog.table_prefix,\
+        'strategy_list': dataset_catalog.strategy_list, 'shift_period_list': dataset_catalog.shift_period_list,\
+        'move_value_list': dataset_catalog.move_value_list, 'upper_case_columns': dataset_catalog.upper_case_columns,\
+        'tickers': list(dataset_catalog.feature_dataframes), 'names': dataset_catalog.names}
+    manifest_path = os.path.join(directory, 'dataset.json')
+    with open(manifest_path + '.tmp', 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+    size = sum(os.path.getsize(path) for path in paths)
+    if verbose: print('Exported {} files, {:.1f} MB.'.format(len(paths), size / 1e6))
+    return size
+
+
+class DatasetReader:
+    '''
+    Reads an export from "write_dataset"
+    args:
+        directory: folder the dataset was written to
+    '''
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, 'dataset.json'), 'r') as manifest_file:
+            self.manifest = json.load(manifest_file)
+        if self.manifest['version'] != DATASET_FORMAT_VERSION:
+            raise ValueError('Dataset in {} has format version {}, expected {}'.format(directory,\
+                self.manifest['version'], DATASET_FORMAT_VERSION))
+        self.file_format = self.manifest['file_format']
+        self.extension = FILE_FORMATS[self.file_format]
+
+    @property
+    def tickers(self) -> list:
+        return self.manifest['tickers']
+
+    @property
+    def names(self) -> list:
+        return list(self.manifest['names'])
+
+    def read_features(self, ticker: str, columns=None) -> pd.DataFrame:
+        '''
+        Read a ticker's feature matrix, or only the given columns of it
+        '''
+        path = _feature_path(self.directory, ticker, self.extension)
+        return _read_table(path, self.file_format, columns= columns).to_pandas()
+
+    def read_target(self, ticker: str, strategy: str, shift_period: int, move_value: float) -> pd.Series:
+        '''
+        Read the target of one configuration, as a nullable int8 series
+        '''
+        path = _target_path(self.directory, ticker, strategy, shift_period, move_value, self.extension)
+        return _read_table(path, self.file_format).to_pandas()['TARGET'].astype('Int8')
+
+    def _empty_catalog(self) -> DatasetCatalog:
+        return DatasetCatalog(table_prefix= self.manifest['table_prefix'], strategy_list= self.manifest['strategy_list'],\
+            shift_period_list= self.manifest['shift_period_list'], move_value_list= self.manifest['move_value_list'],\
+            upper_case_columns= self.manifest['upper_case_columns'])
+
+    def read(self, name: str, columns=None) -> pd.DataFrame:
+        '''
+        Rebuild one named dataframe - the same frame the catalog returned for it - reading only the files and
+        columns it needs
+        args:
+            name: table name, e.g. PREFIX_AAPL_BUY_SHIFT_5_MOVE_0_9_TRAIN
+            columns: feature matrix columns to load (as named in the feature matrix), or None for all of them
+        rtypes:
+            dataframe: the named dataframe, with TARGET added to the loaded columns
+        '''
+        ticker, strategy, shift_period, move_value, split = self.manifest['names'][name]
+        target = self.read_target(ticker, strategy, shift_period, move_value)
+        dataset_catalog = self._empty_catalog()
+        dataset_catalog.add_ticker(ticker= ticker, feature_dataframe= self.read_features(ticker, columns= columns),\
+            target_matrix= pd.DataFrame({(strategy, shift_period, move_value): target}))
+        return dataset_catalog[name]
+
+    def to_catalog(self, tickers=None, columns=None) -> DatasetCatalog:
+        '''
+        Load the dataset back into a DatasetCatalog
+        args:
+            tickers: tickers to load, or None for all of them
+            columns: feature matrix columns to load, or None for all of them
+        '''
+        dataset_catalog = self._empty_catalog()
+        for ticker in (tickers if tickers is not None else self.tickers):
+            target_matrix = pd.DataFrame({(strategy, shift_period, move_value): self.read_target(ticker, strategy, shift_period, move_value)\
+                for strategy in self.manifest['strategy_list'] for shift_period in self.manifest['shift_period_list']\
+                for move_value in self.manifest['move_value_list']})
+            dataset_catalog.add_ticker(ticker= ticker, feature_dataframe= self.read_features(ticker, columns= columns),\
+                target_matrix= target_matrix)
+        return dataset_catalog
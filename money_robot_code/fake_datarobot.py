@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+#Core libraries
+import time
+import uuid
+import threading
+
+
+'''
+In-memory stand-in for the parts of the datarobot client the model factory uses (Project.create, get, list,
+set_target and get_status), with configurable latencies. Pass a FakeDataRobot as the dr_client of a
+model_factory.ModelFactoryScheduler to run the factory without a DataRobot account.
+'''
+
+
+class FakeDataRobot:
+    '''
+    args:
+        upload_seconds: time Project.create takes
+        set_target_seconds: time set_target takes
+        polls_until_done: get_status calls after set_target before Autopilot reports done
+    '''
+
+    def __init__(self, upload_seconds: float = 0.0, set_target_seconds: float = 0.0, polls_until_done: int = 1):
+        self.upload_seconds = upload_seconds
+        self.set_target_seconds = set_target_seconds
+        self.polls_until_done = polls_until_done
+        self.projects = {}
+        self.lock = threading.Lock()
+        self.Project = _project_class(self)
+
+
+def _project_class(client: FakeDataRobot):
+
+    class Project:
+        def __init__(self, project_id: str, project_name: str, row_count: int):
+            self.id = project_id
+            self.project_name = project_name
+            self.row_count = row_count
+            self.target = None
+            self.status_polls = 0
+
+        @classmethod
+        def create(cls, sourcedata, project_name: str = None):
+            time.sleep(client.upload_seconds)
+            project = cls(uuid.uuid4().hex, project_name, len(sourcedata))
+            with client.lock:
+                client.projects[project.id] = project
+            return project
+
+        @classmethod
+        def get(cls, project_id: str):
+            with client.lock:
+                return client.projects[project_id]
+
+        @classmethod
+        def list(cls, search_params: dict = None):
+            with client.lock:
+                projects = list(client.projects.values())
+            if search_params and 'project_name' in search_params:
+                projects = [project for project in projects if search_params['project_name'] in project.project_name]
+            return projects
+
+        def set_target(self, target: str = None, worker_count: int = None, **kwargs):
+            time.sleep(client.set_target_seconds)
+            self.target = target
+
+        def get_status(self) -> dict:
+            if self.target is None:
+                return {'autopilot_done': False, 'stage': 'aim'}
+            self.status_polls += 1
+            done = self.status_polls >= client.polls_until_done
+            return {'autopilot_done': done, 'stage': 'modeling'}
+
+    return Project
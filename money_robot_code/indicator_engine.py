@@ -0,0 +1,867 @@
+# -*- coding: utf-8 -*-
+
+#Core libraries
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+'''
+Native NumPy implementation of the technical indicators produced by ta.add_all_ta_features(..., fillna=True).
+Every indicator group is a function that takes the price arrays and returns a dict of column -> raw array
+(before ta's fillna rule, which compute_indicators applies from FILL_VALUES), with the same column names,
+default windows and fill rules as ta (version pinned in requirements.txt),
+so frames built here can be scored by projects that were trained on ta features. Values agree with ta
+to floating-point tolerance; the recursive averages are evaluated blockwise rather than one bar at a time.
+'''
+
+
+#-----------------------------------------------------------------------------------------------
+# Array kernels
+#-----------------------------------------------------------------------------------------------
+
+def _fillna(values: np.ndarray, value=0) -> np.ndarray:
+    '''
+    Same as ta's fillna rule: infinities become missing, missing values are forward filled, and
+    anything still missing at the start is set to value (a number, or an array of the same length)
+    '''
+    values = np.where(np.isinf(values), np.nan, values)
+    missing = np.isnan(values)
+    if missing.any():
+        last_valid_positions = np.where(missing, 0, np.arange(len(values)))
+        np.maximum.accumulate(last_valid_positions, out=last_valid_positions)
+        values = values[last_valid_positions]
+        still_missing = np.isnan(values)
+        values[still_missing] = value if np.isscalar(value) else np.asarray(value)[still_missing]
+    return values
+
+
+def _shift(values: np.ndarray, periods: int, fill_value=np.nan) -> np.ndarray:
+    shifted = np.full(len(values), fill_value, dtype=np.float64)
+    if periods < len(values):
+        shifted[periods:] = values[:len(values) - periods]
+    return shifted
+
+
+def _rolling(values: np.ndarray, window: int, min_periods: int, statistic: str) -> np.ndarray:
+    '''
+    pandas-style rolling statistic (sum, mean, max, min or std with ddof=0). Windows at the start of
+    the series are partial, missing values are skipped, and windows with fewer than min_periods
+    observations are missing - except sums with min_periods=0, which are 0 like in pandas. Infinities
+    count as missing too, as pandas drops them before windowing (e.g. volume_em on zero-volume bars).
+    '''
+    if np.isinf(values).any():
+        values = np.where(np.isinf(values), np.nan, values)
+    if statistic != 'std' and not np.isnan(values).any():
+        #Fast path without gaps: pad with the neutral element and count the partial windows directly
+        pad_value = {'max': -np.inf, 'min': np.inf}.get(statistic, 0.0)
+        windows = sliding_window_view(np.concatenate([np.full(window - 1, pad_value), values]), window)
+        count = np.minimum(np.arange(1, len(values) + 1), window)
+        if statistic == 'max':
+            result = windows.max(axis=1)
+        elif statistic == 'min':
+            result = windows.min(axis=1)
+        elif statistic == 'sum':
+            result = windows.sum(axis=1)
+        elif statistic == 'mean':
+            result = windows.sum(axis=1) / count
+        else:
+            raise ValueError('Unknown rolling statistic {}'.format(statistic))
+        if not (statistic == 'sum' and min_periods == 0):
+            result[count < max(min_periods, 1)] = np.nan
+        return result
+
+    windows = sliding_window_view(np.concatenate([np.full(window - 1, np.nan), values]), window)
+    valid = ~np.isnan(windows)
+    count = valid.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if statistic == 'max':
+            result = np.where(valid, windows, -np.inf).max(axis=1)
+        elif statistic == 'min':
+            result = np.where(valid, windows, np.inf).min(axis=1)
+        else:
+            total = np.where(valid, windows, 0.0).sum(axis=1)
+            if statistic == 'sum':
+                result = total
+            elif statistic == 'mean':
+                result = total / count
+            elif statistic == 'std':
+                mean = total / count
+                squared_deviation = np.where(valid, (windows - mean[:, None]) ** 2, 0.0)
+                result = np.sqrt(squared_deviation.sum(axis=1) / count)
+            else:
+                raise ValueError('Unknown rolling statistic {}'.format(statistic))
+    if statistic == 'sum' and min_periods == 0:
+        return result
+    result[count < max(min_periods, 1)] = np.nan
+    return result
+
+
+def _recursive_filter(values: np.ndarray, decay: float, gain: float, start: int, initial: float) -> np.ndarray:
+    '''
+    Evaluate y[start] = initial, y[i] = decay * y[i - 1] + gain * values[i] for i > start (missing before
+    start). The recursion is solved in closed form over blocks of bars, so the Python loop runs once per
+    block instead of once per bar; the block size keeps decay ** -block well inside float64 precision.
+    '''
+    result = np.full(len(values), np.nan)
+    if start >= len(values):
+        return result
+    result[start] = initial
+    if decay == 0:
+        result[start + 1:] = gain * values[start + 1:]
+        return result
+    block = int(max(1, min(64, np.floor(27.6 / -np.log(decay)))))
+    exponents = np.arange(block, dtype=np.float64)
+    decay_powers = decay ** exponents
+    growth = decay ** -exponents
+    previous = initial
+    for block_start in range(start + 1, len(values), block):
+        block_values = values[block_start:block_start + block]
+        length = len(block_values)
+        partial_sums = np.cumsum(block_values * growth[:length]) * decay_powers[:length]
+        block_result = decay_powers[:length] * decay * previous + gain * partial_sums
+        result[block_start:block_start + length] = block_result
+        previous = block_result[-1]
+    return result
+
+
+def _ewm_mean_loop(values: np.ndarray, alpha: float) -> np.ndarray:
+    '''
+    Bar-by-bar port of pandas' ewm(alpha, adjust=False).mean(), used when there are gaps inside the series
+    '''
+    result = np.full(len(values), np.nan)
+    weighted = np.nan
+    old_weight = 1.0
+    for position, value in enumerate(values):
+        is_observation = value == value
+        if weighted == weighted:
+            old_weight *= 1.0 - alpha
+            if is_observation:
+                if weighted != value:
+                    weighted = (old_weight * weighted + alpha * value) / (old_weight + alpha)
+                old_weight = 1.0
+        elif is_observation:
+            weighted = value
+        result[position] = weighted
+    return result
+
+
+def _ewm_mean(values: np.ndarray, alpha: float) -> np.ndarray:
+    '''
+    pandas' ewm(alpha=alpha, adjust=False, min_periods=0).mean()
+    '''
+    valid = ~np.isnan(values)
+    if not valid.any():
+        return np.full(len(values), np.nan)
+    start = int(np.argmax(valid))
+    if not valid[start:].all():
+        return _ewm_mean_loop(values, alpha)
+    return _recursive_filter(values, 1.0 - alpha, alpha, start, values[start])
+
+
+def _ema(values: np.ndarray, window: int) -> np.ndarray:
+    return _ewm_mean(values, 2.0 / (window + 1.0))
+
+
+def _true_range(high: np.ndarray, low: np.ndarray, previous_close: np.ndarray) -> np.ndarray:
+    return np.fmax(np.fmax(high - low, np.abs(high - previous_close)), np.abs(low - previous_close))
+
+
+def _wilder_average(values: np.ndarray, window: int) -> np.ndarray:
+    '''
+    ta's Wilder smoothing: zeros for the first window - 1 bars, the simple mean of the first window
+    bars, then avg[i] = (avg[i - 1] * (window - 1) + values[i]) / window
+    '''
+    result = np.zeros(len(values))
+    if len(values) < window:
+        return result
+    result[window - 1:] = _recursive_filter(values, (window - 1.0) / window, 1.0 / window,\
+        window - 1, np.mean(values[:window]))[window - 1:]
+    return result
+
+
+#-----------------------------------------------------------------------------------------------
+# Indicator groups - one per ta indicator class, with the windows add_all_ta_features uses
+#-----------------------------------------------------------------------------------------------
+
+def _volume_adi(prices: dict) -> dict:
+    high, low, close, volume = prices['high'], prices['low'], prices['close'], prices['volume']
+    clv = np.nan_to_num(((close - low) - (high - close)) / (high - low), nan=0.0, posinf=np.inf, neginf=-np.inf)
+    return {'volume_adi': np.cumsum(clv * volume)}
+
+
+def _volume_obv(prices: dict) -> dict:
+    close, volume = prices['close'], prices['volume']
+    obv = np.where(close < _shift(close, 1), -volume, volume)
+    return {'volume_obv': np.cumsum(obv)}
+
+
+def _volume_cmf(prices: dict) -> dict:
+    high, low, close, volume = prices['high'], prices['low'], prices['close'], prices['volume']
+    mfv = np.nan_to_num(((close - low) - (high - close)) / (high - low), nan=0.0, posinf=np.inf, neginf=-np.inf)
+    cmf = _rolling(mfv * volume, 20, 0, 'sum') / _rolling(volume, 20, 0, 'sum')
+    return {'volume_cmf': cmf}
+
+
+def _volume_fi(prices: dict) -> dict:
+    close, volume = prices['close'], prices['volume']
+    return {'volume_fi': _ema((close - _shift(close, 1)) * volume, 13)}
+
+
+def _volume_em(prices: dict) -> dict:
+    high, low, volume = prices['high'], prices['low'], prices['volume']
+    emv = (np.diff(high, prepend=np.nan) + np.diff(low, prepend=np.nan)) * (high - low) / (2 * volume)
+    emv = emv * 100000000
+    return {'volume_em': emv, 'volume_sma_em': _rolling(emv, 14, 0, 'mean')}
+
+
+def _volume_vpt(prices: dict) -> dict:
+    close, volume = prices['close'], prices['volume']
+    previous_close = _shift(close, 1, fill_value=np.nanmean(close))
+    vpt = volume * ((close - previous_close) / previous_close)
+    vpt = _shift(vpt, 1, fill_value=np.nanmean(vpt)) + vpt
+    return {'volume_vpt': vpt}
+
+
+def _volume_vwap(prices: dict) -> dict:
+    high, low, close, volume = prices['high'], prices['low'], prices['close'], prices['volume']
+    typical_price = (high + low + close) / 3.0
+    vwap = _rolling(typical_price * volume, 14, 0, 'sum') / _rolling(volume, 14, 0, 'sum')
+    return {'volume_vwap': vwap}
+
+
+def _volume_mfi(prices: dict) -> dict:
+    high, low, close, volume = prices['high'], prices['low'], prices['close'], prices['volume']
+    typical_price = (high + low + close) / 3.0
+    previous_typical_price = _shift(typical_price, 1)
+    up_down = np.where(typical_price > previous_typical_price, 1, np.where(typical_price < previous_typical_price, -1, 0))
+    money_flow = typical_price * volume * up_down
+    positive_money_flow = _rolling(np.where(money_flow >= 0.0, money_flow, 0.0), 14, 0, 'sum')
+    negative_money_flow = np.abs(_rolling(np.where(money_flow < 0.0, money_flow, 0.0), 14, 0, 'sum'))
+    mfi = 100 - (100 / (1 + positive_money_flow / negative_money_flow))
+    return {'volume_mfi': mfi}
+
+
+def _volume_nvi(prices: dict) -> dict:
+    close, volume = prices['close'], prices['volume']
+    price_change = close / _shift(close, 1) - 1
+    volume_decrease = _shift(volume, 1) > volume
+    factors = np.where(volume_decrease, 1.0 + price_change, 1.0)
+    factors[0] = 1000.0
+    return {'volume_nvi': np.cumprod(factors)}
+
+
+def _volatility_bb(prices: dict) -> dict:
+    close = prices['close']
+    mavg = _rolling(close, 20, 0, 'mean')
+    mstd = _rolling(close, 20, 0, 'std')
+    hband = mavg + 2 * mstd
+    lband = mavg - 2 * mstd
+    return {
+        'volatility_bbm': mavg,
+        'volatility_bbh': hband,
+        'volatility_bbl': lband,
+        'volatility_bbw': ((hband - lband) / mavg) * 100,
+        'volatility_bbp': (close - lband) / (hband - lband),
+        'volatility_bbhi': np.where(close > hband, 1.0, 0.0),
+        'volatility_bbli': np.where(close < lband, 1.0, 0.0),
+    }
+
+
+def _volatility_kc(prices: dict) -> dict:
+    high, low, close = prices['high'], prices['low'], prices['close']
+    middle = _rolling((high + low + close) / 3.0, 10, 1, 'mean')
+    upper = _rolling(((4 * high) - (2 * low) + close) / 3.0, 10, 0, 'mean')
+    lower = _rolling(((-2 * high) + (4 * low) + close) / 3.0, 10, 0, 'mean')
+    return {
+        'volatility_kcc': middle,
+        'volatility_kch': upper,
+        'volatility_kcl': lower,
+        'volatility_kcw': ((upper - lower) / middle) * 100,
+        'volatility_kcp': (close - lower) / (upper - lower),
+        'volatility_kchi': np.where(close > upper, 1.0, 0.0),
+        'volatility_kcli': np.where(close < lower, 1.0, 0.0),
+    }
+
+
+def _volatility_dc(prices: dict) -> dict:
+    high, low, close = prices['high'], prices['low'], prices['close']
+    hband = _rolling(high, 20, 1, 'max')
+    lband = _rolling(low, 20, 1, 'min')
+    return {
+        'volatility_dcl': lband,
+        'volatility_dch': hband,
+        'volatility_dcm': ((hband - lband) / 2.0) + lband,
+        'volatility_dcw': ((hband - lband) / _rolling(close, 20, 1, 'mean')) * 100,
+        'volatility_dcp': (close - lband) / (hband - lband),
+    }
+
+
+def _volatility_atr(prices: dict) -> dict:
+    high, low, close = prices['high'], prices['low'], prices['close']
+    true_range = _true_range(high, low, _shift(close, 1))
+    return {'volatility_atr': _wilder_average(true_range, 10)}
+
+
+def _volatility_ui(prices: dict) -> dict:
+    close = prices['close']
+    rolling_max = _rolling(close, 14, 1, 'max')
+    percent_drawdown = 100 * (close - rolling_max) / rolling_max
+    squared_drawdown = _rolling(percent_drawdown ** 2 / 14, 14, 14, 'sum')
+    return {'volatility_ui': np.sqrt(squared_drawdown)}
+
+
+def _trend_macd(prices: dict) -> dict:
+    close = prices['close']
+    macd = _ema(close, 12) - _ema(close, 26)
+    macd_signal = _ema(macd, 9)
+    return {
+        'trend_macd': macd,
+        'trend_macd_signal': macd_signal,
+        'trend_macd_diff': macd - macd_signal,
+    }
+
+
+def _trend_sma(prices: dict) -> dict:
+    close = prices['close']
+    return {'trend_sma_fast': _rolling(close, 12, 0, 'mean'), 'trend_sma_slow': _rolling(close, 26, 0, 'mean')}
+
+
+def _trend_ema(prices: dict) -> dict:
+    close = prices['close']
+    return {'trend_ema_fast': _ema(close, 12), 'trend_ema_slow': _ema(close, 26)}
+
+
+def _trend_vortex(prices: dict) -> dict:
+    high, low, close = prices['high'], prices['low'], prices['close']
+    true_range = _true_range(high, low, _shift(close, 1, fill_value=np.nanmean(close)))
+    true_range_sum = _rolling(true_range, 14, 0, 'sum')
+    positive = _rolling(np.abs(high - _shift(low, 1)), 14, 0, 'sum') / true_range_sum
+    negative = _rolling(np.abs(low - _shift(high, 1)), 14, 0, 'sum') / true_range_sum
+    return {
+        'trend_vortex_ind_pos': positive,
+        'trend_vortex_ind_neg': negative,
+        'trend_vortex_ind_diff': positive - negative,
+    }
+
+
+def _trend_trix(prices: dict) -> dict:
+    triple_ema = _ema(_ema(_ema(prices['close'], 15), 15), 15)
+    previous = _shift(triple_ema, 1, fill_value=np.nanmean(triple_ema))
+    return {'trend_trix': ((triple_ema - previous) / previous) * 100}
+
+
+def _trend_mass_index(prices: dict) -> dict:
+    amplitude = prices['high'] - prices['low']
+    single_ema = _ema(amplitude, 9)
+    double_ema = _ema(single_ema, 9)
+    return {'trend_mass_index': _rolling(single_ema / double_ema, 25, 0, 'sum')}
+
+
+def _trend_dpo(prices: dict) -> dict:
+    close = prices['close']
+    dpo = _shift(close, int((0.5 * 20) + 1), fill_value=np.nanmean(close)) - _rolling(close, 20, 0, 'mean')
+    return {'trend_dpo': dpo}
+
+
+def _trend_kst(prices: dict) -> dict:
+    close = prices['close']
+    close_mean = np.nanmean(close)
+    rate_of_change_averages = []
+    for roc_window, window in [(10, 10), (15, 10), (20, 10), (30, 15)]:
+        previous = _shift(close, roc_window, fill_value=close_mean)
+        rate_of_change_averages.append(_rolling((close - previous) / previous, window, 0, 'mean'))
+    kst = 100 * (rate_of_change_averages[0] + 2 * rate_of_change_averages[1]\
+        + 3 * rate_of_change_averages[2] + 4 * rate_of_change_averages[3])
+    kst_signal = _rolling(kst, 9, 0, 'mean')
+    return {
+        'trend_kst': kst,
+        'trend_kst_sig': kst_signal,
+        'trend_kst_diff': kst - kst_signal,
+    }
+
+
+def _ichimoku_lines(prices: dict) -> tuple:
+    #Shared by the plain and the visual ichimoku groups, so it is kept on the prices dict after the first call
+    if '_ichimoku_lines' in prices:
+        return prices['_ichimoku_lines']
+    high, low = prices['high'], prices['low']
+    conversion = 0.5 * (_rolling(high, 9, 0, 'max') + _rolling(low, 9, 0, 'min'))
+    base = 0.5 * (_rolling(high, 26, 0, 'max') + _rolling(low, 26, 0, 'min'))
+    span_a = 0.5 * (conversion + base)
+    span_b = 0.5 * (_rolling(high, 52, 0, 'max') + _rolling(low, 52, 0, 'min'))
+    prices['_ichimoku_lines'] = (conversion, base, span_a, span_b)
+    return prices['_ichimoku_lines']
+
+
+def _trend_ichimoku(prices: dict) -> dict:
+    conversion, base, span_a, span_b = _ichimoku_lines(prices)
+    return {
+        'trend_ichimoku_conv': conversion,
+        'trend_ichimoku_base': base,
+        'trend_ichimoku_a': span_a,
+        'trend_ichimoku_b': span_b,
+    }
+
+
+def _trend_visual_ichimoku(prices: dict) -> dict:
+    _, _, span_a, span_b = _ichimoku_lines(prices)
+    return {
+        'trend_visual_ichimoku_a': _shift(span_a, 26, fill_value=np.nanmean(span_a)),
+        'trend_visual_ichimoku_b': _shift(span_b, 26, fill_value=np.nanmean(span_b)),
+    }
+
+
+def _trend_stc(prices: dict) -> dict:
+    close = prices['close']
+    macd = _ema(close, 23) - _ema(close, 50)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        macd_min = _rolling(macd, 10, 10, 'min')
+        stoch_k = 100 * (macd - macd_min) / (_rolling(macd, 10, 10, 'max') - macd_min)
+        stoch_d = _ema(stoch_k, 3)
+        stoch_d_min = _rolling(stoch_d, 10, 10, 'min')
+        stoch_kd = 100 * (stoch_d - stoch_d_min) / (_rolling(stoch_d, 10, 10, 'max') - stoch_d_min)
+    return {'trend_stc': _ema(stoch_kd, 3)}
+
+
+def _trend_adx(prices: dict) -> dict:
+    high, low, close = prices['high'], prices['low'], prices['close']
+    window = 14
+    length = len(close)
+    smoothed_length = length - (window - 1)
+    if smoothed_length < window + 2:
+        return {column: np.full(length, 20.0) for column in ['trend_adx', 'trend_adx_pos', 'trend_adx_neg']}
+
+    def _smooth(values):
+        #ta seeds with the sum of the first window observations, then runs s[i] = s[i-1] - s[i-1]/window + values[window+i]
+        #for every i except the last one, which stays 0
+        smoothed = np.zeros(smoothed_length)
+        smoothed[:-1] = _recursive_filter(np.concatenate([[np.nan], values[window + 1:]]),\
+            1.0 - 1.0 / window, 1.0, 0, values[~np.isnan(values)][:window].sum())
+        return smoothed
+
+    previous_close = _shift(close, 1)
+    directional_movement = np.amax([high, previous_close], axis=0) - np.amin([low, previous_close], axis=0)
+    true_range_sum = _smooth(directional_movement)
+    diff_up = high - _shift(high, 1)
+    diff_down = _shift(low, 1) - low
+    positive_sum = _smooth(np.abs(((diff_up > diff_down) & (diff_up > 0)) * diff_up))
+    negative_sum = _smooth(np.abs(((diff_down > diff_up) & (diff_down > 0)) * diff_down))
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        positive_index = 100 * (positive_sum / true_range_sum)
+        negative_index = 100 * (negative_sum / true_range_sum)
+        directional_index = 100 * np.abs((positive_index - negative_index) / (positive_index + negative_index))
+    adx = np.zeros(smoothed_length)
+    adx[window:] = _recursive_filter(np.concatenate([[np.nan], directional_index[window:-1]]),\
+        (window - 1.0) / window, 1.0 / window, 0, directional_index[0:window].mean())
+    adx = np.concatenate([np.zeros(window - 1), adx])
+
+    adx_positive = np.zeros(length)
+    adx_negative = np.zeros(length)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        adx_positive[window + 1:] = 100 * (positive_sum[1:-1] / true_range_sum[1:-1])
+        adx_negative[window + 1:] = 100 * (negative_sum[1:-1] / true_range_sum[1:-1])
+    return {
+        'trend_adx': adx,
+        'trend_adx_pos': adx_positive,
+        'trend_adx_neg': adx_negative,
+    }
+
+
+def _trend_cci(prices: dict) -> dict:
+    typical_price = (prices['high'] + prices['low'] + prices['close']) / 3.0
+    windows = sliding_window_view(np.concatenate([np.full(19, np.nan), typical_price]), 20)
+    window_mean = np.nanmean(windows, axis=1)
+    mean_absolute_deviation = np.nanmean(np.abs(windows - window_mean[:, None]), axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cci = (typical_price - _rolling(typical_price, 20, 0, 'mean')) / (0.015 * mean_absolute_deviation)
+    return {'trend_cci': cci}
+
+
+def _trend_aroon(prices: dict) -> dict:
+    close = prices['close']
+    window = 25
+    #Partial windows at the start are padded; the pad is never picked, and is taken back off the position
+    pad_length = np.maximum(window - 1 - np.arange(len(close)), 0)
+    aroon_up = (np.argmax(sliding_window_view(np.concatenate([np.full(window - 1, -np.inf), close]), window), axis=1)\
+        - pad_length + 1) / window * 100
+    aroon_down = (np.argmin(sliding_window_view(np.concatenate([np.full(window - 1, np.inf), close]), window), axis=1)\
+        - pad_length + 1) / window * 100
+    return {
+        'trend_aroon_up': aroon_up.astype(np.float64),
+        'trend_aroon_down': aroon_down.astype(np.float64),
+        'trend_aroon_ind': (aroon_up - aroon_down).astype(np.float64),
+    }
+
+
+def _trend_psar(prices: dict) -> dict:
+    high, low, close = prices['high'].tolist(), prices['low'].tolist(), prices['close'].tolist()
+    step, max_step = 0.02, 0.20
+    up_trend = True
+    acceleration_factor = step
+    up_trend_high = high[0]
+    down_trend_low = low[0]
+    psar = list(close)
+    psar_up = [np.nan] * len(close)
+    psar_down = [np.nan] * len(close)
+
+    for i in range(2, len(close)):
+        reversal = False
+        max_high = high[i]
+        min_low = low[i]
+        if up_trend:
+            psar[i] = psar[i - 1] + (acceleration_factor * (up_trend_high - psar[i - 1]))
+            if min_low < psar[i]:
+                reversal = True
+                psar[i] = up_trend_high
+                down_trend_low = min_low
+                acceleration_factor = step
+            else:
+                if max_high > up_trend_high:
+                    up_trend_high = max_high
+                    acceleration_factor = min(acceleration_factor + step, max_step)
+                if low[i - 2] < psar[i]:
+                    psar[i] = low[i - 2]
+                elif low[i - 1] < psar[i]:
+                    psar[i] = low[i - 1]
+        else:
+            psar[i] = psar[i - 1] - (acceleration_factor * (psar[i - 1] - down_trend_low))
+            if max_high > psar[i]:
+                reversal = True
+                psar[i] = down_trend_low
+                up_trend_high = max_high
+                acceleration_factor = step
+            else:
+                if min_low < down_trend_low:
+                    down_trend_low = min_low
+                    acceleration_factor = min(acceleration_factor + step, max_step)
+                if high[i - 2] > psar[i]:
+                    psar[i] = high[i - 2]
+                elif high[i - 1] > psar[i]:
+                    psar[i] = high[i - 1]
+        up_trend = up_trend != reversal
+        if up_trend:
+            psar_up[i] = psar[i]
+        else:
+            psar_down[i] = psar[i]
+
+    psar_up = np.asarray(psar_up, dtype=np.float64)
+    psar_down = np.asarray(psar_down, dtype=np.float64)
+    #An indicator fires on the first bar of each new up (down) trend
+    up_indicator = ~np.isnan(psar_up) & np.isnan(_shift(psar_up, 1))
+    down_indicator = ~np.isnan(psar_down) & np.isnan(_shift(psar_down, 1))
+    return {
+        'trend_psar_up': psar_up,
+        'trend_psar_down': psar_down,
+        'trend_psar_up_indicator': np.where(up_indicator & (psar_up != 0), 1.0, 0.0),
+        'trend_psar_down_indicator': down_indicator.astype(np.float64),
+    }
+
+
+def _rsi(close: np.ndarray, window: int) -> np.ndarray:
+    diff = close - _shift(close, 1)
+    up_direction = np.where(diff > 0, diff, 0.0)
+    down_direction = -np.where(diff < 0, diff, 0.0)
+    ema_up = _ewm_mean(up_direction, 1.0 / window)
+    ema_down = _ewm_mean(down_direction, 1.0 / window)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rsi = np.where(ema_down == 0, 100, 100 - (100 / (1 + ema_up / ema_down)))
+    return _fillna(rsi.astype(np.float64), 50)
+
+
+def _momentum_rsi(prices: dict) -> dict:
+    return {'momentum_rsi': _rsi(prices['close'], 14)}
+
+
+def _momentum_stoch_rsi(prices: dict) -> dict:
+    rsi = _rsi(prices['close'], 14)
+    lowest_rsi = _rolling(rsi, 14, 14, 'min')
+    with np.errstate(invalid='ignore', divide='ignore'):
+        stoch_rsi = (rsi - lowest_rsi) / (_rolling(rsi, 14, 14, 'max') - lowest_rsi)
+    stoch_rsi = np.where(np.isinf(stoch_rsi), np.nan, stoch_rsi)
+    stoch_rsi_k = _rolling(stoch_rsi, 3, 3, 'mean')
+    return {
+        'momentum_stoch_rsi': stoch_rsi,
+        'momentum_stoch_rsi_k': stoch_rsi_k,
+        'momentum_stoch_rsi_d': _rolling(stoch_rsi_k, 3, 3, 'mean'),
+    }
+
+
+def _momentum_tsi(prices: dict) -> dict:
+    close = prices['close']
+    diff = close - _shift(close, 1)
+    smoothed = _ema(_ema(diff, 25), 13)
+    smoothed_absolute = _ema(_ema(np.abs(diff), 25), 13)
+    return {'momentum_tsi': (smoothed / smoothed_absolute) * 100}
+
+
+def _momentum_uo(prices: dict) -> dict:
+    high, low, close = prices['high'], prices['low'], prices['close']
+    previous_close = _shift(close, 1)
+    true_range = _true_range(high, low, previous_close)
+    buying_pressure = close - np.minimum(low, previous_close)
+    averages = [_rolling(buying_pressure, window, 0, 'sum') / _rolling(true_range, window, 0, 'sum') for window in [7, 14, 28]]
+    uo = 100.0 * ((4.0 * averages[0]) + (2.0 * averages[1]) + (1.0 * averages[2])) / (4.0 + 2.0 + 1.0)
+    return {'momentum_uo': uo}
+
+
+def _momentum_stoch(prices: dict) -> dict:
+    high, low, close = prices['high'], prices['low'], prices['close']
+    lowest_low = _rolling(low, 14, 0, 'min')
+    with np.errstate(invalid='ignore', divide='ignore'):
+        stoch_k = 100 * (close - lowest_low) / (_rolling(high, 14, 0, 'max') - lowest_low)
+    return {
+        'momentum_stoch': stoch_k,
+        'momentum_stoch_signal': _rolling(stoch_k, 3, 0, 'mean'),
+    }
+
+
+def _momentum_wr(prices: dict) -> dict:
+    high, low, close = prices['high'], prices['low'], prices['close']
+    highest_high = _rolling(high, 14, 0, 'max')
+    with np.errstate(invalid='ignore', divide='ignore'):
+        wr = -100 * (highest_high - close) / (highest_high - _rolling(low, 14, 0, 'min'))
+    return {'momentum_wr': wr}
+
+
+def _momentum_ao(prices: dict) -> dict:
+    median_price = 0.5 * (prices['high'] + prices['low'])
+    return {'momentum_ao': _rolling(median_price, 5, 0, 'mean') - _rolling(median_price, 34, 0, 'mean')}
+
+
+def _momentum_roc(prices: dict) -> dict:
+    close = prices['close']
+    previous = _shift(close, 12)
+    return {'momentum_roc': ((close - previous) / previous) * 100}
+
+
+def _percentage_oscillator(values: np.ndarray, prefix: str) -> dict:
+    ema_fast = _ema(values, 12)
+    ema_slow = _ema(values, 26)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        oscillator = ((ema_fast - ema_slow) / ema_slow) * 100
+    oscillator_signal = _ema(oscillator, 9)
+    return {
+        prefix: oscillator,
+        prefix + '_signal': oscillator_signal,
+        prefix + '_hist': oscillator - oscillator_signal,
+    }
+
+
+def _momentum_ppo(prices: dict) -> dict:
+    return _percentage_oscillator(prices['close'], 'momentum_ppo')
+
+
+def _momentum_pvo(prices: dict) -> dict:
+    return _percentage_oscillator(prices['volume'], 'momentum_pvo')
+
+
+def _momentum_kama(prices: dict) -> dict:
+    close = prices['close']
+    window, fast, slow = 10, 2, 30
+    #ta uses np.roll here, so the first window bars wrap around to the end of the series
+    volatility = np.abs(close - np.roll(close, 1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        efficiency_ratio = np.abs(close - np.roll(close, window)) / _rolling(volatility, window, 0, 'sum')
+    smoothing_constant = (efficiency_ratio * (2.0 / (fast + 1) - 2.0 / (slow + 1.0)) + 2 / (slow + 1.0)) ** 2.0
+    kama = [np.nan] * len(close)
+    first_value = True
+    for i, (constant, price) in enumerate(zip(smoothing_constant.tolist(), close.tolist())):
+        if constant != constant:
+            continue
+        if first_value:
+            kama[i] = price
+            first_value = False
+        else:
+            kama[i] = kama[i - 1] + constant * (price - kama[i - 1])
+    return {'momentum_kama': np.asarray(kama, dtype=np.float64)}
+
+
+def _others_dr(prices: dict) -> dict:
+    close = prices['close']
+    return {'others_dr': (close / _shift(close, 1, fill_value=np.nanmean(close)) - 1) * 100}
+
+
+def _others_dlr(prices: dict) -> dict:
+    return {'others_dlr': np.diff(np.log(prices['close']), prepend=np.nan) * 100}
+
+
+def _others_cr(prices: dict) -> dict:
+    close = prices['close']
+    return {'others_cr': (close / close[0] - 1) * 100}
+
+
+#Indicator groups in the order add_all_ta_features adds them, with the columns each one produces
+INDICATOR_GROUPS = [
+    (_volume_adi, ['volume_adi']),
+    (_volume_obv, ['volume_obv']),
+    (_volume_cmf, ['volume_cmf']),
+    (_volume_fi, ['volume_fi']),
+    (_volume_em, ['volume_em', 'volume_sma_em']),
+    (_volume_vpt, ['volume_vpt']),
+    (_volume_vwap, ['volume_vwap']),
+    (_volume_mfi, ['volume_mfi']),
+    (_volume_nvi, ['volume_nvi']),
+    (_volatility_bb, ['volatility_bbm', 'volatility_bbh', 'volatility_bbl', 'volatility_bbw', 'volatility_bbp',\
+        'volatility_bbhi', 'volatility_bbli']),
+    (_volatility_kc, ['volatility_kcc', 'volatility_kch', 'volatility_kcl', 'volatility_kcw', 'volatility_kcp',\
+        'volatility_kchi', 'volatility_kcli']),
+    (_volatility_dc, ['volatility_dcl', 'volatility_dch', 'volatility_dcm', 'volatility_dcw', 'volatility_dcp']),
+    (_volatility_atr, ['volatility_atr']),
+    (_volatility_ui, ['volatility_ui']),
+    (_trend_macd, ['trend_macd', 'trend_macd_signal', 'trend_macd_diff']),
+    (_trend_sma, ['trend_sma_fast', 'trend_sma_slow']),
+    (_trend_ema, ['trend_ema_fast', 'trend_ema_slow']),
+    (_trend_vortex, ['trend_vortex_ind_pos', 'trend_vortex_ind_neg', 'trend_vortex_ind_diff']),
+    (_trend_trix, ['trend_trix']),
+    (_trend_mass_index, ['trend_mass_index']),
+    (_trend_dpo, ['trend_dpo']),
+    (_trend_kst, ['trend_kst', 'trend_kst_sig', 'trend_kst_diff']),
+    (_trend_ichimoku, ['trend_ichimoku_conv', 'trend_ichimoku_base', 'trend_ichimoku_a', 'trend_ichimoku_b']),
+    (_trend_stc, ['trend_stc']),
+    (_trend_adx, ['trend_adx', 'trend_adx_pos', 'trend_adx_neg']),
+    (_trend_cci, ['trend_cci']),
+    (_trend_visual_ichimoku, ['trend_visual_ichimoku_a', 'trend_visual_ichimoku_b']),
+    (_trend_aroon, ['trend_aroon_up', 'trend_aroon_down', 'trend_aroon_ind']),
+    (_trend_psar, ['trend_psar_up', 'trend_psar_down', 'trend_psar_up_indicator', 'trend_psar_down_indicator']),
+    (_momentum_rsi, ['momentum_rsi']),
+    (_momentum_stoch_rsi, ['momentum_stoch_rsi', 'momentum_stoch_rsi_k', 'momentum_stoch_rsi_d']),
+    (_momentum_tsi, ['momentum_tsi']),
+    (_momentum_uo, ['momentum_uo']),
+    (_momentum_stoch, ['momentum_stoch', 'momentum_stoch_signal']),
+    (_momentum_wr, ['momentum_wr']),
+    (_momentum_ao, ['momentum_ao']),
+    (_momentum_roc, ['momentum_roc']),
+    (_momentum_ppo, ['momentum_ppo', 'momentum_ppo_signal', 'momentum_ppo_hist']),
+    (_momentum_pvo, ['momentum_pvo', 'momentum_pvo_signal', 'momentum_pvo_hist']),
+    (_momentum_kama, ['momentum_kama']),
+    (_others_dr, ['others_dr']),
+    (_others_dlr, ['others_dlr']),
+    (_others_cr, ['others_cr']),
+]
+
+#Every column the engine can produce, in add_all_ta_features order
+ALL_INDICATOR_COLUMNS = [column for _, columns in INDICATOR_GROUPS for column in columns]
+
+#Value ta's fillna rule puts in the leading gap of each column (see _fillna); 'close' means the close
+#price of the same bar. Columns missing from this table are left as computed.
+FILL_VALUES = {
+    'volume_adi': 0,
+    'volume_obv': 0,
+    'volume_cmf': 0,
+    'volume_fi': 0,
+    'volume_em': 0,
+    'volume_sma_em': 0,
+    'volume_vpt': 0,
+    'volume_vwap': 0,
+    'volume_mfi': 50,
+    'volume_nvi': 1000,
+    'volatility_bbm': -1,
+    'volatility_bbh': -1,
+    'volatility_bbl': -1,
+    'volatility_bbw': 0,
+    'volatility_bbp': 0,
+    'volatility_kcc': -1,
+    'volatility_kch': -1,
+    'volatility_kcl': -1,
+    'volatility_kcw': 0,
+    'volatility_kcp': 0,
+    'volatility_dcl': -1,
+    'volatility_dch': -1,
+    'volatility_dcm': -1,
+    'volatility_dcw': 0,
+    'volatility_dcp': 0,
+    'volatility_atr': 0,
+    'volatility_ui': 0,
+    'trend_macd': 0,
+    'trend_macd_signal': 0,
+    'trend_macd_diff': 0,
+    'trend_vortex_ind_pos': 1,
+    'trend_vortex_ind_neg': 1,
+    'trend_vortex_ind_diff': 0,
+    'trend_trix': 0,
+    'trend_mass_index': 0,
+    'trend_dpo': 0,
+    'trend_kst': 0,
+    'trend_kst_sig': 0,
+    'trend_kst_diff': 0,
+    'trend_ichimoku_conv': -1,
+    'trend_ichimoku_base': -1,
+    'trend_ichimoku_a': -1,
+    'trend_ichimoku_b': -1,
+    'trend_stc': 0,
+    'trend_adx': 20,
+    'trend_adx_pos': 20,
+    'trend_adx_neg': 20,
+    'trend_cci': 0,
+    'trend_visual_ichimoku_a': -1,
+    'trend_visual_ichimoku_b': -1,
+    'trend_aroon_up': 0,
+    'trend_aroon_down': 0,
+    'trend_aroon_ind': 0,
+    'trend_psar_up': -1,
+    'trend_psar_down': -1,
+    'momentum_stoch_rsi': 0,
+    'momentum_stoch_rsi_k': 0,
+    'momentum_stoch_rsi_d': 0,
+    'momentum_tsi': 0,
+    'momentum_uo': 50,
+    'momentum_stoch': 50,
+    'momentum_stoch_signal': 50,
+    'momentum_wr': -50,
+    'momentum_ao': 0,
+    'momentum_roc': 0,
+    'momentum_ppo': 0,
+    'momentum_ppo_signal': 0,
+    'momentum_ppo_hist': 0,
+    'momentum_pvo': 0,
+    'momentum_pvo_signal': 0,
+    'momentum_pvo_hist': 0,
+    'momentum_kama': 'close',
+    'others_dr': 0,
+    'others_dlr': 0,
+    'others_cr': -1,
+}
+
+
+def compute_indicators(dataframe: pd.DataFrame, indicators=None, dtype='float64', open="Open", high="High",\
+     low="Low", close="Close", volume="Volume") -> pd.DataFrame:
+    '''
+    Compute technical indicators with the native engine.
+    args:
+        dataframe: dataframe with the price columns, oldest bar first
+        indicators: list of indicator columns to compute (names as in ALL_INDICATOR_COLUMNS); None computes all
+        dtype: dtype of the output columns, e.g. 'float32' to halve memory
+        open, high, low, close, volume: names of the price columns
+    rtypes:
+        indicator_dataframe: dataframe with one column per indicator, same index as the input, in
+        add_all_ta_features column order
+    '''
+    if indicators is None:
+        requested_columns = ALL_INDICATOR_COLUMNS
+    else:
+        unknown_columns = [column for column in indicators if column not in ALL_INDICATOR_COLUMNS]
+        if unknown_columns:
+            raise ValueError('Unknown indicators: {}'.format(', '.join(unknown_columns)))
+        requested_columns = [column for column in ALL_INDICATOR_COLUMNS if column in set(indicators)]
+
+    prices = {
+        'open': dataframe[open].to_numpy(dtype=np.float64),
+        'high': dataframe[high].to_numpy(dtype=np.float64),
+        'low': dataframe[low].to_numpy(dtype=np.float64),
+        'close': dataframe[close].to_numpy(dtype=np.float64),
+        'volume': dataframe[volume].to_numpy(dtype=np.float64),
+    }
+    indicator_values = {}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for group_function, group_columns in INDICATOR_GROUPS:
+            if any(column in requested_columns for column in group_columns):
+                indicator_values.update(group_function(prices))
+    for column in requested_columns:
+        if column in FILL_VALUES:
+            fill_value = FILL_VALUES[column]
+            indicator_values[column] = _fillna(indicator_values[column], prices[fill_value] if fill_value == 'close' else fill_value)
+    indicator_dataframe = pd.DataFrame({column: indicator_values[column].astype(dtype, copy=False)\
+        for column in requested_columns}, index=dataframe.index)
+    return indicator_dataframe
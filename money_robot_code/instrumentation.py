@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+#Core libraries
+import os
+import json
+import time
+import datetime
+import threading
+import functools
+import contextlib
+import pandas as pd
+
+#resource only exists on Unix - peak RSS is left out of the trace elsewhere
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+'''
+Per-stage instrumentation. Wrap a stage in "with instrumentation.stage('fetch', ticker=ticker) as record:"
+(or decorate a function with @instrumentation.traced('fetch')) and, when tracing is on, each run of the stage
+is written as one JSON line with its wall time, CPU time, peak RSS, row and byte counts and tags. Worker
+processes of pipeline.process_pool trace to the same file. Every record carries the run id set by configure(),
+so a trace file shared by several runs is summarized one run at a time.
+Tracing is off until configure() turns it on; while it is off stage() hands back a shared no-op context
+manager, so instrumented code pays for one attribute check.
+'''
+
+
+class StageRecord:
+    '''
+    Measurements of one stage run; set rows and bytes inside the with block
+    '''
+
+    def __init__(self, stage: str, tags: dict):
+        self.stage = stage
+        self.tags = tags
+        self.rows = None
+        self.bytes = None
+
+
+class _NullRecord:
+    #Stands in for StageRecord while tracing is off - assignments are accepted and dropped
+    def __setattr__(self, name, value):
+        pass
+
+
+class _NullStage:
+    def __enter__(self):
+        return _NULL_RECORD
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_RECORD = _NullRecord()
+_NULL_STAGE = _NullStage()
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    #ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss / (1024.0 * 1024.0) if os.uname().sysname == 'Darwin' else peak_rss / 1024.0
+
+
+class Tracer:
+    '''
+    Writes stage records to a JSON-lines trace
+    args:
+        path: trace file, appended to; None keeps the records in memory only
+        enabled: whether stages are recorded at all
+        run_id: written with every record; None makes a new one from the time and process id
+    '''
+
+    def __init__(self, path: str = None, enabled: bool = True, run_id: str = None):
+        self.path = path
+        self.enabled = enabled
+        self.run_id = run_id if run_id is not None else '{}-{}'.format(datetime.datetime.now().strftime('%Y%m%dT%H%M%S.%f'), os.getpid())
+        self.records = []
+        self.lock = threading.Lock()
+        if path is not None and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def write(self, entry: dict) -> None:
+        line = json.dumps(entry, default=str)
+        with self.lock:
+            if self.path is None:
+                self.records.append(entry)
+                return
+            #One write per line in append mode, so lines from several threads and processes don't interleave
+            with open(self.path, 'a') as trace_file:
+                trace_file.write(line + '\n')
+
+    @contextlib.contextmanager
+    def stage(self, name: str, **tags):
+        record = StageRecord(name, tags)
+        start_wall = time.perf_counter()
+        start_cpu = time.thread_time()
+        start_peak_rss = _peak_rss_mb()
+        error = None
+        try:
+            yield record
+        except BaseException as exception:
+            error = repr(exception)
+            raise
+        finally:
+            peak_rss = _peak_rss_mb()
+            self.write({'run_id': self.run_id, 'stage': name, 'tags': tags, 'start': time.time() - (time.perf_counter() - start_wall),\
+                'wall_s': time.perf_counter() - start_wall, 'cpu_s': time.thread_time() - start_cpu,\
+                'peak_rss_mb': peak_rss, 'peak_rss_growth_mb': None if peak_rss is None else peak_rss - start_peak_rss,\
+                'rows': record.rows, 'bytes': record.bytes, 'pid': os.getpid(), 'thread': threading.current_thread().name,\
+                'error': error})
+
+    def read(self) -> list:
+        '''
+        Every record of the trace
+        '''
+        if self.path is None:
+            with self.lock:
+                return list(self.records)
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, 'r') as trace_file:
+            return [json.loads(line) for line in trace_file if line.strip()]
+
+
+#Tracer used by stage() and traced() - off until configure() is called
+_tracer = Tracer(enabled=False)
+
+
+def configure(path: str = None, enabled: bool = True, run_id: str = None) -> Tracer:
+    '''
+    Turn tracing on (or off) for this process and the pipeline.process_pool workers it starts afterwards
+    args:
+        path: JSON-lines trace file, appended to; None keeps the records in memory
+        enabled: False turns tracing off
+        run_id: id of the run the records belong to; None starts a new run - workers pass their parent's
+    rtypes:
+        tracer: the new tracer
+    '''
+    global _tracer
+    _tracer = Tracer(path= path, enabled= enabled, run_id= run_id)
+    return _tracer
+
+
+def get_tracer() -> Tracer:
+    return _tracer
+
+
+def stage(name: str, **tags):
+    '''
+    Context manager timing one stage run; yields a record whose rows and bytes can be set
+    args:
+        name: stage name, e.g. 'fetch' or 'write_pandas'
+        tags: anything identifying the run, e.g. ticker= or table=
+    '''
+    if not _tracer.enabled:
+        return _NULL_STAGE
+    return _tracer.stage(name, **tags)
+
+
+def traced(name: str):
+    '''
+    Decorator recording every call of a function as a stage
+    '''
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _tracer.enabled:
+                return function(*args, **kwargs)
+            with _tracer.stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def frame_size(dataframe) -> tuple:
+    '''
+    (rows, bytes) of a dataframe, for a stage record - bytes of the column data, strings not counted in full
+    '''
+    return len(dataframe), int(dataframe.memory_usage(index=False, deep=False).sum())
+
+
+def summary(tracer: Tracer = None, all_runs: bool = False) -> pd.DataFrame:
+    '''
+    One row per stage: runs, errors, wall and CPU time, rows, bytes and the highest peak RSS, slowest stage first
+    args:
+        tracer: tracer to summarize; defaults to the configured one
+        all_runs: summarize every run in the trace file instead of only the tracer's own run
+    '''
+    tracer = tracer or _tracer
+    records = tracer.read()
+    if not all_runs:
+        records = [record for record in records if record.get('run_id') == tracer.run_id]
+    columns = ['stage', 'runs', 'errors', 'wall_s', 'mean_wall_s', 'max_wall_s', 'cpu_s', 'rows', 'bytes', 'peak_rss_mb']
+    if not records:
+        return pd.DataFrame(columns=columns)
+    trace = pd.DataFrame(records)
+    trace['failed'] = trace['error'].notna()
+    stage_summary = trace.groupby('stage', sort=False).agg(runs= ('wall_s', 'size'), errors= ('failed', 'sum'),\
+        wall_s= ('wall_s', 'sum'), mean_wall_s= ('wall_s', 'mean'), max_wall_s= ('wall_s', 'max'), cpu_s= ('cpu_s', 'sum'),\
+        rows= ('rows', 'sum'), bytes= ('bytes', 'sum'), peak_rss_mb= ('peak_rss_mb', 'max')).reset_index()
+    return stage_summary.sort_values(by='wall_s', ascending=False).reset_index(drop=True)[columns]
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+
+#Core libraries
+import os
+import json
+import time
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+#Custom imports
+from money_robot_code import instrumentation
+
+
+'''
+Asynchronous DataRobot model factory. Projects are uploaded on a bounded pool of threads, the target is set
+(and Autopilot started) on a separate pool so a slow kickoff never holds an upload slot, and every step is
+recorded in a JSON manifest. Running the same factory again with the same manifest only does the work that
+is still missing, so a crashed run can simply be restarted.
+'''
+
+
+#Manifest states, in the order a project goes through them
+PENDING = 'pending'
+UPLOADING = 'uploading'
+UPLOADED = 'uploaded'
+MODELING = 'modeling'
+COMPLETED = 'completed'
+FAILED = 'failed'
+
+
+class ProjectManifest:
+    '''
+    JSON file with one entry per project: project name, id, state, Autopilot stage and last error, keyed by
+    the training table name. Every change is written straight to disk.
+    args:
+        path: path of the manifest file
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, 'r') as manifest_file:
+                self.entries = json.load(manifest_file)
+
+    def get(self, key: str) -> dict:
+        with self.lock:
+            return dict(self.entries[key]) if key in self.entries else None
+
+    def update(self, key: str, **fields) -> dict:
+        with self.lock:
+            entry = self.entries.setdefault(key, {'state': PENDING})
+            entry.update(fields)
+            entry['updated_at'] = datetime.datetime.now().isoformat()
+            self._write()
+            return dict(entry)
+
+    def items(self) -> list:
+        with self.lock:
+            return [(key, dict(entry)) for key, entry in self.entries.items()]
+
+    def _write(self) -> None:
+        #Write to a temp file and swap it in, so a crash never leaves a truncated manifest
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as manifest_file:
+            json.dump(self.entries, manifest_file, indent=2, sort_keys=True)
+        os.replace(temp_path, self.path)
+
+
+class ModelFactoryScheduler:
+    '''
+    Submits DataRobot projects without blocking the pipeline
+    args:
+        manifest: ProjectManifest recording the projects of this factory run
+        dr_client: the datarobot module, or a stand-in with the same Project API
+        max_in_flight_uploads: most project uploads running at once
+        max_target_workers: most set_target calls running at once
+        target: name of the target column
+        worker_count: modeling workers for Autopilot, -1 for the maximum
+        verbose: choose whether to add prints and logs
+    '''
+
+    def __init__(self, manifest: ProjectManifest, dr_client=None, max_in_flight_uploads: int = 4,\
+         max_target_workers: int = 16, target: str = 'TARGET', worker_count: int = -1, verbose=True):
+        if dr_client is None:
+            import datarobot as dr_client
+        self.manifest = manifest
+        self.dr = dr_client
+        self.target = target
+        self.worker_count = worker_count
+        self.verbose = verbose
+        self.upload_pool = ThreadPoolExecutor(max_workers=max_in_flight_uploads, thread_name_prefix='datarobot-upload')
+        self.target_pool = ThreadPoolExecutor(max_workers=max_target_workers, thread_name_prefix='datarobot-target')
+        #Bounds the queue as well as the running uploads, so frames waiting to be uploaded don't pile up in memory
+        self.upload_slots = threading.BoundedSemaphore(max_in_flight_uploads * 2)
+        self.futures = []
+        self.futures_lock = threading.Lock()
+
+    def submit(self, dataframe, project_name_prefix: str):
+        '''
+        Queue a project for the dataframe. Blocks only while the upload queue is full. Projects the manifest
+        already has are not created again: an uploaded project (or one whose set_target failed) only gets its
+        target set, and a project that is already modeling or done is skipped.
+        args:
+            dataframe: training dataframe
+            project_name_prefix: training table name, also the manifest key
+        '''
+        entry = self.manifest.get(project_name_prefix)
+        if entry is not None and entry['state'] in [MODELING, COMPLETED]:
+            if self.verbose: print('Project for {} already {}, skipping.'.format(project_name_prefix, entry['state']))
+            return
+        if entry is not None and 'project_id' in entry and entry['state'] in [UPLOADED, FAILED]:
+            self._submit_target(project_name_prefix, entry['project_id'])
+            return
+        if entry is None or 'project_name' not in entry:
+            entry = self.manifest.update(project_name_prefix, state= PENDING,\
+                project_name= f'{project_name_prefix}_{datetime.datetime.now()}')
+        self.upload_slots.acquire()
+        try:
+            future = self.upload_pool.submit(self._upload, project_name_prefix, entry['project_name'], dataframe)
+        except Exception:
+            self.upload_slots.release()
+            raise
+        with self.futures_lock:
+            self.futures.append(future)
+
+    def _find_project(self, project_name: str):
+        #An upload interrupted by a crash may still have created the project - look it up before creating another
+        for project in self.dr.Project.list(search_params={'project_name': project_name}):
+            if project.project_name == project_name:
+                return project
+        return None
+
+    def _upload(self, key: str, project_name: str, dataframe) -> None:
+        try:
+            previous_state = self.manifest.get(key)['state']
+            project = self._find_project(project_name) if previous_state in [UPLOADING, FAILED] else None
+            if project is None:
+                self.manifest.update(key, state= UPLOADING)
+                if self.verbose: print(f'Starting project {project_name}')
+                with instrumentation.stage('project_create', project= key) as record:
+                    record.rows, record.bytes = instrumentation.frame_size(dataframe)
+                    project = self.dr.Project.create(dataframe, project_name = project_name)
+            self.manifest.update(key, state= UPLOADED, project_id= project.id)
+        except Exception as error:
+            self.manifest.update(key, state= FAILED, error= repr(error))
+            raise
+        finally:
+            self.upload_slots.release()
+        self._submit_target(key, project.id)
+
+    def _submit_target(self, key: str, project_id: str) -> None:
+        future = self.target_pool.submit(self._set_target, key, project_id)
+        with self.futures_lock:
+            self.futures.append(future)
+
+    def _set_target(self, key: str, project_id: str) -> None:
+        try:
+            with instrumentation.stage('set_target', project= key):
+                project = self.dr.Project.get(project_id)
+                project.set_target(target = self.target, worker_count = self.worker_count)
+            self.manifest.update(key, state= MODELING)
+        except Exception as error:
+            self.manifest.update(key, state= FAILED, error= repr(error))
+            raise
+
+    def wait(self) -> dict:
+        '''
+        Wait for every queued upload and set_target call. Failures are recorded in the manifest rather than
+        raised, so one bad project doesn't stop the others.
+        rtypes:
+            projects: dict of manifest key -> project id for every project that was created
+        '''
+        while True:
+            with self.futures_lock:
+                futures, self.futures = self.futures, []
+            if not futures:
+                break
+            for future in futures:
+                future.exception()
+        return {key: entry['project_id'] for key, entry in self.manifest.items() if 'project_id' in entry}
+
+    def poll(self) -> dict:
+        '''
+        Check Autopilot on every project that is modeling and record its status in the manifest
+        rtypes:
+            states: dict of manifest key -> state
+        '''
+        for key, entry in self.manifest.items():
+            if entry['state'] != MODELING:
+                continue
+            try:
+                status = self.dr.Project.get(entry['project_id']).get_status()
+            except Exception as error:
+                if self.verbose: print('Could not get the status of project {}: {!r}'.format(entry['project_id'], error))
+                continue
+            self.manifest.update(key, state= COMPLETED if status.get('autopilot_done') else MODELING,\
+                stage= status.get('stage'))
+        return {key: entry['state'] for key, entry in self.manifest.items()}
+
+    def wait_for_autopilot(self, poll_interval: float = 60, timeout: float = None) -> dict:
+        '''
+        Poll until no project is modeling any more, or timeout seconds have passed
+        '''
+        start = time.monotonic()
+        while True:
+            states = self.poll()
+            if MODELING not in states.values():
+                return states
+            if timeout is not None and time.monotonic() - start > timeout:
+                return states
+            time.sleep(poll_interval)
+
+    def close(self) -> None:
+        self.wait()
+        self.upload_pool.shutdown(wait=True)
+        self.target_pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
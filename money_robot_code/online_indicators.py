@@ -0,0 +1,728 @@
+# -*- coding: utf-8 -*-
+
+#Core libraries
+import os
+import pickle
+from collections import deque
+import numpy as np
+import pandas as pd
+
+#Custom imports
+from money_robot_code import indicator_engine
+
+
+'''
+Online (incremental) mode for the native indicator engine. OnlineIndicatorState is built once from a
+ticker's history and then takes new daily bars one at a time, emitting the same feature rows a full
+indicator_engine.compute_indicators run over the extended history would give:
+    - recursive indicators (EMAs, Wilder averages, cumulative sums, PSAR, KAMA...) keep their running
+      accumulators and are advanced bar by bar, in the same order of operations as the array kernels
+    - window indicators (rolling sums, bands, channels, ichimoku...) are recomputed by the engine's own
+      group functions over a fixed tail of raw bars, which is longer than their deepest lookback
+    - ta's fillna rule is applied online by carrying the last valid value of every column
+Cost per bar is constant - it doesn't grow with the length of the history.
+'''
+
+
+#Raw bars kept for the window indicators - the deepest lookback is the visual ichimoku (52 bar span shifted 26)
+TAIL_LENGTH = 100
+
+#Shortest history an online state can be built from - ta switches to different rules on very short series
+MIN_HISTORY_LENGTH = TAIL_LENGTH
+
+
+#-----------------------------------------------------------------------------------------------
+# Scalar kernels - one bar at a time versions of the array kernels in indicator_engine
+#-----------------------------------------------------------------------------------------------
+
+class _EWM:
+    '''
+    pandas' ewm(alpha=alpha, adjust=False).mean(), same steps as indicator_engine._ewm_mean_loop
+    '''
+
+    def __init__(self, alpha: float):
+        self.alpha = alpha
+        self.weighted = np.nan
+        self.old_weight = 1.0
+
+    def update(self, value):
+        if self.weighted == self.weighted:
+            self.old_weight *= 1.0 - self.alpha
+            if value == value:
+                if self.weighted != value:
+                    self.weighted = (self.old_weight * self.weighted + self.alpha * value) / (self.old_weight + self.alpha)
+                self.old_weight = 1.0
+        elif value == value:
+            self.weighted = value
+        return self.weighted
+
+
+def _ema(window: int) -> _EWM:
+    return _EWM(2.0 / (window + 1.0))
+
+
+class _Window:
+    '''
+    pandas-style rolling statistic over the last window bars, same rules as indicator_engine._rolling
+    (missing values and infinities are skipped)
+    '''
+
+    def __init__(self, window: int, min_periods: int, statistic: str):
+        self.values = deque(maxlen=window)
+        self.min_periods = min_periods
+        self.statistic = statistic
+
+    def update(self, value):
+        self.values.append(value)
+        valid = [item for item in self.values if item == item and item not in (np.inf, -np.inf)]
+        if self.statistic == 'sum' and self.min_periods == 0:
+            return np.float64(sum(valid))
+        if len(valid) < max(self.min_periods, 1):
+            return np.nan
+        if self.statistic == 'max':
+            return max(valid)
+        if self.statistic == 'min':
+            return min(valid)
+        if self.statistic == 'sum':
+            return np.float64(sum(valid))
+        return np.float64(sum(valid)) / len(valid)
+
+
+class _FillForward:
+    '''
+    ta's fillna rule one value at a time: infinities and missing values are replaced by the last valid
+    value, or by value if there hasn't been one yet
+    '''
+
+    def __init__(self, value):
+        self.value = value
+        self.last_valid = None
+
+    def update(self, value, fill_value=None):
+        if value == value and not np.isinf(value):
+            self.last_valid = value
+            return value
+        if self.last_valid is not None:
+            return self.last_valid
+        return self.value if fill_value is None else fill_value
+
+
+def _true_range(bar: dict, previous_close):
+    return np.fmax(np.fmax(bar['high'] - bar['low'], abs(bar['high'] - previous_close)), abs(bar['low'] - previous_close))
+
+
+#-----------------------------------------------------------------------------------------------
+# Recursive indicator groups - update(bar, previous) takes the new bar and the one before it as dicts
+# of open/high/low/close/volume (all missing before the first bar) and returns column -> raw value
+#-----------------------------------------------------------------------------------------------
+
+class _VolumeADI:
+    def __init__(self):
+        self.total = np.float64(0.0)
+
+    def update(self, bar: dict, previous: dict) -> dict:
+        clv = ((bar['close'] - bar['low']) - (bar['high'] - bar['close'])) / (bar['high'] - bar['low'])
+        if clv != clv:
+            clv = 0.0
+        self.total = self.total + clv * bar['volume']
+        return {'volume_adi': self.total}
+
+
+class _VolumeOBV:
+    def __init__(self):
+        self.total = np.float64(0.0)
+
+    def update(self, bar: dict, previous: dict) -> dict:
+        self.total = self.total + (-bar['volume'] if bar['close'] < previous['close'] else bar['volume'])
+        return {'volume_obv': self.total}
+
+
+class _VolumeFI:
+    def __init__(self):
+        self.ema = _ema(13)
+
+    def update(self, bar: dict, previous: dict) -> dict:
+        return {'volume_fi': self.ema.update((bar['close'] - previous['close']) * bar['volume'])}
+
+
+class _VolumeNVI:
+    def __init__(self):
+        self.value = None
+
+    def update(self, bar: dict, previous: dict) -> dict:
+        if self.value is None:
+            self.value = np.float64(1000.0)
+        elif previous['volume'] > bar['volume']:
+            self.value = self.value * (1.0 + (bar['close'] / previous['close'] - 1))
+        return {'volume_nvi': self.value}
+
+
+class _VolatilityATR:
+    def __init__(self, window: int = 10):
+        self.window = window
+        self.first_values = []
+        self.average = None
+
+    def update(self, bar: dict, previous: dict) -> dict:
+        true_range = _true_range(bar, previous['close'])
+        if self.average is None:
+            self.first_values.append(true_range)
+            if len(self.first_values) < self.window:
+                return {'volatility_atr': np.float64(0.0)}
+            self.average = np.mean(self.first_values)
+        else:
+            self.average = ((self.window - 1.0) / self.window) * self.average + (1.0 / self.window) * true_range
+        return {'volatility_atr': self.average}
+
+
+class _TrendMACD:
+    def __init__(self):
+        self.ema_fast, self.ema_slow, self.ema_signal = _ema(12), _ema(26), _ema(9)
+
+    def update(self, bar: dict, previous: dict) -> dict:
+        macd = self.ema_fast.update(bar['close']) - self.ema_slow.update(bar['close'])
+        macd_signal = self.ema_signal.update(macd)
+        return {
+            'trend_macd': macd,
+            'trend_macd_signal': macd_signal,
+            'trend_macd_diff': macd - macd_signal,
+        }
+
+
+class _TrendEMA:
+    def __init__(self):
+        self.ema_fast, self.ema_slow = _ema(12), _ema(26)
+
+    def update(self, bar: dict, previous: dict) -> dict:
+        return {'trend_ema_fast': self.ema_fast.update(bar['close']), 'trend_ema_slow': self.ema_slow.update(bar['close'])}
+
+
+class _TrendTRIX:
+    def __init__(self):
+        self.emas = [_ema(15), _ema(15), _ema(15)]
+        self.previous_triple_ema = np.nan
+
+    def update(self, bar: dict, previous: dict) -> dict:
+        triple_ema = bar['close']
+        for ema in self.emas:
+            triple_ema = ema.update(triple_ema)
+        trix = ((triple_ema - self.previous_triple_ema) / self.previous_triple_ema) * 100
+        self.previous_triple_ema = triple_ema
+        return {'trend_trix': trix}
+
+
+class _TrendMassIndex:
+    def __init__(self):
+        self.single_ema, self.double_ema = _ema(9), _ema(9)
+        self.ratio_sum = _Window(25, 0, 'sum')
+
+    def update(self, bar: dict, previous: dict) -> dict:
+        single_ema = self.single_ema.update(bar['high'] - bar['low'])
+        double_ema = self.double_ema.update(single_ema)
+        return {'trend_mass_index': self.ratio_sum.update(single_ema / double_ema)}
+
+
+class _TrendSTC:
+    def __init__(self):
+        self.ema_fast, self.ema_slow = _ema(23), _ema(50)
+        self.macd_min, self.macd_max = _Window(10, 10, 'min'), _Window(10, 10, 'max')
+        self.stoch_d_ema = _ema(3)
+        self.stoch_d_min, self.stoch_d_max = _Window(10, 10, 'min'), _Window(10, 10, 'max')
+        self.stc_ema = _ema(3)
+
+    def update(self, bar: dict, previous: dict) -> dict:
+        macd = self.ema_fast.update(bar['close']) - self.ema_slow.update(bar['close'])
+        macd_min = self.macd_min.update(macd)
+        stoch_k = 100 * (macd - macd_min) / (self.macd_max.update(macd) - macd_min)
+        stoch_d = self.stoch_d_ema.update(stoch_k)
+        stoch_d_min = self.stoch_d_min.update(stoch_d)
+        stoch_kd = 100 * (stoch_d - stoch_d_min) / (self.stoch_d_max.update(stoch_d) - stoch_d_min)
+        return {'trend_stc': self.stc_ema.update(stoch_kd)}
+
+
+class _TrendADX:
+    '''
+    ta's ADX, bar by bar: the directional sums are seeded with the sum of the first window observations
+    (bar window) and then decayed, the ADX is the mean of the first window DX values (bar 2 * window - 1)
+    followed by Wilder smoothing, and every output is 0 until it is defined
+    '''
+
+    def __init__(self, window: int = 14):
+        self.window = window
+        self.first_values = []
+        self.sums = None
+        self.first_directional_index = []
+        self.adx = None
+
+    def update(self, bar: dict, previous: dict) -> dict:
+        window = self.window
+        outputs = {'trend_adx': np.float64(0.0), 'trend_adx_pos': np.float64(0.0), 'trend_adx_neg': np.float64(0.0)}
+        if previous['close'] != previous['close']:
+            return outputs
+        directional_movement = max(bar['high'], previous['close']) - min(bar['low'], previous['close'])
+        diff_up = bar['high'] - previous['high']
+        diff_down = previous['low'] - bar['low']
+        positive = diff_up if (diff_up > diff_down and diff_up > 0) else np.float64(0.0)
+        negative = diff_down if (diff_down > diff_up and diff_down > 0) else np.float64(0.0)
+        values = (directional_movement, abs(positive), abs(negative))
+
+        if self.sums is None:
+            self.first_values.append(values)
+            if len(self.first_values) < window:
+                return outputs
+            self.sums = [np.float64(sum(column)) for column in zip(*self.first_values)]
+            report_directional_indices = False
+        else:
+            self.sums = [(1.0 - 1.0 / window) * total + value for total, value in zip(self.sums, values)]
+            report_directional_indices = True
+
+        true_range_sum, positive_sum, negative_sum = self.sums
+        positive_index = 100 * (positive_sum / true_range_sum)
+        negative_index = 100 * (negative_sum / true_range_sum)
+        directional_index = 100 * abs((positive_index - negative_index) / (positive_index + negative_index))
+        if self.adx is None:
+            self.first_directional_index.append(directional_index)
+            if len(self.first_directional_index) == window:
+                self.adx = np.mean(self.first_directional_index)
+        else:
+            self.adx = ((window - 1.0) / window) * self.adx + (1.0 / window) * directional_index
+
+        if self.adx is not None:
+            outputs['trend_adx'] = self.adx
+        if report_directional_indices:
+            outputs['trend_adx_pos'] = positive_index
+            outputs['trend_adx_neg'] = negative_index
+        return outputs
+
+
+class _TrendPSAR:
+    def __init__(self, step: float = 0.02, max_step: float = 0.20):
+        self.step, self.max_step = step, max_step
+        self.up_trend = True
+        self.acceleration_factor = step
+        self.up_trend_high = None
+        self.down_trend_low = None
+        self.highs = deque(maxlen=2)
+        self.lows = deque(maxlen=2)
+        self.psar = None
+        self.previous_psar_up = np.nan
+        self.previous_psar_down = np.nan
+
+    def update(self, bar: dict, previous: dict) -> dict:
+        psar_up, psar_down = np.nan, np.nan
+        if self.up_trend_high is None:
+            self.up_trend_high, self.down_trend_low = bar['high'], bar['low']
+        if len(self.highs) < 2:
+            psar = bar['close']
+        else:
+            reversal = False
+            max_high, min_low = bar['high'], bar['low']
+            if self.up_trend:
+                psar = self.psar + (self.acceleration_factor * (self.up_trend_high - self.psar))
+                if min_low < psar:
+                    reversal = True
+                    psar = self.up_trend_high
+                    self.down_trend_low = min_low
+                    self.acceleration_factor = self.step
+                else:
+                    if max_high > self.up_trend_high:
+                        self.up_trend_high = max_high
+                        self.acceleration_factor = min(self.acceleration_factor + self.step, self.max_step)
+                    if self.lows[0] < psar:
+                        psar = self.lows[0]
+                    elif self.lows[1] < psar:
+                        psar = self.lows[1]
+            else:
+                psar = self.psar - (self.acceleration_factor * (self.psar - self.down_trend_low))
+                if max_high > psar:
+                    reversal = True
+                    psar = self.down_trend_low
+                    self.up_trend_high = max_high
+                    self.acceleration_factor = self.step
+                else:
+                    if min_low < self.down_trend_low:
+                        self.down_trend_low = min_low
+                        self.acceleration_factor = min(self.acceleration_factor + self.step, self.max_step)
+                    if self.highs[0] > psar:
+                        psar = self.highs[0]
+                    elif self.highs[1] > psar:
+                        psar = self.highs[1]
+            self.up_trend = self.up_trend != reversal
+            if self.up_trend:
+                psar_up = psar
+            else:
+                psar_down = psar
+        self.psar = psar
+        self.highs.append(bar['high'])
+        self.lows.append(bar['low'])
+
+        up_indicator = psar_up == psar_up and self.previous_psar_up != self.previous_psar_up and psar_up != 0
+        down_indicator = psar_down == psar_down and self.previous_psar_down != self.previous_psar_down
+        self.previous_psar_up, self.previous_psar_down = psar_up, psar_down
+        return {
+            'trend_psar_up': np.float64(psar_up),
+            'trend_psar_down': np.float64(psar_down),
+            'trend_psar_up_indicator': np.float64(1.0 if up_indicator else 0.0),
+            'trend_psar_down_indicator': np.float64(1.0 if down_indicator else 0.0),
+        }
+
+
+class _RSI:
+    def __init__(self, window: int = 14):
+        self.ema_up, self.ema_down = _EWM(1.0 / window), _EWM(1.0 / window)
+        self.fill = _FillForward(50)
+
+    def update(self, bar: dict, previous: dict):
+        diff = bar['close'] - previous['close']
+        ema_up = self.ema_up.update(diff if diff > 0 else np.float64(0.0))
+        ema_down = self.ema_down.update(-diff if diff < 0 else np.float64(0.0))
+        rsi = np.float64(100.0) if ema_down == 0 else 100 - (100 / (1 + ema_up / ema_down))
+        return self.fill.update(rsi)
+
+
+class _MomentumRSI:
+    def __init__(self):
+        self.rsi = _RSI(14)
+
+    def update(self, bar: dict, previous: dict) -> dict:
+        return {'momentum_rsi': self.rsi.update(bar, previous)}
+
+
+class _MomentumStochRSI:
+    def __init__(self):
+        self.rsi = _RSI(14)
+        self.rsi_min, self.rsi_max = _Window(14, 14, 'min'), _Window(14, 14, 'max')
+        self.stoch_rsi_k, self.stoch_rsi_d = _Window(3, 3, 'mean'), _Window(3, 3, 'mean')
+
+    def update(self, bar: dict, previous: dict) -> dict:
+        rsi = self.rsi.update(bar, previous)
+        lowest_rsi = self.rsi_min.update(rsi)
+        stoch_rsi = (rsi - lowest_rsi) / (self.rsi_max.update(rsi) - lowest_rsi)
+        if np.isinf(stoch_rsi):
+            stoch_rsi = np.nan
+        stoch_rsi_k = self.stoch_rsi_k.update(stoch_rsi)
+        return {
+            'momentum_stoch_rsi': np.float64(stoch_rsi),
+            'momentum_stoch_rsi_k': np.float64(stoch_rsi_k),
+            'momentum_stoch_rsi_d': np.float64(self.stoch_rsi_d.update(stoch_rsi_k)),
+        }
+
+
+class _MomentumTSI:
+    def __init__(self):
+        self.smoothed = [_ema(25), _ema(13)]
+        self.smoothed_absolute = [_ema(25), _ema(13)]
+
+    def update(self, bar: dict, previous: dict) -> dict:
+        diff = bar['close'] - previous['close']
+        smoothed, smoothed_absolute = diff, abs(diff)
+        for ema, ema_absolute in zip(self.smoothed, self.smoothed_absolute):
+            smoothed, smoothed_absolute = ema.update(smoothed), ema_absolute.update(smoothed_absolute)
+        return {'momentum_tsi': (smoothed / smoothed_absolute) * 100}
+
+
+class _PercentageOscillator:
+    def __init__(self, source: str, prefix: str):
+        self.source, self.prefix = source, prefix
+        self.ema_fast, self.ema_slow, self.ema_signal = _ema(12), _ema(26), _ema(9)
+
+    def update(self, bar: dict, previous: dict) -> dict:
+        ema_slow = self.ema_slow.update(bar[self.source])
+        oscillator = ((self.ema_fast.update(bar[self.source]) - ema_slow) / ema_slow) * 100
+        oscillator_signal = self.ema_signal.update(oscillator)
+        return {
+            self.prefix: oscillator,
+            self.prefix + '_signal': oscillator_signal,
+            self.prefix + '_hist': oscillator - oscillator_signal,
+        }
+
+
+class _MomentumKAMA:
+    '''
+    ta builds KAMA with np.roll, so its first window bars compare against the end of the series. Pass the
+    last window closes of the history as initial_closes to reproduce that while replaying the history;
+    later bars then differ from a full recompute only through that start-of-series term, which decays away.
+    '''
+
+    def __init__(self, window: int = 10, fast: int = 2, slow: int = 30, initial_closes=()):
+        self.window, self.fast, self.slow = window, fast, slow
+        self.closes = deque(initial_closes, maxlen=window + 1)
+        self.volatility = _Window(window, 0, 'sum')
+        self.kama = np.nan
+        self.first_value = True
+
+    def update(self, bar: dict, previous: dict) -> dict:
+        price = bar['close']
+        self.closes.append(price)
+        volatility_sum = self.volatility.update(abs(price - self.closes[-2]) if len(self.closes) > 1 else np.nan)
+        efficiency_ratio = abs(price - self.closes[0]) / volatility_sum if len(self.closes) > self.window else np.nan
+        smoothing_constant = (efficiency_ratio * (2.0 / (self.fast + 1) - 2.0 / (self.slow + 1.0)) + 2 / (self.slow + 1.0)) ** 2.0
+        if smoothing_constant != smoothing_constant:
+            self.kama = np.nan
+        elif self.first_value:
+            self.kama = price
+            self.first_value = False
+        else:
+            self.kama = self.kama + smoothing_constant * (price - self.kama)
+        return {'momentum_kama': np.float64(self.kama)}
+
+
+class _OthersCR:
+    def __init__(self):
+        self.first_close = None
+
+    def update(self, bar: dict, previous: dict) -> dict:
+        if self.first_close is None:
+            self.first_close = bar['close']
+        return {'others_cr': (bar['close'] / self.first_close - 1) * 100}
+
+
+#Recursive groups, keyed by the first column of the matching indicator_engine group. Every other group only
+#looks back a fixed number of bars and is recomputed over the raw tail.
+RECURSIVE_GROUPS = {
+    'volume_adi': _VolumeADI,
+    'volume_obv': _VolumeOBV,
+    'volume_fi': _VolumeFI,
+    'volume_nvi': _VolumeNVI,
+    'volatility_atr': _VolatilityATR,
+    'trend_macd': _TrendMACD,
+    'trend_ema_fast': _TrendEMA,
+    'trend_trix': _TrendTRIX,
+    'trend_mass_index': _TrendMassIndex,
+    'trend_stc': _TrendSTC,
+    'trend_adx': _TrendADX,
+    'trend_psar_up': _TrendPSAR,
+    'momentum_rsi': _MomentumRSI,
+    'momentum_stoch_rsi': _MomentumStochRSI,
+    'momentum_tsi': _MomentumTSI,
+    'momentum_ppo': lambda: _PercentageOscillator('close', 'momentum_ppo'),
+    'momentum_pvo': lambda: _PercentageOscillator('volume', 'momentum_pvo'),
+    'momentum_kama': _MomentumKAMA,
+    'others_cr': _OthersCR,
+}
+
+PRICE_FIELDS = ['open', 'high', 'low', 'close', 'volume']
+
+
+class OnlineIndicatorState:
+    '''
+    Running indicator state for one ticker. Build it with from_history, then call update with each new
+    batch of bars to get their feature rows without recomputing the history.
+    args:
+        indicators: list of indicator columns to produce (names as in indicator_engine.ALL_INDICATOR_COLUMNS);
+        None produces all of them
+        dtype: dtype of the output columns
+        open, high, low, close, volume: names of the price columns
+    '''
+
+    def __init__(self, indicators=None, dtype='float64', open="Open", high="High", low="Low", close="Close",\
+         volume="Volume"):
+        if indicators is None:
+            self.columns = list(indicator_engine.ALL_INDICATOR_COLUMNS)
+        else:
+            unknown_columns = [column for column in indicators if column not in indicator_engine.ALL_INDICATOR_COLUMNS]
+            if unknown_columns:
+                raise ValueError('Unknown indicators: {}'.format(', '.join(unknown_columns)))
+            self.columns = [column for column in indicator_engine.ALL_INDICATOR_COLUMNS if column in set(indicators)]
+        self.dtype = dtype
+        self.price_columns = {'open': open, 'high': high, 'low': low, 'close': close, 'volume': volume}
+
+        #Split the engine's groups into ones advanced bar by bar and ones recomputed over the tail
+        self.recursive_groups = []
+        self.window_groups = []
+        for group_function, group_columns in indicator_engine.INDICATOR_GROUPS:
+            if not any(column in self.columns for column in group_columns):
+                continue
+            if group_columns[0] in RECURSIVE_GROUPS:
+                self.recursive_groups.append((group_columns[0], RECURSIVE_GROUPS[group_columns[0]]()))
+            else:
+                self.window_groups.append(group_function)
+        self.fills = {column: _FillForward(indicator_engine.FILL_VALUES[column]) for column in self.columns\
+            if column in indicator_engine.FILL_VALUES}
+        self.tail = {field: np.empty(0) for field in PRICE_FIELDS}
+        self.previous_bar = {field: np.float64(np.nan) for field in PRICE_FIELDS}
+        self.bar_count = 0
+        self.last_date = None
+        #Close of the last bar - with bar_count, ties the state to the adjusted prices it was built from
+        self.last_close = None
+        #Indicator row of the last bar, so its feature row can be served again without recomputing the history
+        self.last_indicators = None
+
+    @classmethod
+    def from_history(cls, price_dataframe: pd.DataFrame, indicators=None, dtype='float64', **price_columns):
+        '''
+        Build the state from a ticker's full history (oldest bar first). The history itself is computed
+        with indicator_engine.compute_indicators; its feature rows are kept in history_features.
+        args:
+            price_dataframe: price history with the OHLCV columns and optionally a "Date" column
+            indicators, dtype, price_columns: see OnlineIndicatorState
+        rtypes:
+            state: OnlineIndicatorState positioned after the last bar of the history
+        '''
+        if len(price_dataframe) < MIN_HISTORY_LENGTH:
+            raise ValueError('Online indicators need at least {} bars of history, got {}'.format(MIN_HISTORY_LENGTH,\
+                len(price_dataframe)))
+        state = cls(indicators= indicators, dtype= dtype, **price_columns)
+        prices = state._price_arrays(price_dataframe)
+        for position, (name, group) in enumerate(state.recursive_groups):
+            if name == 'momentum_kama':
+                state.recursive_groups[position] = (name, _MomentumKAMA(initial_closes= prices['close'][-10:]))
+
+        #Replay the recursive groups over the history to bring their accumulators up to the last bar
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for bar in state._bars(prices):
+                for _, group in state.recursive_groups:
+                    group.update(bar, state.previous_bar)
+                state.previous_bar = bar
+        state.bar_count = len(price_dataframe)
+        state.last_close = prices['close'][-1]
+        state.tail = {field: values[-TAIL_LENGTH:] for field, values in prices.items()}
+
+        #The last filled value of every column is what ta's fillna carries into the next bar
+        state.history_features = indicator_engine.compute_indicators(price_dataframe, indicators= state.columns,\
+            dtype= dtype, **state.price_columns)
+        for column, fill in state.fills.items():
+            fill.last_valid = np.float64(state.history_features[column].iloc[-1])
+        state.last_indicators = state.history_features.iloc[-1:].copy()
+        if 'Date' in price_dataframe.columns:
+            state.last_date = price_dataframe['Date'].iloc[-1]
+        return state
+
+    def update(self, price_dataframe: pd.DataFrame) -> pd.DataFrame:
+        '''
+        Add new bars and return their feature rows. Bars dated on or before the last bar already in the
+        state are skipped, so the full stored history can be passed in as well.
+        args:
+            price_dataframe: new bars, oldest first, with the OHLCV columns and optionally a "Date" column
+        rtypes:
+            indicator_dataframe: one row per new bar, same columns as indicator_engine.compute_indicators
+        '''
+        if self.last_date is not None and 'Date' in price_dataframe.columns:
+            price_dataframe = price_dataframe[pd.to_datetime(price_dataframe['Date']) > pd.Timestamp(self.last_date)]
+        if len(price_dataframe) == 0:
+            return pd.DataFrame(columns=self.columns, dtype=self.dtype)
+        prices = self._price_arrays(price_dataframe)
+        new_bar_count = len(price_dataframe)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            #Recursive groups, bar by bar
+            indicator_rows = []
+            for bar in self._bars(prices):
+                indicator_row = {}
+                for _, group in self.recursive_groups:
+                    indicator_row.update(group.update(bar, self.previous_bar))
+                indicator_rows.append(indicator_row)
+                self.previous_bar = bar
+
+            #Window groups, over the stored tail plus the new bars
+            tail_prices = {field: np.concatenate([self.tail[field], prices[field]]) for field in PRICE_FIELDS}
+            window_values = {}
+            group_prices = dict(tail_prices)
+            for group_function in self.window_groups:
+                window_values.update(group_function(group_prices))
+
+            indicator_values = {}
+            for column in self.columns:
+                if column in window_values:
+                    values = window_values[column][-new_bar_count:]
+                else:
+                    values = np.array([indicator_row[column] for indicator_row in indicator_rows], dtype=np.float64)
+                if column in self.fills:
+                    fill_value = self.fills[column].value
+                    values = np.array([self.fills[column].update(value, prices['close'][position] if fill_value == 'close' else None)\
+                        for position, value in enumerate(values)], dtype=np.float64)
+                indicator_values[column] = values
+
+        self.tail = {field: values[-TAIL_LENGTH:] for field, values in tail_prices.items()}
+        self.bar_count += new_bar_count
+        self.last_close = prices['close'][-1]
+        if 'Date' in price_dataframe.columns:
+            self.last_date = price_dataframe['Date'].iloc[-1]
+        #One block instead of a column at a time - building the frame column-wise costs more than the update itself
+        indicator_matrix = np.column_stack([indicator_values[column] for column in self.columns]).astype(self.dtype, copy=False)
+        indicator_dataframe = pd.DataFrame(indicator_matrix, index=price_dataframe.index, columns=self.columns)
+        self.last_indicators = indicator_dataframe.iloc[-1:].copy()
+        return indicator_dataframe
+
+    def matches_history(self, price_dataframe: pd.DataFrame) -> bool:
+        '''
+        Check that a history is the one the state was built from: its bar at last_date is the state's
+        bar_count-th bar and has the same close. A split or dividend re-adjusts every past price (and the
+        price store re-downloads the history), which leaves the state's accumulators on the old prices -
+        such a state has to be rebuilt with from_history.
+        args:
+            price_dataframe: full price history, oldest bar first, that update would be called with
+        rtypes:
+            matches: False when the state must be rebuilt
+        '''
+        if getattr(self, 'last_close', None) is None or len(price_dataframe) < self.bar_count:
+            return False
+        if self.last_date is not None and 'Date' in price_dataframe.columns:
+            positions = np.flatnonzero(pd.to_datetime(price_dataframe['Date']).to_numpy() == pd.Timestamp(self.last_date).to_datetime64())
+            if len(positions) != 1 or positions[0] != self.bar_count - 1:
+                return False
+        close = price_dataframe[self.price_columns['close']].to_numpy(dtype=np.float64)[self.bar_count - 1]
+        return bool(np.isclose(close, self.last_close, rtol=1e-9, atol=0.0))
+
+    def _price_arrays(self, price_dataframe: pd.DataFrame) -> dict:
+        return {field: price_dataframe[column].to_numpy(dtype=np.float64) for field, column in self.price_columns.items()}
+
+    def _bars(self, prices: dict):
+        for values in zip(*[prices[field].tolist() for field in PRICE_FIELDS]):
+            yield {field: np.float64(value) for field, value in zip(PRICE_FIELDS, values)}
+
+    def __getstate__(self):
+        #The history frame is only there for the caller of from_history - don't write it to disk
+        state = self.__dict__.copy()
+        state.pop('history_features', None)
+        return state
+
+
+class OnlineIndicatorStore:
+    '''
+    On-disk store of OnlineIndicatorState objects, one pickle file per ticker, next to the price store
+    args:
+        directory: folder holding <ticker>.pkl files
+        cache: also keep the states in memory, so a long-running process only reads each file once. The
+        cached states are the live objects - read, update and write them under one lock per ticker.
+    '''
+
+    def __init__(self, directory: str = 'data/indicator_state', cache=False):
+        self.directory = directory
+        self.cache = {} if cache else None
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, ticker: str) -> str:
+        return os.path.join(self.directory, ticker + '.pkl')
+
+    def read(self, ticker: str):
+        '''
+        Read the saved state for a ticker, or None if nothing has been saved yet
+        '''
+        if self.cache is not None and ticker in self.cache:
+            return self.cache[ticker]
+        if not os.path.exists(self.path(ticker)):
+            return None
+        with open(self.path(ticker), 'rb') as state_file:
+            state = pickle.load(state_file)
+        if self.cache is not None:
+            self.cache[ticker] = state
+        return state
+
+    def write(self, ticker: str, state: OnlineIndicatorState) -> None:
+        #Write to a temp file and swap it in, so an interrupted run never leaves a truncated file
+        temp_path = self.path(ticker) + '.tmp'
+        with open(temp_path, 'wb') as state_file:
+            pickle.dump(state, state_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self.path(ticker))
+        if self.cache is not None:
+            self.cache[ticker] = state
+
+    def delete(self, ticker: str) -> None:
+        '''
+        Drop the saved state for a ticker, so the next update_feature_rows builds it again from the history
+        '''
+        if self.cache is not None:
+            self.cache.pop(ticker, None)
+        if os.path.exists(self.path(ticker)):
+            os.remove(self.path(ticker))
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+
+#Core libraries
+import os
+import multiprocessing
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+#Custom imports
+from money_robot_code import data_engineering
+from money_robot_code import instrumentation
+from money_robot_code import stage_cache as stage_cache_operations
+
+
+#Modules whose source each cached stage depends on - editing one of them invalidates that stage's entries
+STAGE_MODULES = {
+    'features': ['money_robot_code.data_engineering', 'money_robot_code.indicator_engine', 'money_robot_code.schema'],
+    'target': ['money_robot_code.data_engineering', 'money_robot_code.quantile_engine'],
+    'table': ['money_robot_code.database_operations', 'money_robot_code.schema'],
+    'project': ['money_robot_code.model_factory'],
+}
+
+
+def table_name(table_prefix: str, ticker: str, strategy: str, shift_period: int, move_value: float, split: str) -> str:
+    '''
+    Name of the table (and dataframe) for one configuration, in the format Snowflake needs
+    args:
+        table_prefix, ticker, strategy, shift_period, move_value: the configuration
+        split: 'TRAIN' or 'TEST'
+    rtypes:
+        name: e.g. PREFIX_AAPL_BUY_SHIFT_5_MOVE_0_9_TRAIN
+    '''
+    strategy_string = strategy.upper() #convert string to upper to create the table name
+    move_value_string = str(move_value)
+    if "." in str(move_value):
+        move_value_string = move_value_string.replace('.', '_')
+    return table_prefix+'_'+ticker+'_'+strategy_string+'_'+'SHIFT'+'_'+str(shift_period)+'_'+'MOVE'+'_'+move_value_string+'_'+split
+
+
+def iterate_configurations(strategy_list: list, shift_period_list: list, move_value_list: list):
+    '''
+    Every (strategy, shift_period, move_value) configuration, in the order main.py has always built them
+    '''
+    for strategy in strategy_list:
+        for shift_period in shift_period_list:
+            for move_value in move_value_list:
+                yield strategy, shift_period, move_value
+
+
+def configuration_names(table_prefix: str, ticker_list: list, strategy_list: list, shift_period_list: list,\
+     move_value_list: list) -> dict:
+    '''
+    Every table name of a run, mapped to its configuration
+    rtypes:
+        names: dict of table name -> (ticker, strategy, shift_period, move_value, split), in the order main.py builds them
+    '''
+    names = {}
+    for ticker in ticker_list:
+        for strategy, shift_period, move_value in iterate_configurations(strategy_list= strategy_list,\
+            shift_period_list= shift_period_list, move_value_list= move_value_list):
+            for split in ['TRAIN', 'TEST']:
+                names[table_name(table_prefix= table_prefix, ticker= ticker, strategy= strategy, shift_period= shift_period,\
+                    move_value= move_value, split= split)] = (ticker, strategy, shift_period, move_value, split)
+    return names
+
+
+def build_target_matrix_cached(close, shift_period_list: list, move_value_list: list, strategy_list: list,\
+     stage_cache, target_settings=None, verbose=True):
+    '''
+    data_engineering.build_target_matrix with every configuration's target cached on its own, so growing
+    the grid only computes the new configurations
+    args:
+        close, shift_period_list, move_value_list, strategy_list: see data_engineering.build_target_matrix
+        stage_cache: StageCache to read and store the targets in
+        target_settings: extra keyword arguments for data_engineering.build_target_matrix, e.g. threshold_mode
+        verbose: choose whether to add prints and logs
+    rtypes:
+        target_matrix: same as data_engineering.build_target_matrix
+    '''
+    target_settings = target_settings or {}
+    close_key = stage_cache_operations.stage_key('close', [], close)
+    target_keys, targets, missing = {}, {}, {}
+    for configuration in iterate_configurations(strategy_list= strategy_list, shift_period_list= shift_period_list,\
+        move_value_list= move_value_list):
+        target_keys[configuration] = stage_cache_operations.stage_key('target', STAGE_MODULES['target'], close_key,\
+            target_settings, *configuration)
+        target = stage_cache.get('target', target_keys[configuration])
+        if target is stage_cache_operations.MISSING:
+            strategy, shift_period, move_value = configuration
+            missing.setdefault((strategy, shift_period), []).append(move_value)
+        else:
+            targets[configuration] = target
+
+    #Compute the missing configurations, all move values of a horizon in one call
+    for (strategy, shift_period), missing_move_values in missing.items():
+        missing_matrix = data_engineering.build_target_matrix(close= close, shift_period_list= [shift_period],\
+            move_value_list= missing_move_values, strategy_list= [strategy], verbose= False, **target_settings)
+        for move_value in missing_move_values:
+            configuration = (strategy, shift_period, move_value)
+            targets[configuration] = missing_matrix[configuration]
+            stage_cache.put('target', target_keys[configuration], targets[configuration])
+    if verbose: print('\n{} of {} target variables taken from the stage cache.'.format(len(target_keys) - sum(len(move_values)\
+        for move_values in missing.values()), len(target_keys)))
+    return pd.DataFrame({configuration: targets[configuration] for configuration in target_keys}, index=close.index)
+
+
+def build_ticker_features(stock_dataframe, shift_period_list: list, move_value_list: list, strategy_list: list,\
+     engine='ta', indicators=None, dtype='float64', target_settings=None, stage_cache=None, verbose=True) -> tuple:
+    '''
+    CPU-bound part of the pipeline for one ticker - runs in a worker process
+    args:
+        stock_dataframe: dataframe from the "pull_yahoo_data" function
+        shift_period_list, move_value_list, strategy_list: the configuration grid
+        engine, indicators, dtype: indicator settings, see data_engineering.engineer_technical_indicators
+        target_settings: extra keyword arguments for data_engineering.build_target_matrix, e.g. threshold_mode
+        stage_cache: optional StageCache - features and targets whose inputs haven't changed are read from it
+        verbose: choose whether to add prints and logs
+    rtypes:
+        feature_dataframe: output of data_engineering.build_feature_matrix
+        target_matrix: output of data_engineering.build_target_matrix
+    '''
+    feature_settings = dict(stock_dataframe= stock_dataframe, verbose=verbose, engine= engine, indicators= indicators, dtype= dtype)
+    if stage_cache is None:
+        feature_dataframe = data_engineering.build_feature_matrix(**feature_settings)
+    else:
+        features_key = stage_cache_operations.stage_key('features', STAGE_MODULES['features'], stock_dataframe,\
+            engine, indicators, dtype)
+        feature_dataframe = stage_cache.call('features', features_key, data_engineering.build_feature_matrix, **feature_settings)
+
+    #Targets come from the price history's close, like create_target_feature
+    if stage_cache is None:
+        target_matrix = data_engineering.build_target_matrix(close= stock_dataframe['Close'], shift_period_list= shift_period_list,\
+            move_value_list= move_value_list, strategy_list= strategy_list, verbose=verbose, **(target_settings or {}))
+    else:
+        target_matrix = build_target_matrix_cached(close= stock_dataframe['Close'], shift_period_list= shift_period_list,\
+            move_value_list= move_value_list, strategy_list= strategy_list, stage_cache= stage_cache,\
+            target_settings= target_settings, verbose=verbose)
+    return feature_dataframe, target_matrix
+
+
+def process_pool(max_workers: int, preload=None) -> ProcessPoolExecutor:
+    '''
+    Process pool for CPU-bound stages. Workers are started from a fork server where the platform has one, and
+    spawned elsewhere - never forked from this process, whose I/O threads and pyarrow thread pools may hold a
+    lock at the moment of the fork that the child then waits on forever. Both import the entry script again,
+    which is safe as main.py only runs under __main__. Tracing is set up in every worker like in this process.
+    args:
+        max_workers: number of worker processes
+        preload: modules the fork server imports once, so its workers start with them already loaded
+    '''
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        #Only read when the fork server starts, i.e. by the first pool of the process
+        context.set_forkserver_preload(['__main__'] + list(preload or []))
+    else:
+        context = multiprocessing.get_context('spawn')
+    tracer = instrumentation.get_tracer()
+    return ProcessPoolExecutor(max_workers= max_workers, mp_context= context, initializer= instrumentation.configure,\
+        initargs= (tracer.path, tracer.enabled, tracer.run_id))
+
+
+def run_ticker_pipeline(ticker_list: list, price_store, shift_period_list: list, move_value_list: list, strategy_list: list,\
+     engine='ta', indicators=None, dtype='float64', target_settings=None, cpu_workers=None, io_workers=8, stage_cache=None,\
+     verbose=True):
+    '''
+    Fetch and engineer every ticker in parallel: price data is read on a pool of io_workers threads and
+    each ticker's features and targets are built on a pool of cpu_workers processes. Results are yielded
+    in ticker_list order as soon as each one (and every ticker before it) is ready, so callers can load
+    and upload one ticker while the next ones are still being computed.
+    args:
+        ticker_list: tickers to process
+        price_store: PriceStore the price data is read from
+        shift_period_list, move_value_list, strategy_list: the configuration grid
+        engine, indicators, dtype: indicator settings, see data_engineering.engineer_technical_indicators
+        target_settings: extra keyword arguments for data_engineering.build_target_matrix, e.g. threshold_mode
+        cpu_workers: worker processes for feature engineering; None uses every core, 1 runs in this process
+        io_workers: threads for reading price data
+        stage_cache: optional StageCache for features and targets, see build_ticker_features
+        verbose: choose whether to add prints and logs
+    rtypes:
+        generator of (ticker, feature_dataframe, target_matrix) tuples
+    '''
+    if cpu_workers is None:
+        cpu_workers = os.cpu_count() or 1
+    cpu_workers = max(1, min(cpu_workers, len(ticker_list)))
+    feature_settings = dict(shift_period_list= shift_period_list, move_value_list= move_value_list,\
+        strategy_list= strategy_list, engine= engine, indicators= indicators, dtype= dtype, target_settings= target_settings,\
+        stage_cache= stage_cache, verbose= verbose)
+
+    with ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix='pipeline-io') as io_pool:
+        fetch_futures = [io_pool.submit(data_engineering.pull_yahoo_data, ticker= ticker, verbose= verbose,\
+            price_store= price_store) for ticker in ticker_list]
+
+        if cpu_workers == 1:
+            for ticker, fetch_future in zip(ticker_list, fetch_futures):
+                feature_dataframe, target_matrix = build_ticker_features(fetch_future.result(), **feature_settings)
+                yield ticker, feature_dataframe, target_matrix
+            return
+
+        with process_pool(cpu_workers, preload= ['money_robot_code.pipeline']) as cpu_pool:
+            #Hand each ticker to the process pool the moment its data is in memory
+            feature_futures = []
+            for fetch_future in fetch_futures:
+                feature_futures.append(cpu_pool.submit(build_ticker_features, fetch_future.result(), **feature_settings))
+            for ticker, feature_future in zip(ticker_list, feature_futures):
+                feature_dataframe, target_matrix = feature_future.result()
+                yield ticker, feature_dataframe, target_matrix
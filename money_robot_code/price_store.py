@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+
+#Core libraries
+import os
+import pandas as pd
+import numpy as np
+
+#Custom imports
+from money_robot_code import instrumentation
+
+
+#Columns every price frame is normalized to, in the order yahoo finance returns them
+PRICE_COLUMNS = ['Date', 'Open', 'High', 'Low', 'Close', 'Volume', 'Dividends', 'Stock Splits']
+
+
+def normalize_price_frame(price_dataframe: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Put a raw price frame into the layout used by the store: a naive datetime64 "Date" column,
+    the standard OHLCV + actions columns, sorted ascending with one row per date.
+    args:
+        price_dataframe: dataframe from any data source, with the date either as the index or a "Date" column
+    rtypes:
+        price_dataframe: normalized dataframe
+    '''
+    if 'Date' not in price_dataframe.columns:
+        price_dataframe = price_dataframe.reset_index()
+        price_dataframe = price_dataframe.rename(columns={price_dataframe.columns[0]: 'Date'})
+    price_dataframe = price_dataframe.copy()
+    dates = pd.to_datetime(price_dataframe['Date'])
+    if getattr(dates.dt, 'tz', None) is not None:
+        dates = dates.dt.tz_localize(None)
+    price_dataframe['Date'] = dates.dt.normalize()
+
+    #Yahoo leaves the action columns out of some responses - treat those as "no action"
+    for column in ['Dividends', 'Stock Splits']:
+        if column not in price_dataframe.columns:
+            price_dataframe[column] = 0.0
+    price_dataframe = price_dataframe[PRICE_COLUMNS]
+    price_dataframe = price_dataframe.dropna(subset=['Close'])
+    price_dataframe = price_dataframe.drop_duplicates(subset='Date', keep='last')
+    price_dataframe = price_dataframe.sort_values(by='Date').reset_index(drop=True)
+    return price_dataframe
+
+
+class YahooDataSource:
+    '''
+    Data source backed by yahoo finance. Uses the same settings as Ticker.history (adjusted prices,
+    with dividends and splits), and a single threaded yf.download call for multi-ticker requests.
+    '''
+
+    def fetch(self, ticker: str, start=None) -> pd.DataFrame:
+        '''
+        Get bars for one ticker from start (inclusive) onwards, or the full history if start is None
+        '''
+        import yfinance as yf
+        if start is None:
+            price_dataframe = yf.Ticker(ticker).history(period='max')
+        else:
+            price_dataframe = yf.Ticker(ticker).history(start=pd.Timestamp(start).strftime('%Y-%m-%d'))
+        return price_dataframe
+
+    def fetch_many(self, tickers: list, start=None) -> dict:
+        '''
+        Get bars for several tickers in one request; returns a dict of ticker -> dataframe
+        '''
+        import yfinance as yf
+        if start is None:
+            download_kwargs = {'period': 'max'}
+        else:
+            download_kwargs = {'start': pd.Timestamp(start).strftime('%Y-%m-%d')}
+        price_dataframe = yf.download(tickers, group_by='ticker', auto_adjust=True, actions=True,\
+            threads=True, progress=False, **download_kwargs)
+
+        #A single ticker comes back with flat columns, several tickers with a (ticker, field) MultiIndex
+        if not isinstance(price_dataframe.columns, pd.MultiIndex):
+            return {tickers[0]: price_dataframe}
+        price_dataframes = {}
+        for ticker in tickers:
+            if ticker in price_dataframe.columns.get_level_values(0):
+                price_dataframes[ticker] = price_dataframe[ticker].dropna(how='all')
+        return price_dataframes
+
+
+class LocalDataSource:
+    '''
+    Offline data source that reads <directory>/<ticker>.parquet or <directory>/<ticker>.csv. Used
+    to run the pipeline and the price store without network access.
+    '''
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def fetch(self, ticker: str, start=None) -> pd.DataFrame:
+        parquet_path = os.path.join(self.directory, ticker + '.parquet')
+        if os.path.exists(parquet_path):
+            price_dataframe = pd.read_parquet(parquet_path)
+        else:
+            price_dataframe = pd.read_csv(os.path.join(self.directory, ticker + '.csv'))
+        price_dataframe = normalize_price_frame(price_dataframe)
+        if start is not None:
+            price_dataframe = price_dataframe[price_dataframe['Date'] >= pd.Timestamp(start)]
+        return price_dataframe
+
+    def fetch_many(self, tickers: list, start=None) -> dict:
+        return {ticker: self.fetch(ticker, start=start) for ticker in tickers}
+
+
+class PriceStore:
+    '''
+    On-disk Parquet store of daily bars, one file per ticker. After the first full download only the
+    bars from the last stored date onwards are requested from the data source and merged in.
+    args:
+        directory: folder holding <ticker>.parquet files
+        data_source: object with fetch(ticker, start) and fetch_many(tickers, start) methods;
+        defaults to YahooDataSource
+        verbose: choose whether to add print statements and logs
+    '''
+
+    def __init__(self, directory: str = 'data/price_store', data_source=None, verbose=True):
+        self.directory = directory
+        self.data_source = data_source if data_source is not None else YahooDataSource()
+        self.verbose = verbose
+        #Tickers already brought up to date during this session - they are read straight from disk
+        self.refreshed_tickers = set()
+        #Tickers the last update_many call re-downloaded in full because their adjusted history changed
+        self.redownloaded_tickers = set()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, ticker: str) -> str:
+        return os.path.join(self.directory, ticker + '.parquet')
+
+    def read(self, ticker: str) -> pd.DataFrame:
+        '''
+        Read the stored bars for a ticker, or None if nothing has been stored yet
+        '''
+        if not os.path.exists(self.path(ticker)):
+            return None
+        return pd.read_parquet(self.path(ticker))
+
+    def write(self, ticker: str, price_dataframe: pd.DataFrame) -> None:
+        #Write to a temp file and swap it in, so an interrupted run never leaves a truncated file
+        temp_path = self.path(ticker) + '.tmp'
+        price_dataframe.to_parquet(temp_path, index=False)
+        os.replace(temp_path, self.path(ticker))
+
+    def last_date(self, ticker: str):
+        stored_dataframe = self.read(ticker)
+        if stored_dataframe is None or len(stored_dataframe) == 0:
+            return None
+        return stored_dataframe['Date'].iloc[-1]
+
+    def merge(self, ticker: str, stored_dataframe: pd.DataFrame, new_dataframe: pd.DataFrame) -> pd.DataFrame:
+        '''
+        Merge newly fetched bars into the stored bars. The last stored bar is always re-fetched, so it
+        is used to check that the adjusted history hasn't changed underneath us (a split or dividend
+        re-adjusts every past price). Returns None when a full re-download is needed.
+        '''
+        new_dataframe = normalize_price_frame(new_dataframe)
+        if stored_dataframe is None:
+            return new_dataframe
+        if len(new_dataframe) == 0:
+            return stored_dataframe
+        overlap = new_dataframe.merge(stored_dataframe[['Date', 'Close']], on='Date', suffixes=('', '_stored'))
+        if len(overlap) > 0 and not np.allclose(overlap['Close'], overlap['Close_stored'], rtol=1e-6):
+            return None
+        new_bars = new_dataframe[new_dataframe['Date'] > stored_dataframe['Date'].iloc[-1]]
+        if (new_bars['Stock Splits'] != 0).any() or (new_bars['Dividends'] != 0).any():
+            return None
+        merged_dataframe = pd.concat([stored_dataframe, new_dataframe], ignore_index=True)
+        merged_dataframe = merged_dataframe.drop_duplicates(subset='Date', keep='last')
+        merged_dataframe = merged_dataframe.sort_values(by='Date').reset_index(drop=True)
+        return merged_dataframe
+
+    def update(self, ticker: str) -> pd.DataFrame:
+        '''
+        Bring one ticker up to date and return its full history
+        '''
+        return self.update_many([ticker])[ticker]
+
+    def update_many(self, tickers: list) -> dict:
+        '''
+        Bring several tickers up to date with as few data source requests as possible. Tickers are
+        grouped by their last stored date, so a nightly run is one bulk request for the whole list.
+        args:
+            tickers: list of tickers to update
+        rtypes:
+            price_dataframes: dict of ticker -> full stored history
+        '''
+        stored_dataframes = {ticker: self.read(ticker) for ticker in tickers}
+        self.redownloaded_tickers.difference_update(tickers)
+        start_groups = {}
+        for ticker in tickers:
+            stored_dataframe = stored_dataframes[ticker]
+            start = None if stored_dataframe is None or len(stored_dataframe) == 0 else stored_dataframe['Date'].iloc[-1]
+            start_groups.setdefault(start, []).append(ticker)
+
+        price_dataframes = {}
+        for start, start_tickers in start_groups.items():
+            if self.verbose:
+                print('\nFetching {} from {}...'.format(', '.join(start_tickers), 'the start of history' if start is None else start.date()))
+            with instrumentation.stage('price_download', tickers= len(start_tickers), since= start) as record:
+                new_dataframes = self.data_source.fetch_many(start_tickers, start=start)
+                record.rows = sum(len(new_dataframe) for new_dataframe in new_dataframes.values())
+            for ticker in start_tickers:
+                new_dataframe = new_dataframes.get(ticker)
+                if new_dataframe is None:
+                    new_dataframe = pd.DataFrame(columns=PRICE_COLUMNS)
+                merged_dataframe = self.merge(ticker, stored_dataframes[ticker], new_dataframe)
+                if merged_dataframe is None:
+                    if self.verbose: print('Adjusted history changed for ticker {}, re-downloading it in full.'.format(ticker))
+                    merged_dataframe = normalize_price_frame(self.data_source.fetch(ticker, start=None))
+                    self.redownloaded_tickers.add(ticker)
+                self.write(ticker, merged_dataframe)
+                self.refreshed_tickers.add(ticker)
+                price_dataframes[ticker] = merged_dataframe
+        return price_dataframes
+
+    def get(self, ticker: str) -> pd.DataFrame:
+        '''
+        Get the full history for a ticker, fetching new bars only the first time it is asked for in a session
+        '''
+        if ticker in self.refreshed_tickers:
+            return self.read(ticker)
+        return self.update(ticker)
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+#Core libraries
+import math
+from bisect import bisect_left, insort
+import numpy as np
+
+
+'''
+Rolling and expanding quantiles for the target thresholds. The window is kept as a sorted list: each new bar
+is inserted and the bar leaving the window removed by binary search, so every quantile of the window is read
+by index. A step costs O(log w) comparisons plus one memmove instead of a sort of the whole window, and all
+requested quantiles of a window come out of the same pass. Quantiles use linear interpolation, the default of
+numpy.percentile and pandas' quantile.
+'''
+
+
+def rolling_quantiles(values, quantiles: list, window: int = None, min_periods: int = 1) -> np.ndarray:
+    '''
+    Quantiles of a trailing window at every position
+    args:
+        values: 1d array, oldest first; missing values are skipped
+        quantiles: quantiles to compute, each between 0 and 1
+        window: number of trailing positions in the window (the current one included), None for an expanding window
+        min_periods: fewest non-missing values a window needs; positions with fewer are left missing
+    rtypes:
+        quantile_values: array of shape (len(values), len(quantiles))
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    quantiles = [float(quantile) for quantile in quantiles]
+    if any(quantile < 0 or quantile > 1 for quantile in quantiles):
+        raise ValueError('Quantiles must be between 0 and 1, got {}'.format(quantiles))
+    if window is not None and window < 1:
+        raise ValueError('window must be at least 1, got {}'.format(window))
+    min_periods = max(1, min_periods)
+
+    quantile_values = np.full((len(values), len(quantiles)), np.nan)
+    sorted_window = []
+    value_list = values.tolist()
+    for position, value in enumerate(value_list):
+        if value == value:
+            insort(sorted_window, value)
+        if window is not None and position >= window:
+            leaving_value = value_list[position - window]
+            if leaving_value == leaving_value:
+                del sorted_window[bisect_left(sorted_window, leaving_value)]
+
+        count = len(sorted_window)
+        if count < min_periods:
+            continue
+        row = quantile_values[position]
+        for column, quantile in enumerate(quantiles):
+            rank = quantile * (count - 1)
+            lower = int(math.floor(rank))
+            upper = min(lower + 1, count - 1)
+            row[column] = sorted_window[lower] + (sorted_window[upper] - sorted_window[lower]) * (rank - lower)
+    return quantile_values
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+#Core libraries
+import hashlib
+import pandas as pd
+import numpy as np
+
+
+'''
+Column schema of the engineered dataset. Every column gets a fixed dtype - datetime64 dates, features at a
+configurable float precision, a nullable int8 target - and every dtype maps to one Snowflake type, so the
+DDL of a table only depends on its columns and the schema version.
+'''
+
+
+#Bump whenever a dtype or a DDL type below changes, so tables loaded under the old schema are rebuilt
+SCHEMA_VERSION = 2
+
+DATE_COLUMN = 'Date'
+TARGET_COLUMN = 'TARGET'
+
+#Price columns that keep a fixed dtype whatever the feature precision is - volume is a share count, and the close
+#stays at full precision, as targets computed from a float32 close can land on the other side of the move threshold
+FIXED_DTYPES = {'Volume': 'Int64', 'Close': 'float64'}
+
+#Snowflake type for each dtype kind; Snowflake FLOAT is always double precision, so float32 widens on load
+DDL_TYPES = [
+    ('bool', 'BOOLEAN'),
+    ('int8', 'NUMBER(3,0)'),
+    ('int16', 'NUMBER(5,0)'),
+    ('int32', 'NUMBER(10,0)'),
+    ('int64', 'NUMBER(19,0)'),
+    ('uint8', 'NUMBER(3,0)'),
+    ('uint16', 'NUMBER(5,0)'),
+    ('uint32', 'NUMBER(10,0)'),
+    ('uint64', 'NUMBER(20,0)'),
+    ('float16', 'FLOAT'),
+    ('float32', 'FLOAT'),
+    ('float64', 'FLOAT'),
+]
+
+
+def ddl_type(dtype) -> str:
+    '''
+    Snowflake column type for a pandas dtype
+    args:
+        dtype: numpy or pandas extension dtype
+    rtypes:
+        ddl_type: e.g. FLOAT, NUMBER(3,0), DATE or VARCHAR
+    '''
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return 'DATE'
+    if isinstance(dtype, pd.api.extensions.ExtensionDtype) and not isinstance(dtype, pd.CategoricalDtype):
+        #Nullable Int8/Int64/Float32/boolean map like their numpy counterparts
+        dtype = getattr(dtype, 'numpy_dtype', dtype)
+    for dtype_name, snowflake_type in DDL_TYPES:
+        if str(dtype) == dtype_name:
+            return snowflake_type
+    return 'VARCHAR'
+
+
+def normalize_dates(dates: pd.Series) -> pd.Series:
+    '''
+    Dates as naive datetime64, from strings, datetimes or time zone aware timestamps
+    '''
+    dates = pd.to_datetime(dates)
+    if getattr(dates.dt, 'tz', None) is not None:
+        dates = dates.dt.tz_localize(None)
+    return dates
+
+
+class DatasetSchema:
+    '''
+    dtypes of the engineered dataset: "Date" as naive datetime64, TARGET as nullable int8, Volume as a
+    nullable int64, Close as float64 and every other numeric column as feature_dtype
+    args:
+        feature_dtype: float dtype of the price and indicator columns, e.g. 'float32' or 'float64'
+    '''
+
+    def __init__(self, feature_dtype: str = 'float32'):
+        if not np.issubdtype(np.dtype(feature_dtype), np.floating):
+            raise ValueError('feature_dtype must be a float dtype, got {}'.format(feature_dtype))
+        self.feature_dtype = str(np.dtype(feature_dtype))
+
+    def dtype(self, column: str, current_dtype):
+        '''
+        dtype a column should have under the schema; non-numeric columns other than the date keep their dtype
+        '''
+        if column == DATE_COLUMN:
+            return 'datetime64[ns]'
+        if column == TARGET_COLUMN:
+            return 'Int8'
+        if column in FIXED_DTYPES:
+            return FIXED_DTYPES[column]
+        if pd.api.types.is_numeric_dtype(current_dtype) and not pd.api.types.is_bool_dtype(current_dtype):
+            return self.feature_dtype
+        return current_dtype
+
+    def apply(self, dataframe: pd.DataFrame) -> pd.DataFrame:
+        '''
+        Cast a dataframe to the schema. Columns that already have the right dtype are not copied.
+        args:
+            dataframe: price, feature or training dataframe
+        rtypes:
+            dataframe: the same columns, with the schema's dtypes
+        '''
+        casts = {}
+        for column, current_dtype in dataframe.dtypes.items():
+            if column == DATE_COLUMN:
+                if not pd.api.types.is_datetime64_dtype(current_dtype):
+                    casts[column] = normalize_dates(dataframe[column])
+                continue
+            target_dtype = self.dtype(column, current_dtype)
+            if str(target_dtype) != str(current_dtype):
+                values = dataframe[column]
+                if target_dtype in ['Int8', 'Int64'] and pd.api.types.is_float_dtype(current_dtype):
+                    #Nullable integers can't take fractional parts - round whole-number floats, e.g. 1.0 -> 1
+                    values = values.round()
+                casts[column] = values.astype(target_dtype)
+        if not casts:
+            return dataframe
+        dataframe = dataframe.copy(deep=False)
+        for column, values in casts.items():
+            dataframe[column] = values
+        return dataframe
+
+
+def col_types(dataframe: pd.DataFrame) -> str:
+    '''
+    Column definitions for a CREATE TABLE statement, e.g. "DATE DATE, OPEN FLOAT, TARGET NUMBER(3,0)".
+    Column names are upper case, as Snowflake needs them.
+    '''
+    return ', '.join('{} {}'.format(str(column).upper(), ddl_type(dtype)) for column, dtype in dataframe.dtypes.items())
+
+
+def fingerprint(col_types: str) -> str:
+    '''
+    Fingerprint of a table definition from "col_types" and the schema version - two loads with the same
+    fingerprint have the same table layout
+    '''
+    normalized = ' '.join(col_types.upper().split())
+    return hashlib.sha256('{}|{}'.format(SCHEMA_VERSION, normalized).encode('utf-8')).hexdigest()
+
+
+def to_load_frame(dataframe: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Dataframe ready to send to Snowflake: datetime64 columns become datetime.date values, which bind and
+    bulk load as DATE (a raw datetime64 column is written as a nanosecond timestamp)
+    '''
+    date_columns = [column for column, dtype in dataframe.dtypes.items() if pd.api.types.is_datetime64_any_dtype(dtype)]
+    if not date_columns:
+        return dataframe
+    dataframe = dataframe.copy(deep=False)
+    for column in date_columns:
+        dataframe[column] = dataframe[column].dt.date
+    return dataframe
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+#Core libraries
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+#Custom imports
+from money_robot_code import instrumentation
+
+
+#Prediction API endpoint - {deployment_id} is filled in per request
+DEFAULT_API_URL = 'https://cfds-ccm-prod.orm.datarobot.com/predApi/v1.0/deployments/{deployment_id}/predictions'
+
+#Status codes worth retrying: rate limiting and transient server errors
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def prepare_scoring_frame(dataframe: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Put a dataframe into the column layout the deployments were trained on (upper case, STOCK_SPLITS, dates
+    as YYYY-MM-DD strings)
+    '''
+    dataframe = dataframe.rename(columns={'Stock Splits': 'STOCK_SPLITS'})
+    dataframe.columns = [col.upper() for col in dataframe.columns]
+    for column, dtype in dataframe.dtypes.items():
+        if pd.api.types.is_datetime64_any_dtype(dtype):
+            dataframe[column] = dataframe[column].dt.strftime('%Y-%m-%d')
+    return dataframe
+
+
+class PredictionClient:
+    '''
+    Client for the DataRobot prediction API. One keep-alive session is shared by every request, frames are
+    split into size-bounded batches, batches are sent concurrently (at most max_concurrency at a time),
+    failed requests are retried with exponential backoff and a batch the server rejects as too large (413) is
+    sent again in halves.
+    args:
+        token: DataRobot API token
+        api_url: prediction URL template with a {deployment_id} placeholder
+        max_concurrency: most requests in flight at once
+        max_retries: retries per batch after the first attempt
+        backoff: seconds before the first retry, doubled after each one
+        max_rows_per_batch: most rows in one request
+        max_batch_bytes: most payload bytes in one request (the prediction API rejects bodies over 50MB)
+        payload_format: 'json' or 'csv' - csv payloads are smaller and faster to encode
+        timeout: seconds to wait for each response
+        session: optional requests.Session to use, e.g. one pointing at a local stub
+        verbose: choose whether to add prints and logs
+    '''
+
+    def __init__(self, token: str, api_url: str = DEFAULT_API_URL, max_concurrency: int = 4, max_retries: int = 3,\
+         backoff: float = 0.5, max_rows_per_batch: int = 10000, max_batch_bytes: int = 50 * 1024 * 1024,\
+         payload_format: str = 'json', timeout: float = 60, session=None, verbose=True):
+        if payload_format not in ['json', 'csv']:
+            raise ValueError('Unknown payload format {}, expected "json" or "csv"'.format(payload_format))
+        self.api_url = api_url
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_rows_per_batch = max_rows_per_batch
+        self.max_batch_bytes = max_batch_bytes
+        self.payload_format = payload_format
+        self.timeout = timeout
+        self.verbose = verbose
+        self.session = session if session is not None else requests.Session()
+        #Keep one open connection per concurrent request instead of reconnecting every time
+        adapter = HTTPAdapter(pool_connections=max_concurrency, pool_maxsize=max_concurrency)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({'Authorization': 'Bearer {}'.format(token)})
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+
+    def close(self) -> None:
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _encode(self, dataframe: pd.DataFrame) -> bytes:
+        if self.payload_format == 'csv':
+            return dataframe.to_csv(index=False).encode('utf-8')
+        return dataframe.to_json(orient='records').encode('utf-8')
+
+    def _content_type(self) -> str:
+        if self.payload_format == 'csv':
+            return 'text/plain; charset=UTF-8'
+        return 'application/json; charset=UTF-8'
+
+    def make_batches(self, dataframe: pd.DataFrame) -> list:
+        '''
+        Split a dataframe into (first row, batch, payload) batches within the row and byte limits
+        '''
+        batches = []
+        pending = [dataframe.iloc[start:start + self.max_rows_per_batch] for start in range(0, len(dataframe), self.max_rows_per_batch)]
+        offsets = list(range(0, len(dataframe), self.max_rows_per_batch))
+        while pending:
+            batch, offset = pending.pop(0), offsets.pop(0)
+            payload = self._encode(batch)
+            if len(payload) > self.max_batch_bytes and len(batch) > 1:
+                #Too big - split it in half and try again
+                half = len(batch) // 2
+                pending[:0] = [batch.iloc[:half], batch.iloc[half:]]
+                offsets[:0] = [offset, offset + half]
+                continue
+            batches.append((offset, batch, payload))
+        return batches
+
+    def _post(self, deployment_id: str, deployment_key: str, payload: bytes) -> dict:
+        url = self.api_url.format(deployment_id=deployment_id)
+        headers = {'Content-Type': self._content_type(), 'DataRobot-Key': deployment_key}
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self.slots, instrumentation.stage('prediction_request', deployment_id= deployment_id, attempt= attempt) as record:
+                    record.bytes = len(payload)
+                    response = self.session.post(url, data=payload, headers=headers, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUS_CODES or attempt == self.max_retries:
+                    response.raise_for_status()
+                    return response.json()
+                #Honour the server's Retry-After when it sends one
+                retry_after = response.headers.get('Retry-After')
+                if retry_after is not None and retry_after.isdigit():
+                    time.sleep(float(retry_after))
+                    continue
+            time.sleep(self.backoff * (2 ** attempt))
+
+    def score(self, dataframe: pd.DataFrame, deployment_id: str, deployment_key: str) -> pd.DataFrame:
+        '''
+        Score one dataframe on one deployment
+        args:
+            dataframe: rows to score, in the deployment's column layout (see prepare_scoring_frame)
+            deployment_id, deployment_key: the deployment to score on
+        rtypes:
+            predictions_df: one row per scored row, as returned by the API, with rowId counted over the whole frame
+        '''
+        return self.score_many([(None, dataframe, deployment_id, deployment_key)]).drop(columns=['dataframe_name', 'deployment_id'])
+
+    def _build_requests(self, jobs: list) -> list:
+        #One (job position, dataframe name, deployment id, deployment key, first row, batch, payload) tuple per batch
+        requests_to_send = []
+        for job_position, (dataframe_name, dataframe, deployment_id, deployment_key) in enumerate(jobs):
+            for offset, batch, payload in self.make_batches(dataframe):
+                requests_to_send.append((job_position, dataframe_name, deployment_id, deployment_key, offset, batch, payload))
+        return requests_to_send
+
+    def score_many(self, jobs: list) -> pd.DataFrame:
+        '''
+        Score several dataframes, each on its own deployment, with every batch of every job sharing the
+        concurrency limit
+        args:
+            jobs: list of (dataframe_name, dataframe, deployment_id, deployment_key) tuples
+        rtypes:
+            predictions_df: predictions of every job, in job order, with dataframe_name and deployment_id columns
+        '''
+        with instrumentation.stage('scoring_payload', jobs= len(jobs)) as record:
+            requests_to_send = self._build_requests(jobs)
+            record.bytes = sum(len(request[-1]) for request in requests_to_send)
+        if self.verbose: print('\nScoring {} dataframe(s) in {} request(s)...'.format(len(jobs), len(requests_to_send)))
+
+        def _score_batch(request):
+            job_position, dataframe_name, deployment_id, deployment_key, offset, batch, payload = request
+            try:
+                response_json = self._post(deployment_id, deployment_key, payload)
+            except requests.HTTPError as error:
+                if error.response is None or error.response.status_code != 413 or len(batch) < 2:
+                    raise
+                #The server takes smaller bodies than max_batch_bytes - send the batch in two halves
+                half = len(batch) // 2
+                if self.verbose: print('Batch of {} rows for {} is too large, splitting it.'.format(len(batch), dataframe_name))
+                return pd.concat([_score_batch(request[:4] + (offset + start, part, self._encode(part)))\
+                    for start, part in [(0, batch.iloc[:half]), (half, batch.iloc[half:])]], ignore_index=True)
+            response_df = pd.json_normalize(response_json['data'])
+            if 'rowId' in response_df.columns:
+                response_df['rowId'] = response_df['rowId'] + offset
+            response_df.insert(0, 'deployment_id', deployment_id)
+            response_df.insert(0, 'dataframe_name', dataframe_name)
+            return response_df
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='scoring') as executor:
+            #map keeps the request order, so the combined frame is in job and row order
+            response_dfs = list(executor.map(_score_batch, requests_to_send))
+        if not response_dfs:
+            return pd.DataFrame(columns=['dataframe_name', 'deployment_id'])
+        predictions_df = pd.concat(response_dfs, ignore_index=True)
+        if self.verbose: print('Scored {} rows.'.format(len(predictions_df)))
+        return predictions_df
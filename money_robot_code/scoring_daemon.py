@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+
+#Core libraries
+import copy
+import json
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+import pandas as pd
+
+#Custom imports
+from money_robot_code import data_engineering
+from money_robot_code import pipeline
+from money_robot_code import datarobot_operations
+from money_robot_code.price_store import PriceStore, normalize_price_frame
+from money_robot_code.online_indicators import OnlineIndicatorStore
+from money_robot_code.scoring_client import prepare_scoring_frame
+
+
+'''
+Resident scoring service. It loads every ticker's price history once, keeps its online indicator state and
+latest feature row in memory, and holds one PredictionClient (one pooled keep-alive session) for all requests,
+so a prediction costs one indicator update and one HTTP round trip instead of a cold run of the whole pipeline.
+
+Local JSON API (bound to 127.0.0.1 by default):
+    GET  /health               tickers held and the date of each one's last bar
+    POST /bars                 {"ticker": "AAPL", "bars": [{"Date": ..., "Open": ..., ...}, ...]}
+                               add completed daily bars; returns the new last date
+    POST /predict              {"ticker": "AAPL", "strategy": "buy", "shift_period": 5, "move_value": 0.9,
+                               "bar": {...}, "deployment_id": ..., "deployment_key": ...}
+                               score one configuration on the latest bar
+    POST /score                {"refresh": true, "bars": {"AAPL": {...}}}
+                               score every job in datarobot_api_scoring_settings - the pre-close job
+
+"bar" (and the per-ticker "bars" of /score) is today's bar so far: it is scored on a copy of the state and not
+kept, so the same day can be scored again as it goes on. The deployment of /predict defaults to the scoring
+job for the configuration's _TEST table. Only the native indicator engine has an online state; with the ta
+engine every request recomputes the ticker's features over its history.
+'''
+
+
+class ScoringDaemon:
+    '''
+    In-memory scoring state for every ticker of the config
+    args:
+        settings: settings.Settings; needs the datarobot_settings and datarobot_api_scoring_settings sections
+        price_store: PriceStore the histories are read from; defaults to data.price_store_dir
+        client: PredictionClient to score with; built from the settings when not given
+        state_store: OnlineIndicatorStore the indicator states are kept in between runs; defaults to
+        scoring_daemon.indicator_state_dir
+        verbose: choose whether to add prints and logs
+    '''
+
+    def __init__(self, settings, price_store=None, client=None, state_store=None, verbose=True):
+        settings.require('datarobot_settings', 'datarobot_api_scoring_settings')
+        self.settings = settings
+        self.data = settings.data
+        self.verbose = verbose
+        self.price_store = price_store if price_store is not None else PriceStore(directory= self.data.price_store_dir, verbose= verbose)
+        self.client = client if client is not None else datarobot_operations.get_scoring_client(settings, verbose=False)
+        self.state_store = state_store if state_store is not None else\
+            OnlineIndicatorStore(directory= settings.scoring_daemon.indicator_state_dir, cache=True)
+        self.online = self.data.indicator_engine == 'native'
+        self.names = pipeline.configuration_names(table_prefix= self.data.table_prefix, ticker_list= self.data.ticker_list,\
+            strategy_list= self.data.strategy_list, shift_period_list= self.data.shift_period_list,\
+            move_value_list= self.data.move_value_list)
+        self.deployments = {job.dataframe_name: (job.deployment_id, job.deployment_key) for job in settings.scoring.jobs}
+        #Per ticker: price history and the latest feature row; the online indicator states are cached by the state store
+        self.histories = {}
+        self.latest_rows = {}
+        self.locks = {ticker: threading.Lock() for ticker in self.data.ticker_list}
+
+    def warm(self, refresh=False, tickers=None) -> None:
+        '''
+        Load every ticker's history and bring its indicator state up to its last bar
+        args:
+            refresh: download the bars missing from the price store first
+            tickers: tickers to load, defaults to every ticker of the config
+        '''
+        tickers = tickers if tickers is not None else self.data.ticker_list
+        if refresh:
+            histories = self.price_store.update_many(tickers)
+        else:
+            histories = {ticker: self.price_store.read(ticker) for ticker in tickers}
+            missing_tickers = [ticker for ticker, history in histories.items() if history is None]
+            if missing_tickers:
+                histories.update(self.price_store.update_many(missing_tickers))
+        for ticker in tickers:
+            start = time.perf_counter()
+            with self.locks[ticker]:
+                self._load_ticker(ticker, histories[ticker])
+            if self.verbose: print('Ticker {} ready, last bar {}, {:.2f}s.'.format(ticker, self.latest_rows[ticker]['Date'].iloc[0].date(),\
+                time.perf_counter() - start))
+
+    def _load_ticker(self, ticker: str, history: pd.DataFrame) -> None:
+        history = history.reset_index(drop=True)
+        self.histories[ticker] = history
+        if self.online:
+            #A saved state is rolled forward over the bars stored since it was written (or serves its last row
+            #again), as long as the history it was built from hasn't been re-adjusted since
+            self.latest_rows[ticker] = self._update_features(ticker, history)
+        else:
+            self.latest_rows[ticker] = self._recompute_features(history).tail(1)
+
+    def _update_features(self, ticker: str, history: pd.DataFrame) -> pd.DataFrame:
+        return data_engineering.update_feature_rows(ticker, history, self.state_store, verbose=False,\
+            indicators= self.data.indicator_list, dtype= self.data.indicator_dtype).tail(1)
+
+    def _recompute_features(self, history: pd.DataFrame) -> pd.DataFrame:
+        return data_engineering.build_feature_matrix(history, verbose=False, engine= self.data.indicator_engine,\
+            indicators= self.data.indicator_list, dtype= self.data.indicator_dtype)
+
+    def _ticker_lock(self, ticker: str) -> threading.Lock:
+        if ticker not in self.locks:
+            raise KeyError('Unknown ticker {}, expected one of {}'.format(ticker, self.data.ticker_list))
+        return self.locks[ticker]
+
+    def add_bars(self, ticker: str, bars) -> pd.Timestamp:
+        '''
+        Add completed daily bars to a ticker. Bars on or before its last bar are ignored.
+        args:
+            ticker: ticker symbol
+            bars: dataframe or list of dicts with Date, Open, High, Low, Close and Volume
+        rtypes:
+            last_date: date of the ticker's last bar afterwards
+        '''
+        new_bars = normalize_price_frame(pd.DataFrame(bars))
+        with self._ticker_lock(ticker):
+            return self._append_bars(ticker, new_bars)
+
+    def _append_bars(self, ticker: str, new_bars: pd.DataFrame) -> pd.Timestamp:
+        #Caller holds the ticker's lock
+        history = self.histories[ticker]
+        new_bars = new_bars[new_bars['Date'] > history['Date'].iloc[-1]]
+        if len(new_bars) == 0:
+            return history['Date'].iloc[-1]
+        new_bars.index = pd.RangeIndex(len(history), len(history) + len(new_bars))
+        history = pd.concat([history, new_bars])
+        self.histories[ticker] = history
+        if self.online:
+            self.latest_rows[ticker] = self._update_features(ticker, history)
+        else:
+            self.latest_rows[ticker] = self._recompute_features(history).tail(1)
+        return history['Date'].iloc[-1]
+
+    def refresh_ticker(self, ticker: str, history: pd.DataFrame) -> pd.Timestamp:
+        '''
+        Bring a ticker up to its full history from the price store. New bars are appended as with add_bars, but
+        when the price store re-downloaded the ticker, or the history no longer has the held last bar at the
+        same close (a split or dividend re-adjusted every past price), the ticker is loaded again from scratch.
+        args:
+            ticker: ticker symbol
+            history: the ticker's full stored history, e.g. from PriceStore.update_many
+        rtypes:
+            last_date: date of the ticker's last bar afterwards
+        '''
+        with self._ticker_lock(ticker):
+            held_history = self.histories[ticker]
+            held_bar = history[history['Date'] == held_history['Date'].iloc[-1]]
+            if ticker in self.price_store.redownloaded_tickers or len(held_bar) != 1\
+                or not np.isclose(held_bar['Close'].iloc[0], held_history['Close'].iloc[-1], rtol=1e-9, atol=0.0):
+                if self.verbose: print('Price history of ticker {} was re-adjusted, reloading it.'.format(ticker))
+                self.state_store.delete(ticker)
+                self._load_ticker(ticker, history)
+                return self.histories[ticker]['Date'].iloc[-1]
+            return self._append_bars(ticker, history)
+
+    def feature_row(self, ticker: str, bar=None) -> pd.DataFrame:
+        '''
+        The feature row of a ticker's latest bar, or of a provisional bar for today that isn't kept
+        args:
+            ticker: ticker symbol
+            bar: optional dict with Date, Open, High, Low, Close and Volume, newer than the ticker's last bar
+        rtypes:
+            feature_row: one row dataframe, in the layout of data_engineering.build_feature_matrix
+        '''
+        with self._ticker_lock(ticker):
+            if bar is None:
+                return self.latest_rows[ticker]
+            history = self.histories[ticker]
+            provisional_bar = normalize_price_frame(pd.DataFrame([bar]))
+            if provisional_bar['Date'].iloc[0] <= history['Date'].iloc[-1]:
+                raise ValueError('The bar for {} is dated {}, on or before its last bar {} - add it with /bars instead'.\
+                    format(ticker, provisional_bar['Date'].iloc[0].date(), history['Date'].iloc[-1].date()))
+            provisional_bar.index = pd.RangeIndex(len(history), len(history) + 1)
+            if self.online:
+                #Update a copy, so the bar can be scored again with later prices
+                state = copy.deepcopy(self.state_store.read(ticker))
+                return data_engineering.feature_rows(provisional_bar, state.update(provisional_bar), dtype= self.data.indicator_dtype)
+            return self._recompute_features(pd.concat([history, provisional_bar])).tail(1)
+
+    def scoring_frame(self, ticker: str, strategy: str, shift_period: int, move_value: float, bar=None) -> pd.DataFrame:
+        '''
+        One row to score for a configuration: the latest feature row with an empty TARGET, in the column
+        layout the deployments were trained on
+        '''
+        feature_row = self.feature_row(ticker, bar= bar)
+        target_matrix = pd.DataFrame({(strategy, shift_period, move_value): pd.array([pd.NA] * len(feature_row), dtype='Int8')},\
+            index= feature_row.index)
+        scoring_dataframe = data_engineering.attach_target_feature(feature_row, shift_period, move_value, strategy,\
+            target_matrix= target_matrix, verbose=False, copy=False)
+        scoring_dataframe.index = pd.RangeIndex(len(scoring_dataframe))
+        return prepare_scoring_frame(scoring_dataframe)
+
+    def _configuration(self, dataframe_name: str) -> tuple:
+        if dataframe_name not in self.names:
+            raise KeyError('{} is not a table of the configuration grid'.format(dataframe_name))
+        return self.names[dataframe_name][:4]
+
+    def predict(self, ticker: str, strategy: str, shift_period: int, move_value: float, bar=None, deployment_id=None,\
+         deployment_key=None) -> dict:
+        '''
+        Score one configuration on a ticker's latest bar (or a provisional bar)
+        args:
+            ticker, strategy, shift_period, move_value: the configuration
+            bar: optional provisional bar, see feature_row
+            deployment_id, deployment_key: deployment to score on; default to the scoring job of the
+            configuration's _TEST table
+        rtypes:
+            prediction: dict with the configuration, the date scored and the prediction API's rows
+        '''
+        self._ticker_lock(ticker)
+        dataframe_name = pipeline.table_name(table_prefix= self.data.table_prefix, ticker= ticker, strategy= strategy,\
+            shift_period= shift_period, move_value= move_value, split= 'TEST')
+        if deployment_id is None:
+            if dataframe_name not in self.deployments:
+                raise KeyError('No scoring job for {} - pass deployment_id and deployment_key'.format(dataframe_name))
+            deployment_id, deployment_key = self.deployments[dataframe_name]
+        scoring_dataframe = self.scoring_frame(ticker, strategy, shift_period, move_value, bar= bar)
+        predictions_df = self.client.score_many([(dataframe_name, scoring_dataframe, deployment_id, deployment_key)])
+        return self._prediction(dataframe_name, deployment_id, scoring_dataframe, predictions_df)
+
+    def score_jobs(self, bars=None, refresh=False) -> list:
+        '''
+        Score every configured scoring job at once, on the shared session
+        args:
+            bars: optional dict of ticker -> provisional bar
+            refresh: download the bars missing from the price store first and add them; tickers whose history was
+            re-adjusted are reloaded
+        rtypes:
+            predictions: one prediction dict (see predict) per job, in job order
+        '''
+        bars = bars or {}
+        jobs = [(job.dataframe_name, self._configuration(job.dataframe_name), job.deployment_id, job.deployment_key)\
+            for job in self.settings.scoring.jobs]
+        if refresh:
+            job_tickers = list(dict.fromkeys(configuration[0] for _, configuration, _, _ in jobs))
+            for ticker, history in self.price_store.update_many(job_tickers).items():
+                self.refresh_ticker(ticker, history)
+        scoring_jobs = [(dataframe_name, self.scoring_frame(*configuration, bar= bars.get(configuration[0])), deployment_id,\
+            deployment_key) for dataframe_name, configuration, deployment_id, deployment_key in jobs]
+        predictions_df = self.client.score_many(scoring_jobs)
+        return [self._prediction(dataframe_name, deployment_id, scoring_dataframe,\
+            predictions_df[(predictions_df['dataframe_name'] == dataframe_name) & (predictions_df['deployment_id'] == deployment_id)])\
+            for dataframe_name, scoring_dataframe, deployment_id, _ in scoring_jobs]
+
+    def _prediction(self, dataframe_name: str, deployment_id: str, scoring_dataframe: pd.DataFrame, predictions_df: pd.DataFrame) -> dict:
+        ticker, strategy, shift_period, move_value = self._configuration(dataframe_name)
+        return {'dataframe_name': dataframe_name, 'ticker': ticker, 'strategy': strategy, 'shift_period': shift_period,\
+            'move_value': move_value, 'date': scoring_dataframe['DATE'].iloc[0], 'deployment_id': deployment_id,\
+            'predictions': predictions_df.drop(columns=['dataframe_name', 'deployment_id']).to_dict(orient='records')}
+
+    def health(self) -> dict:
+        return {'status': 'ok', 'tickers': {ticker: str(latest_row['Date'].iloc[0].date())\
+            for ticker, latest_row in self.latest_rows.items()}}
+
+    def close(self) -> None:
+        self.client.close()
+
+
+def _make_handler(daemon: ScoringDaemon):
+
+    class ScoringRequestHandler(BaseHTTPRequestHandler):
+        #Keep-alive, so a caller polling the daemon reuses its connection, and no Nagle delay on the small
+        #responses - headers and body go out in separate writes
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            if daemon.verbose: BaseHTTPRequestHandler.log_message(self, format, *args)
+
+        def _send(self, status: int, body: dict) -> None:
+            payload = json.dumps(body, default=str).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _handle(self, action) -> None:
+            try:
+                self._send(200, action())
+            except (KeyError, ValueError, TypeError) as error:
+                self._send(400, {'error': str(error.args[0]) if error.args else repr(error)})
+            except Exception as error:
+                self._send(500, {'error': repr(error)})
+
+        def _body(self) -> dict:
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length)) if length else {}
+            if not isinstance(body, dict):
+                raise ValueError('The request body should be a JSON object')
+            return body
+
+        def do_GET(self):
+            if self.path == '/health':
+                self._handle(daemon.health)
+            else:
+                self._send(404, {'error': 'Unknown path {}'.format(self.path)})
+
+        def do_POST(self):
+            if self.path == '/bars':
+                def _action():
+                    body = self._body()
+                    return {'ticker': body['ticker'], 'last_date': str(daemon.add_bars(body['ticker'], body['bars']).date())}
+            elif self.path == '/predict':
+                def _action():
+                    body = self._body()
+                    return daemon.predict(body['ticker'], body['strategy'], int(body['shift_period']), float(body['move_value']),\
+                        bar= body.get('bar'), deployment_id= body.get('deployment_id'), deployment_key= body.get('deployment_key'))
+            elif self.path == '/score':
+                def _action():
+                    body = self._body()
+                    return {'predictions': daemon.score_jobs(bars= body.get('bars'), refresh= bool(body.get('refresh', False)))}
+            else:
+                self._send(404, {'error': 'Unknown path {}'.format(self.path)})
+                return
+            self._handle(_action)
+
+    return ScoringRequestHandler
+
+
+def serve(settings, daemon=None, verbose=True) -> None:
+    '''
+    Warm a ScoringDaemon and serve its API on scoring_daemon.host:port until interrupted
+    args:
+        settings: settings.Settings
+        daemon: ScoringDaemon to serve; built from the settings when not given
+        verbose: choose whether to add prints and logs
+    '''
+    if daemon is None:
+        daemon = ScoringDaemon(settings, verbose= verbose)
+    if verbose: print('\nWarming the scoring daemon for {} tickers...'.format(len(settings.data.ticker_list)))
+    daemon.warm(refresh= settings.scoring_daemon.refresh_on_start)
+    server = ThreadingHTTPServer((settings.scoring_daemon.host, settings.scoring_daemon.port), _make_handler(daemon))
+    server.daemon_threads = True
+    if verbose: print('Scoring daemon listening on http://{}:{}.'.format(*server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        daemon.close()
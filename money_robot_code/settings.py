@@ -0,0 +1,427 @@
+# -*- coding: utf-8 -*-
+
+#Core libraries
+import threading
+from dataclasses import dataclass, field
+
+
+'''
+Typed, validated view of config.yaml. The file is parsed once per process by load_settings() and every
+setting is checked up front, so a typo or a wrong type fails at start-up with the offending key instead of
+halfway through a run. Modules take the Settings object (or one of its sections) instead of reading the file
+themselves. Sections a run may not need - snowflake, datarobot_settings and datarobot_api_scoring_settings -
+are None when they are missing from the file; Settings.require() raises when a command needs one of them.
+'''
+
+
+DEFAULT_CONFIG_PATH = 'config.yaml'
+
+#Marks a setting that has no default
+_REQUIRED = object()
+
+#Settings read from config files, keyed by path - each file is only read once per process
+_loaded_settings = {}
+_loaded_settings_lock = threading.Lock()
+
+
+def _check(section: dict, section_name: str, key: str, types, default=_REQUIRED, choices=None, allow_none=False):
+    #One setting: present (or defaulted), of the right type and, if given, one of the choices
+    if key not in section or (section[key] is None and default is not _REQUIRED and not allow_none):
+        if default is _REQUIRED:
+            raise ValueError('{}.{} is missing from the config file'.format(section_name, key))
+        return default
+    value = section[key]
+    if value is None and allow_none:
+        return None
+    #yaml reads true/false as bools, which are also ints - don't let them pass as numbers
+    if not isinstance(value, types) or (isinstance(value, bool) and bool not in (types if isinstance(types, tuple) else (types,))):
+        raise ValueError('{}.{} should be {}, got {!r}'.format(section_name, key, _type_names(types), value))
+    if choices is not None and value not in choices:
+        raise ValueError('{}.{} should be one of {}, got {!r}'.format(section_name, key, choices, value))
+    return value
+
+
+def _check_list(section: dict, section_name: str, key: str, item_types, default=_REQUIRED, allow_none=False) -> list:
+    value = _check(section, section_name, key, list, default= default, allow_none= allow_none)
+    if value is None:
+        return None
+    for item in value:
+        if not isinstance(item, item_types) or isinstance(item, bool):
+            raise ValueError('{}.{} should be a list of {}, got {!r}'.format(section_name, key, _type_names(item_types), item))
+    return list(value)
+
+
+def _type_names(types) -> str:
+    return ' or '.join(kind.__name__ for kind in (types if isinstance(types, tuple) else (types,)))
+
+
+def _section(config: dict, section_name: str, required=True) -> dict:
+    section = config.get(section_name)
+    if section is None:
+        if required:
+            raise ValueError('The {} section is missing from the config file'.format(section_name))
+        return None
+    if not isinstance(section, dict):
+        raise ValueError('The {} section of the config file should be a mapping, got {!r}'.format(section_name, section))
+    return section
+
+
+@dataclass(frozen=True)
+class DataSettings:
+    '''
+    The "data" section: tickers, the configuration grid and how features and targets are built
+    '''
+    ticker_list: list
+    shift_period_list: list
+    move_value_list: list
+    strategy_list: list
+    table_prefix: str
+    price_store_dir: str = 'data/price_store'
+    indicator_engine: str = 'ta'
+    indicator_list: list = None
+    #Float precision of the price and indicator columns - see schema.DatasetSchema
+    indicator_dtype: str = 'float64'
+    #How the move_value quantile thresholds are taken - 'global' over the whole history, or 'expanding' /
+    #'rolling' over only the moves known on each day, so the targets don't look ahead
+    threshold_mode: str = 'global'
+    threshold_window: int = None
+    threshold_min_periods: int = None
+
+    @classmethod
+    def from_dict(cls, section: dict):
+        name = 'data'
+        settings = cls(ticker_list= _check_list(section, name, 'ticker_list', str),\
+            shift_period_list= _check_list(section, name, 'shift_period_list', int),\
+            move_value_list= _check_list(section, name, 'move_value_list', (int, float)),\
+            strategy_list= _check_list(section, name, 'strategy_list', str),\
+            table_prefix= _check(section, name, 'table_prefix', str),\
+            price_store_dir= _check(section, name, 'price_store_dir', str, default='data/price_store'),\
+            indicator_engine= _check(section, name, 'indicator_engine', str, default='ta', choices=['ta', 'native']),\
+            indicator_list= _check_list(section, name, 'indicator_list', str, default=None, allow_none=True),\
+            indicator_dtype= _check(section, name, 'indicator_dtype', str, default='float64', choices=['float32', 'float64']),\
+            threshold_mode= _check(section, name, 'threshold_mode', str, default='global', choices=['global', 'expanding', 'rolling']),\
+            threshold_window= _check(section, name, 'threshold_window', int, default=None, allow_none=True),\
+            threshold_min_periods= _check(section, name, 'threshold_min_periods', int, default=None, allow_none=True))
+        if not settings.ticker_list:
+            raise ValueError('data.ticker_list should list at least one ticker')
+        if any(shift_period < 1 for shift_period in settings.shift_period_list):
+            raise ValueError('data.shift_period_list should only hold positive periods, got {}'.format(settings.shift_period_list))
+        if any(move_value <= 0 or move_value >= 1 for move_value in settings.move_value_list):
+            raise ValueError('data.move_value_list should only hold quantiles between 0 and 1, got {}'.format(settings.move_value_list))
+        if any(strategy not in ['buy', 'sell'] for strategy in settings.strategy_list):
+            raise ValueError('data.strategy_list should only hold "buy" and "sell", got {}'.format(settings.strategy_list))
+        if settings.threshold_mode == 'rolling' and settings.threshold_window is None:
+            raise ValueError('data.threshold_window is required when data.threshold_mode is "rolling"')
+        return settings
+
+    @property
+    def target_settings(self) -> dict:
+        '''
+        Keyword arguments for data_engineering.build_target_matrix
+        '''
+        return {'threshold_mode': self.threshold_mode, 'threshold_window': self.threshold_window,\
+            'threshold_min_periods': self.threshold_min_periods}
+
+
+@dataclass(frozen=True)
+class AppSettings:
+    '''
+    The "app" section: which steps a full run does, where it saves data and how many workers it uses
+    '''
+    save_data_locally: bool = False
+    load_data_into_snowflake: bool = False
+    model_factory: bool = False
+    api_scoring: bool = False
+    #'csv' writes one file per table; 'parquet' or 'feather' write one partitioned dataset to dataset_dir
+    save_format: str = 'csv'
+    dataset_dir: str = 'data/dataset'
+    #cpu_workers processes for feature engineering (None: every core), io_workers threads for reading price
+    #data and uploading to DataRobot
+    cpu_workers: int = None
+    io_workers: int = 8
+
+    @classmethod
+    def from_dict(cls, section: dict):
+        name = 'app'
+        return cls(save_data_locally= _check(section, name, 'save_data_locally', bool, default=False),\
+            load_data_into_snowflake= _check(section, name, 'load_data_into_snowflake', bool, default=False),\
+            model_factory= _check(section, name, 'model_factory', bool, default=False),\
+            api_scoring= _check(section, name, 'api_scoring', bool, default=False),\
+            save_format= _check(section, name, 'save_format', str, default='csv', choices=['csv', 'parquet', 'feather']),\
+            dataset_dir= _check(section, name, 'dataset_dir', str, default='data/dataset'),\
+            cpu_workers= _check(section, name, 'cpu_workers', int, default=None, allow_none=True),\
+            io_workers= _check(section, name, 'io_workers', int, default=8))
+
+
+@dataclass(frozen=True)
+class InstrumentationSettings:
+    '''
+    The "instrumentation" section - when enabled, every stage run is written to a JSON-lines trace
+    '''
+    enabled: bool = False
+    trace_path: str = None
+
+    @classmethod
+    def from_dict(cls, section: dict):
+        name = 'instrumentation'
+        return cls(enabled= _check(section, name, 'enabled', bool, default=False),\
+            trace_path= _check(section, name, 'trace_path', str, default=None, allow_none=True))
+
+
+@dataclass(frozen=True)
+class BacktestSettings:
+    '''
+    The "backtest" section - when enabled, only the top_k configurations of each ticker go on to the model factory
+    '''
+    enabled: bool = False
+    n_splits: int = 5
+    min_train_rows: int = 500
+    ridge: float = 10.0
+    top_k: int = 3
+    min_signals: int = 20
+    ranking_path: str = 'data/backtest_ranking.csv'
+
+    @classmethod
+    def from_dict(cls, section: dict):
+        name = 'backtest'
+        return cls(enabled= _check(section, name, 'enabled', bool, default=False),\
+            n_splits= _check(section, name, 'n_splits', int, default=5),\
+            min_train_rows= _check(section, name, 'min_train_rows', int, default=500),\
+            ridge= float(_check(section, name, 'ridge', (int, float), default=10.0)),\
+            top_k= _check(section, name, 'top_k', int, default=3),\
+            min_signals= _check(section, name, 'min_signals', int, default=20),\
+            ranking_path= _check(section, name, 'ranking_path', str, default='data/backtest_ranking.csv'))
+
+
+@dataclass(frozen=True)
+class StageCacheSettings:
+    '''
+    The "stage_cache" section - see stage_cache.StageCache
+    '''
+    enabled: bool = False
+    directory: str = 'data/stage_cache'
+    max_size_mb: float = 2048
+    max_age_days: float = 30
+
+    @classmethod
+    def from_dict(cls, section: dict):
+        name = 'stage_cache'
+        return cls(enabled= _check(section, name, 'enabled', bool, default=False),\
+            directory= _check(section, name, 'directory', str, default='data/stage_cache'),\
+            max_size_mb= _check(section, name, 'max_size_mb', (int, float), default=2048, allow_none=True),\
+            max_age_days= _check(section, name, 'max_age_days', (int, float), default=30, allow_none=True))
+
+
+@dataclass(frozen=True)
+class SnowflakeSettings:
+    '''
+    The "snowflake" section: connection settings and how tables are loaded
+    '''
+    account: str
+    user: str
+    password: str
+    warehouse: str
+    database: str
+    schema: str
+    role: str
+    max_connections: int = 4
+    #'create_replace' rewrites every table in full; 'merge' only sends the rows that changed since the last run
+    load_action: str = 'create_replace'
+    load_state_dir: str = 'data/load_state'
+
+    @classmethod
+    def from_dict(cls, section: dict):
+        name = 'snowflake'
+        connection_settings = {key: str(_check(section, name, key, (str, int))) for key in\
+            ['account', 'user', 'password', 'warehouse', 'database', 'schema', 'role']}
+        return cls(max_connections= _check(section, name, 'max_connections', int, default=4),\
+            load_action= _check(section, name, 'load_action', str, default='create_replace', choices=['create_replace', 'append', 'merge']),\
+            load_state_dir= _check(section, name, 'load_state_dir', str, default='data/load_state'), **connection_settings)
+
+    def connect_settings(self) -> dict:
+        '''
+        Keyword arguments for snowflake.connector.connect
+        '''
+        return {'account': self.account, 'user': self.user, 'password': self.password, 'warehouse': self.warehouse,\
+            'database': self.database, 'schema': self.schema, 'role': self.role}
+
+
+@dataclass(frozen=True)
+class DataRobotSettings:
+    '''
+    The "datarobot_settings" section: API credentials and the model factory settings
+    '''
+    endpoint: str
+    token: str
+    #Projects are tracked in a manifest per factory run - by default one per day
+    factory_run_id: str = None
+    manifest_dir: str = 'data/model_factory'
+    max_in_flight_uploads: int = None
+    #How often and how long "--wait" polls Autopilot; no timeout waits until every project is done
+    autopilot_poll_interval: float = 60
+    autopilot_timeout: float = None
+
+    @classmethod
+    def from_dict(cls, section: dict):
+        name = 'datarobot_settings'
+        factory_run_id = _check(section, name, 'factory_run_id', (str, int), default=None, allow_none=True)
+        return cls(endpoint= _check(section, name, 'endpoint', str), token= _check(section, name, 'token', str),\
+            factory_run_id= None if factory_run_id is None else str(factory_run_id),\
+            manifest_dir= _check(section, name, 'manifest_dir', str, default='data/model_factory'),\
+            max_in_flight_uploads= _check(section, name, 'max_in_flight_uploads', int, default=None, allow_none=True),\
+            autopilot_poll_interval= _check(section, name, 'autopilot_poll_interval', (int, float), default=60),\
+            autopilot_timeout= _check(section, name, 'autopilot_timeout', (int, float), default=None, allow_none=True))
+
+
+@dataclass(frozen=True)
+class ScoringJob:
+    '''
+    One dataframe to score on one deployment
+    '''
+    dataframe_name: str
+    deployment_id: str
+    deployment_key: str
+
+
+@dataclass(frozen=True)
+class ScoringSettings:
+    '''
+    The "datarobot_api_scoring_settings" section. The jobs come from its "jobs" list, or from its buy_/sell_
+    keys when there is no list; the buy_/sell_ jobs are also kept in strategy_jobs.
+    '''
+    jobs: list
+    strategy_jobs: dict = field(default_factory=dict)
+    api_url: str = None
+    max_concurrency: int = 4
+    max_retries: int = 3
+    backoff: float = 0.5
+    max_rows_per_batch: int = 10000
+    payload_format: str = 'json'
+    timeout: float = 60
+
+    @classmethod
+    def from_dict(cls, section: dict):
+        name = 'datarobot_api_scoring_settings'
+        strategy_jobs = {}
+        for strategy in ['buy', 'sell']:
+            keys = [strategy + '_dataframe_name', strategy + '_deployment_id', strategy + '_deployment_key']
+            if any(key in section for key in keys):
+                strategy_jobs[strategy] = ScoringJob(*[str(_check(section, name, key, (str, int))) for key in keys])
+        if 'jobs' in section:
+            jobs = []
+            for position, job in enumerate(_check(section, name, 'jobs', list)):
+                if not isinstance(job, dict):
+                    raise ValueError('{}.jobs[{}] should be a mapping, got {!r}'.format(name, position, job))
+                job_name = '{}.jobs[{}]'.format(name, position)
+                jobs.append(ScoringJob(*[str(_check(job, job_name, key, (str, int))) for key in\
+                    ['dataframe_name', 'deployment_id', 'deployment_key']]))
+        else:
+            jobs = [strategy_jobs[strategy] for strategy in ['buy', 'sell'] if strategy in strategy_jobs]
+        if not jobs:
+            raise ValueError('{} should have a "jobs" list or buy_/sell_ dataframe_name, deployment_id and deployment_key keys'.format(name))
+        return cls(jobs= jobs, strategy_jobs= strategy_jobs,\
+            api_url= _check(section, name, 'api_url', str, default=None, allow_none=True),\
+            max_concurrency= _check(section, name, 'max_concurrency', int, default=4),\
+            max_retries= _check(section, name, 'max_retries', int, default=3),\
+            backoff= float(_check(section, name, 'backoff', (int, float), default=0.5)),\
+            max_rows_per_batch= _check(section, name, 'max_rows_per_batch', int, default=10000),\
+            payload_format= _check(section, name, 'payload_format', str, default='json', choices=['json', 'csv']),\
+            timeout= float(_check(section, name, 'timeout', (int, float), default=60)))
+
+
+@dataclass(frozen=True)
+class ScoringDaemonSettings:
+    '''
+    The "scoring_daemon" section - see scoring_daemon.ScoringDaemon
+    '''
+    host: str = '127.0.0.1'
+    port: int = 8787
+    #Where the online indicator states are kept between daemon runs
+    indicator_state_dir: str = 'data/indicator_state'
+    #Download the bars missing from the price store when the daemon starts
+    refresh_on_start: bool = False
+
+    @classmethod
+    def from_dict(cls, section: dict):
+        name = 'scoring_daemon'
+        return cls(host= _check(section, name, 'host', str, default='127.0.0.1'),\
+            port= _check(section, name, 'port', int, default=8787),\
+            indicator_state_dir= _check(section, name, 'indicator_state_dir', str, default='data/indicator_state'),\
+            refresh_on_start= _check(section, name, 'refresh_on_start', bool, default=False))
+
+
+@dataclass(frozen=True)
+class Settings:
+    '''
+    Every section of the config file
+    '''
+    data: DataSettings
+    app: AppSettings
+    instrumentation: InstrumentationSettings
+    backtest: BacktestSettings
+    stage_cache: StageCacheSettings
+    scoring_daemon: ScoringDaemonSettings
+    snowflake: SnowflakeSettings = None
+    datarobot: DataRobotSettings = None
+    scoring: ScoringSettings = None
+    path: str = None
+
+    #Attribute of each optional section, keyed by its name in the config file
+    OPTIONAL_SECTIONS = {'snowflake': 'snowflake', 'datarobot_settings': 'datarobot',\
+        'datarobot_api_scoring_settings': 'scoring'}
+
+    @classmethod
+    def from_dict(cls, config: dict, path: str = None):
+        '''
+        Validate a parsed config file
+        args:
+            config: the parsed config file
+            path: where it was read from, for error messages
+        rtypes:
+            settings: Settings
+        '''
+        if not isinstance(config, dict):
+            raise ValueError('The config file should be a mapping of sections, got {!r}'.format(config))
+        optional_settings = {}
+        for section_name, section_class in [('snowflake', SnowflakeSettings), ('datarobot_settings', DataRobotSettings),\
+            ('datarobot_api_scoring_settings', ScoringSettings)]:
+            section = _section(config, section_name, required=False)
+            if section is not None:
+                optional_settings[cls.OPTIONAL_SECTIONS[section_name]] = section_class.from_dict(section)
+        return cls(data= DataSettings.from_dict(_section(config, 'data')),\
+            app= AppSettings.from_dict(_section(config, 'app', required=False) or {}),\
+            instrumentation= InstrumentationSettings.from_dict(_section(config, 'instrumentation', required=False) or {}),\
+            backtest= BacktestSettings.from_dict(_section(config, 'backtest', required=False) or {}),\
+            stage_cache= StageCacheSettings.from_dict(_section(config, 'stage_cache', required=False) or {}),\
+            scoring_daemon= ScoringDaemonSettings.from_dict(_section(config, 'scoring_daemon', required=False) or {}),\
+            path= path, **optional_settings)
+
+    def require(self, *section_names):
+        '''
+        Raise if any of the given optional sections (by their config file names) is missing
+        '''
+        for section_name in section_names:
+            if getattr(self, self.OPTIONAL_SECTIONS[section_name]) is None:
+                raise ValueError('The {} section is missing from {}'.format(section_name, self.path or 'the config file'))
+        return self
+
+
+def load_settings(config_path: str = DEFAULT_CONFIG_PATH) -> Settings:
+    '''
+    Read and validate the config file, once per process
+    args:
+        config_path: path to the config file
+    rtypes:
+        settings: Settings
+    '''
+    with _loaded_settings_lock:
+        if config_path not in _loaded_settings:
+            #yaml is only needed here, so it isn't imported by modules that are handed their settings
+            import yaml
+            with open(config_path, "r") as ymlfile:
+                config = yaml.safe_load(ymlfile)
+            try:
+                _loaded_settings[config_path] = Settings.from_dict(config, path= config_path)
+            except ValueError as error:
+                raise ValueError('{}: {}'.format(config_path, error)) from None
+        return _loaded_settings[config_path]
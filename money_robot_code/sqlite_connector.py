@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+#Core libraries
+import re
+import time
+import sqlite3
+import threading
+import pandas as pd
+
+
+'''
+Local stand-in for snowflake.connector, backed by SQLite. It takes the same connect(**settings) call as
+Snowflake (the settings are ignored) and understands the Snowflake SQL used in database_operations, so the
+Snowflake load path can be run end to end without an account. Pass an SQLiteConnector as the connector of a
+database_operations.SnowflakeSessionPool.
+'''
+
+
+class SQLiteCursor:
+    '''
+    DB-API cursor that rewrites the Snowflake-only statements into SQLite before running them
+    '''
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.cursor = connection.sqlite_connection.cursor()
+
+    def execute(self, statement: str, parameters=None):
+        for sqlite_statement in translate_statement(statement):
+            if parameters is None:
+                self.cursor.execute(sqlite_statement)
+            else:
+                self.cursor.execute(sqlite_statement, tuple(parameters))
+        return self
+
+    def executemany(self, statement: str, parameter_rows):
+        for sqlite_statement in translate_statement(statement):
+            self.cursor.executemany(sqlite_statement, [tuple(row) for row in parameter_rows])
+        return self
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    def close(self):
+        self.cursor.close()
+
+
+class SQLiteConnection:
+    def __init__(self, path: str):
+        #Autocommit, like a default Snowflake session; writers from other connections wait instead of failing
+        self.sqlite_connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=60)
+        self.closed = False
+
+    def cursor(self) -> SQLiteCursor:
+        return SQLiteCursor(self)
+
+    def commit(self):
+        return None
+
+    def rollback(self):
+        return None
+
+    def is_closed(self) -> bool:
+        return self.closed
+
+    def close(self):
+        if not self.closed:
+            self.sqlite_connection.close()
+            self.closed = True
+
+
+class SQLiteConnector:
+    '''
+    Connector object with the snowflake.connector interface used by database_operations
+    args:
+        path: SQLite database file shared by every connection
+        connect_latency: seconds to sleep in every connect call, to stand in for the Snowflake handshake
+    '''
+
+    def __init__(self, path: str, connect_latency: float = 0.0):
+        self.path = path
+        self.connect_latency = connect_latency
+        self.connection_count = 0
+        self.lock = threading.Lock()
+
+    def connect(self, **settings) -> SQLiteConnection:
+        if self.connect_latency:
+            time.sleep(self.connect_latency)
+        with self.lock:
+            self.connection_count += 1
+        return SQLiteConnection(self.path)
+
+    def write_pandas(self, connection: SQLiteConnection, df: pd.DataFrame, table_name: str):
+        '''
+        Same call and return value as snowflake.connector.pandas_tools.write_pandas
+        '''
+        placeholders = ', '.join(['?'] * len(df.columns))
+        columns = ', '.join('"{}"'.format(column) for column in df.columns)
+        rows = [tuple(None if pd.isna(value) else value for value in row) for row in df.astype(object).itertuples(index=False, name=None)]
+        cursor = connection.sqlite_connection.cursor()
+        try:
+            #One transaction for the whole frame, like a single COPY INTO
+            cursor.execute('BEGIN')
+            try:
+                cursor.executemany('INSERT INTO {} ({}) VALUES ({})'.format(table_name, columns, placeholders), rows)
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+            cursor.execute('COMMIT')
+        finally:
+            cursor.close()
+        return True, 1, len(rows), []
+
+
+def translate_statement(statement: str) -> list:
+    '''
+    Rewrite one Snowflake statement into the SQLite statements that do the same thing
+    '''
+    statement = statement.strip()
+    create_replace = re.match(r'CREATE\s+OR\s+REPLACE\s+(TEMPORARY\s+)?TABLE\s+(\w+)\s*\((.*)\)$', statement, flags=re.IGNORECASE | re.DOTALL)
+    if create_replace:
+        temporary, table, columns = create_replace.groups()
+        return ['DROP TABLE IF EXISTS {}'.format(table),\
+            'CREATE {}TABLE {}({})'.format('TEMP ' if temporary else '', table, columns)]
+
+    #database_operations.build_merge_statement's MERGE becomes an UPDATE of the matched rows plus an INSERT of the rest
+    merge = re.match(r'MERGE\s+INTO\s+(\w+)\s+USING\s+(\w+)\s+ON\s+\w+\.(\w+)\s*=\s*\w+\.\w+'
+        r'\s+WHEN\s+MATCHED\s+THEN\s+UPDATE\s+SET\s+(.*?)\s+WHEN\s+NOT\s+MATCHED\s+THEN\s+INSERT\s*\((.*?)\)\s*VALUES\s*\((.*)\)$',\
+        statement, flags=re.IGNORECASE | re.DOTALL)
+    if merge:
+        table, stage_table, key, updates, columns, values = merge.groups()
+        update_columns = [update.split('=')[0].strip().split('.')[-1] for update in updates.split(',')]
+        assignments = ', '.join('{column} = (SELECT {stage}.{column} FROM {stage} WHERE {stage}.{key} = {table}.{key})'.format(\
+            column= column, stage= stage_table, key= key, table= table) for column in update_columns)
+        return [
+            'UPDATE {table} SET {assignments} WHERE {key} IN (SELECT {key} FROM {stage})'.format(table= table,\
+                assignments= assignments, key= key, stage= stage_table),
+            'INSERT INTO {table} ({columns}) SELECT {values} FROM {stage} WHERE {stage}.{key} NOT IN (SELECT {key} FROM {table})'.format(\
+                table= table, columns= columns, values= values, stage= stage_table, key= key),
+        ]
+    show_tables = re.match(r"SHOW\s+TABLES\s+LIKE\s+'(\w+)'$", statement, flags=re.IGNORECASE)
+    if show_tables:
+        #Same column position for the name as Snowflake's SHOW TABLES output (created_on, name, ...)
+        return ["SELECT NULL AS created_on, name FROM sqlite_master WHERE type = 'table' AND name LIKE '{}'".format(show_tables.group(1))]
+    #Snowflake's pyformat placeholders become SQLite's qmark placeholders
+    return [statement.replace('%s', '?')]
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+#Core libraries
+import os
+import sys
+import time
+import pickle
+import hashlib
+import threading
+import pandas as pd
+import numpy as np
+
+
+'''
+Content-addressed cache for pipeline stages. A stage's output is stored under a hash of everything it was
+computed from - the input data, its settings and the source code of the modules that compute it - so a
+re-run after a config change only recomputes (or re-uploads) what the change actually touched. Stages with
+side effects, like table loads and project creation, store a small record instead of their output.
+
+Entries live in <directory>/<stage>/<key[:2]>/<key>.pkl. An entry's modification time is its last use;
+evict() drops entries unused for longer than max_age_days and then the least recently used ones until the
+cache fits in max_size_mb.
+'''
+
+
+#Returned by get() when the key isn't cached - None is a valid cached value
+MISSING = object()
+
+#Source hashes of modules, computed once per process
+_code_versions = {}
+_code_versions_lock = threading.Lock()
+
+
+def code_version(*module_names) -> str:
+    '''
+    Hash of the source files of the given modules, e.g. code_version('money_robot_code.indicator_engine')
+    '''
+    digest = hashlib.sha256()
+    for module_name in sorted(module_names):
+        with _code_versions_lock:
+            if module_name not in _code_versions:
+                module = sys.modules.get(module_name)
+                if module is None:
+                    module = __import__(module_name, fromlist=['_'])
+                with open(module.__file__, 'rb') as source_file:
+                    _code_versions[module_name] = hashlib.sha256(source_file.read()).hexdigest()
+            digest.update(module_name.encode('utf-8') + b'=' + _code_versions[module_name].encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _update_digest(digest, value) -> None:
+    if isinstance(value, pd.DataFrame):
+        digest.update(b'DataFrame')
+        digest.update(repr([(str(column), str(dtype)) for column, dtype in value.dtypes.items()]).encode('utf-8'))
+        digest.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+    elif isinstance(value, pd.Series):
+        digest.update(b'Series' + repr((value.name, str(value.dtype))).encode('utf-8'))
+        digest.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+    elif isinstance(value, np.ndarray):
+        digest.update(b'ndarray' + repr((value.dtype.str, value.shape)).encode('utf-8'))
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (list, tuple)):
+        digest.update(type(value).__name__.encode('utf-8') + str(len(value)).encode('utf-8'))
+        for item in value:
+            _update_digest(digest, item)
+    elif isinstance(value, dict):
+        digest.update(b'dict' + str(len(value)).encode('utf-8'))
+        for item_key in sorted(value, key=repr):
+            _update_digest(digest, item_key)
+            _update_digest(digest, value[item_key])
+    else:
+        digest.update(b'value' + repr(value).encode('utf-8'))
+
+
+def stage_key(stage: str, modules: list, *inputs) -> str:
+    '''
+    Cache key of a stage run
+    args:
+        stage: name of the stage, e.g. 'features'
+        modules: modules whose source the stage's output depends on
+        inputs: everything else the output depends on - dataframes, series, arrays, lists, dicts and plain values
+    rtypes:
+        key: hex digest
+    '''
+    digest = hashlib.sha256()
+    digest.update(stage.encode('utf-8'))
+    digest.update(code_version(*modules).encode('utf-8'))
+    for value in inputs:
+        _update_digest(digest, value)
+    return digest.hexdigest()
+
+
+class StageCache:
+    '''
+    On-disk store of stage outputs, keyed by stage_key
+    args:
+        directory: folder holding the cache
+        max_size_mb: size evict() trims the cache to, None for no limit
+        max_age_days: entries not used for this long are dropped by evict(), None to keep them
+        verbose: choose whether to add prints and logs
+    '''
+
+    def __init__(self, directory: str = 'data/stage_cache', max_size_mb: float = None, max_age_days: float = None, verbose=True):
+        self.directory = directory
+        self.max_size_mb = max_size_mb
+        self.max_age_days = max_age_days
+        self.verbose = verbose
+        self.hits = {}
+        self.misses = {}
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, stage: str, key: str) -> str:
+        return os.path.join(self.directory, stage, key[:2], key + '.pkl')
+
+    def get(self, stage: str, key: str):
+        '''
+        Cached value of a stage run, or MISSING
+        '''
+        path = self.path(stage, key)
+        try:
+            with open(path, 'rb') as cache_file:
+                value = pickle.load(cache_file)
+        except FileNotFoundError:
+            self.misses[stage] = self.misses.get(stage, 0) + 1
+            return MISSING
+        except Exception as error:
+            #Truncated, corrupt, or pickled by code that has changed since (AttributeError, ImportError...) -
+            #a miss, and the entry is dropped so it's written again
+            if self.verbose: print('Dropping unreadable {} cache entry {} ({}).'.format(stage, key[:12], type(error).__name__))
+            self.misses[stage] = self.misses.get(stage, 0) + 1
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return MISSING
+        try:
+            #Mark the entry as recently used
+            os.utime(path, None)
+        except OSError:
+            pass
+        self.hits[stage] = self.hits.get(stage, 0) + 1
+        return value
+
+    def put(self, stage: str, key: str, value) -> None:
+        #Write to a temp file and swap it in, so an interrupted run never leaves a truncated entry
+        path = self.path(stage, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+        with open(temp_path, 'wb') as cache_file:
+            pickle.dump(value, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+
+    def contains(self, stage: str, key: str) -> bool:
+        return os.path.exists(self.path(stage, key))
+
+    def call(self, stage: str, key: str, function, *args, **kwargs):
+        '''
+        Return the cached value of key, or run function(*args, **kwargs) and cache what it returns. Use it
+        for side effects too - a load that was already done is not run again.
+        '''
+        value = self.get(stage, key)
+        if value is MISSING:
+            value = function(*args, **kwargs)
+            self.put(stage, key, value)
+        return value
+
+    def entries(self) -> list:
+        '''
+        Every entry as (path, size in bytes, last used time), oldest first
+        '''
+        entries = []
+        for root, _, file_names in os.walk(self.directory):
+            for file_name in file_names:
+                if not file_name.endswith('.pkl'):
+                    continue
+                path = os.path.join(root, file_name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((path, stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def evict(self) -> int:
+        '''
+        Drop entries older than max_age_days, then the least recently used ones until the cache is within
+        max_size_mb
+        rtypes:
+            removed: number of entries removed
+        '''
+        entries = self.entries()
+        removed = []
+        if self.max_age_days is not None:
+            cutoff = time.time() - self.max_age_days * 86400
+            removed = [entry for entry in entries if entry[2] < cutoff]
+            entries = [entry for entry in entries if entry[2] >= cutoff]
+        if self.max_size_mb is not None:
+            size = sum(entry[1] for entry in entries)
+            while entries and size > self.max_size_mb * 1e6:
+                entry = entries.pop(0)
+                removed.append(entry)
+                size -= entry[1]
+        for path, _, _ in removed:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        if self.verbose and removed: print('\nEvicted {} stage cache entries.'.format(len(removed)))
+        return len(removed)
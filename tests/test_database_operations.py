@@ -0,0 +1,101 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from money_robot_code import database_operations
+from money_robot_code.sqlite_connector import SQLiteConnector
+
+
+TABLE = 'MR_TEST_TABLE'
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / 'snowflake.sqlite')
+    session_pool = database_operations.SnowflakeSessionPool(settings={}, connector=SQLiteConnector(path), max_connections=2,\
+        verbose=False)
+    yield path, session_pool, database_operations.TableLoadStateStore(str(tmp_path / 'load_state'))
+    session_pool.close()
+
+
+def frame(rows=10, start='2020-01-01'):
+    return pd.DataFrame({'Date': pd.date_range(start, periods=rows, freq='B'), 'Close': np.arange(rows, dtype='float64') + 100.0,\
+        'Target': pd.array(np.arange(rows) % 2, dtype='Int8')})
+
+
+def load(database, df, action):
+    _, session_pool, load_state = database
+    database_operations.create_table(table=TABLE, action=action, col_type=database_operations.get_col_types(df.rename(columns=str.upper)),\
+        df=df, verbose=False, session_pool=session_pool, load_state=load_state)
+
+
+def table_rows(database):
+    with sqlite3.connect(database[0]) as connection:
+        return pd.read_sql('SELECT * FROM {} ORDER BY DATE'.format(TABLE), connection)
+
+
+def test_create_replace(database):
+    df = frame()
+    load(database, df, 'create_replace')
+    assert list(df.columns) == ['Date', 'Close', 'Target']
+    rows = table_rows(database)
+    assert list(rows.columns) == ['DATE', 'CLOSE', 'TARGET']
+    assert rows['CLOSE'].tolist() == df['Close'].tolist()
+    load(database, frame(rows=4), 'create_replace')
+    assert len(table_rows(database)) == 4
+
+
+def test_append(database):
+    load(database, frame(rows=5).rename(columns=str.upper), 'create_replace')
+    load(database, frame(rows=3, start='2021-01-01').rename(columns=str.upper), 'append')
+    assert len(table_rows(database)) == 8
+
+
+def test_merge_sends_changed_rows_and_deletes_removed_keys(database):
+    load(database, frame(), 'merge')
+    df = frame().iloc[1:].copy()
+    df.loc[5, 'Close'] = -1.0
+    df = pd.concat([df, frame(rows=2, start='2021-01-01')], ignore_index=True)
+    load(database, df, 'merge')
+    rows = table_rows(database)
+    assert len(rows) == len(df)
+    assert rows['CLOSE'].tolist() == df['Close'].tolist()
+
+
+def test_merge_schema_change_recreates_table(database):
+    load(database, frame(), 'merge')
+    df = frame().assign(Volume=pd.array(np.arange(10), dtype='Int64'))
+    load(database, df, 'merge')
+    assert list(table_rows(database).columns) == ['DATE', 'CLOSE', 'TARGET', 'VOLUME']
+
+
+def test_merge_recreates_dropped_or_changed_table(database):
+    load(database, frame(), 'merge')
+    with sqlite3.connect(database[0]) as connection:
+        connection.execute('DROP TABLE {}'.format(TABLE))
+    load(database, frame(), 'merge')
+    assert len(table_rows(database)) == 10
+
+    with sqlite3.connect(database[0]) as connection:
+        connection.execute('DELETE FROM {} WHERE CLOSE < 103'.format(TABLE))
+    load(database, frame(), 'merge')
+    assert len(table_rows(database)) == 10
+
+
+def test_merge_errors_are_raised(database, monkeypatch):
+    load(database, frame(), 'merge')
+    def failing_merge(*args, **kwargs):
+        raise RuntimeError('connection lost')
+    monkeypatch.setattr(database_operations, '_merge_rows', failing_merge)
+    with pytest.raises(RuntimeError, match='connection lost'):
+        load(database, frame(rows=11), 'merge')
+    assert database[2].read(TABLE) is not None
+
+
+def test_get_table_row_count(database):
+    _, session_pool, _ = database
+    assert database_operations.get_table_row_count(TABLE, session_pool=session_pool) is None
+    load(database, frame(), 'create_replace')
+    assert database_operations.get_table_row_count(TABLE, session_pool=session_pool) == 10
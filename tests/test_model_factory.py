@@ -0,0 +1,96 @@
+import pandas as pd
+import pytest
+
+from money_robot_code import model_factory
+from money_robot_code.fake_datarobot import FakeDataRobot
+
+
+KEYS = ['MR_AAA_BUY_SHIFT_1_MOVE_0_5_TRAIN', 'MR_BBB_BUY_SHIFT_1_MOVE_0_5_TRAIN', 'MR_CCC_BUY_SHIFT_1_MOVE_0_5_TRAIN']
+
+
+@pytest.fixture
+def manifest_path(tmp_path):
+    return str(tmp_path / 'manifest' / 'run.json')
+
+
+def frame():
+    return pd.DataFrame({'CLOSE': [1.0, 2.0, 3.0], 'TARGET': [0, 1, 0]})
+
+
+def run_factory(manifest_path, fake, keys=KEYS):
+    manifest = model_factory.ProjectManifest(manifest_path)
+    with model_factory.ModelFactoryScheduler(manifest, dr_client=fake, max_in_flight_uploads=2, verbose=False) as scheduler:
+        for key in keys:
+            scheduler.submit(frame(), key)
+        projects = scheduler.wait()
+    return manifest, projects
+
+
+def test_projects_are_created_and_recorded(manifest_path):
+    fake = FakeDataRobot()
+    manifest, projects = run_factory(manifest_path, fake)
+    assert sorted(projects) == KEYS
+    assert len(fake.projects) == 3
+    assert all(fake.projects[project_id].target == 'TARGET' for project_id in projects.values())
+    #The manifest on disk holds the same entries
+    reloaded = dict(model_factory.ProjectManifest(manifest_path).items())
+    assert {key: entry['state'] for key, entry in reloaded.items()} == {key: model_factory.MODELING for key in KEYS}
+    assert {key: entry['project_id'] for key, entry in reloaded.items()} == projects
+
+
+def test_rerun_resumes_without_new_projects(manifest_path):
+    fake = FakeDataRobot()
+    run_factory(manifest_path, fake)
+    _, projects = run_factory(manifest_path, fake)
+    assert len(fake.projects) == 3
+    assert sorted(projects) == KEYS
+
+
+def test_resume_after_a_crash(manifest_path):
+    fake = FakeDataRobot()
+    manifest = model_factory.ProjectManifest(manifest_path)
+    #Crashed after the upload of the first project, and during the upload of the second (which DataRobot still created)
+    uploaded = fake.Project.create(frame(), project_name=KEYS[0] + '_run')
+    manifest.update(KEYS[0], state=model_factory.UPLOADED, project_name=KEYS[0] + '_run', project_id=uploaded.id)
+    fake.Project.create(frame(), project_name=KEYS[1] + '_run')
+    manifest.update(KEYS[1], state=model_factory.UPLOADING, project_name=KEYS[1] + '_run')
+
+    manifest, projects = run_factory(manifest_path, fake)
+    assert len(fake.projects) == 3
+    assert projects[KEYS[0]] == uploaded.id
+    assert all(project.target == 'TARGET' for project in fake.projects.values())
+    assert {entry['state'] for _, entry in manifest.items()} == {model_factory.MODELING}
+
+
+def test_failed_upload_is_recorded_and_retried(manifest_path):
+    fake = FakeDataRobot()
+    create = fake.Project.create
+
+    def failing_create(sourcedata, project_name=None):
+        if project_name.startswith(KEYS[1]):
+            raise ConnectionError('upload failed')
+        return create(sourcedata, project_name=project_name)
+
+    fake.Project.create = failing_create
+    manifest, projects = run_factory(manifest_path, fake)
+    assert KEYS[1] not in projects
+    assert manifest.get(KEYS[1])['state'] == model_factory.FAILED
+    assert 'upload failed' in manifest.get(KEYS[1])['error']
+
+    fake.Project.create = create
+    manifest, projects = run_factory(manifest_path, fake)
+    assert sorted(projects) == KEYS
+    assert len(fake.projects) == 3
+
+
+def test_wait_for_autopilot(manifest_path):
+    fake = FakeDataRobot(polls_until_done=2)
+    run_factory(manifest_path, fake)
+    manifest = model_factory.ProjectManifest(manifest_path)
+    scheduler = model_factory.ModelFactoryScheduler(manifest, dr_client=fake, verbose=False)
+    try:
+        assert set(scheduler.poll().values()) == {model_factory.MODELING}
+        assert set(scheduler.wait_for_autopilot(poll_interval=0).values()) == {model_factory.COMPLETED}
+    finally:
+        scheduler.close()
+    assert all(entry['stage'] == 'modeling' for _, entry in manifest.items())
@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from money_robot_code import data_engineering, indicator_engine
+from money_robot_code.benchmark import synthetic_ohlcv
+from money_robot_code.online_indicators import OnlineIndicatorState, OnlineIndicatorStore
+
+
+ROWS = 300
+ONLINE_BARS = 40
+
+
+@pytest.fixture
+def price_dataframe():
+    price_dataframe = synthetic_ohlcv('TEST', ROWS, seed=1)
+    #Zero-volume runs make volume_em infinite, in the history and among the online bars
+    for start in [ROWS // 10, ROWS - ONLINE_BARS // 2]:
+        price_dataframe.loc[start:start + 4, 'Volume'] = 0
+    return price_dataframe
+
+
+def assert_same_indicators(expected: pd.DataFrame, actual: pd.DataFrame):
+    assert list(actual.columns) == list(expected.columns)
+    for column in expected.columns:
+        np.testing.assert_allclose(actual[column].to_numpy(dtype=np.float64), expected[column].to_numpy(dtype=np.float64),\
+            rtol=1e-6, atol=1e-9, equal_nan=True, err_msg=column)
+
+
+def test_update_matches_compute_indicators(price_dataframe):
+    expected = indicator_engine.compute_indicators(price_dataframe)
+    state = OnlineIndicatorState.from_history(price_dataframe.iloc[:ROWS - ONLINE_BARS])
+    online_dataframe = state.update(price_dataframe.iloc[ROWS - ONLINE_BARS:])
+    assert len(online_dataframe) == ONLINE_BARS
+    assert_same_indicators(expected.iloc[ROWS - ONLINE_BARS:], online_dataframe)
+
+
+def test_update_bar_by_bar_matches_compute_indicators(price_dataframe):
+    expected = indicator_engine.compute_indicators(price_dataframe)
+    state = OnlineIndicatorState.from_history(price_dataframe.iloc[:ROWS - ONLINE_BARS])
+    online_dataframe = pd.concat([state.update(price_dataframe.iloc[position:position + 1])\
+        for position in range(ROWS - ONLINE_BARS, ROWS)])
+    assert_same_indicators(expected.iloc[ROWS - ONLINE_BARS:], online_dataframe)
+
+
+def test_update_skips_bars_already_in_state(price_dataframe):
+    state = OnlineIndicatorState.from_history(price_dataframe)
+    assert len(state.update(price_dataframe)) == 0
+    assert state.bar_count == ROWS
+
+
+def test_update_feature_rows(price_dataframe, tmp_path):
+    state_store = OnlineIndicatorStore(str(tmp_path))
+    expected = data_engineering.build_feature_matrix(price_dataframe.copy(), verbose=False, engine='native')
+
+    first = data_engineering.update_feature_rows('TEST', price_dataframe.iloc[:ROWS - 1], state_store, verbose=False)
+    assert len(first) == ROWS - 1
+
+    new_rows = data_engineering.update_feature_rows('TEST', price_dataframe, state_store, verbose=False)
+    assert list(new_rows.columns) == list(expected.columns)
+    assert list(new_rows.index) == [ROWS - 1]
+    assert_same_indicators(expected[indicator_engine.ALL_INDICATOR_COLUMNS].iloc[-1:],\
+        new_rows[indicator_engine.ALL_INDICATOR_COLUMNS])
+
+    #No new bars - the latest row is served again from the saved state
+    latest_row = data_engineering.update_feature_rows('TEST', price_dataframe, state_store, verbose=False)
+    pd.testing.assert_frame_equal(latest_row, new_rows)
+
+
+def test_update_feature_rows_rebuilds_after_readjustment(price_dataframe, tmp_path):
+    state_store = OnlineIndicatorStore(str(tmp_path))
+    data_engineering.update_feature_rows('TEST', price_dataframe.iloc[:ROWS - 1], state_store, verbose=False)
+    adjusted_dataframe = price_dataframe.copy()
+    adjusted_dataframe[['Open', 'High', 'Low', 'Close']] /= 2
+    feature_dataframe = data_engineering.update_feature_rows('TEST', adjusted_dataframe, state_store, verbose=False)
+    assert len(feature_dataframe) == ROWS
+
+
+def test_store_cache_and_delete(price_dataframe, tmp_path):
+    state_store = OnlineIndicatorStore(str(tmp_path), cache=True)
+    data_engineering.update_feature_rows('TEST', price_dataframe, state_store, verbose=False)
+    assert state_store.read('TEST') is state_store.read('TEST')
+    assert OnlineIndicatorStore(str(tmp_path)).read('TEST').bar_count == ROWS
+    state_store.delete('TEST')
+    assert state_store.read('TEST') is None
@@ -0,0 +1,98 @@
+import os
+
+import pandas as pd
+import pytest
+
+from money_robot_code.benchmark import synthetic_ohlcv
+from money_robot_code.price_store import LocalDataSource, PriceStore
+
+
+ROWS = 60
+
+
+class CountingDataSource(LocalDataSource):
+    '''
+    LocalDataSource that records the start date of every fetch
+    '''
+
+    def __init__(self, directory):
+        super().__init__(directory)
+        self.starts = []
+
+    def fetch(self, ticker, start=None):
+        self.starts.append(start)
+        return super().fetch(ticker, start=start)
+
+
+@pytest.fixture
+def history():
+    return synthetic_ohlcv('TEST', ROWS + 5, seed=2)
+
+
+@pytest.fixture
+def source(tmp_path):
+    os.makedirs(str(tmp_path / 'source'))
+    return CountingDataSource(str(tmp_path / 'source'))
+
+
+@pytest.fixture
+def price_store(tmp_path, source):
+    return PriceStore(str(tmp_path / 'store'), data_source=source, verbose=False)
+
+
+def publish(source, price_dataframe):
+    price_dataframe.to_csv(os.path.join(source.directory, 'TEST.csv'), index=False)
+
+
+def test_first_download_then_only_new_bars(price_store, source, history):
+    publish(source, history.iloc[:ROWS])
+    assert len(price_store.update('TEST')) == ROWS
+    assert source.starts == [None]
+
+    publish(source, history.iloc[:ROWS + 2])
+    stored = price_store.update('TEST')
+    pd.testing.assert_frame_equal(stored, history.iloc[:ROWS + 2].reset_index(drop=True), check_dtype=False)
+    #Only the bars from the last stored date onwards were asked for
+    assert source.starts[1] == history['Date'].iloc[ROWS - 1]
+    assert 'TEST' not in price_store.redownloaded_tickers
+
+
+def test_split_redownloads_adjusted_history(price_store, source, history):
+    publish(source, history.iloc[:ROWS])
+    price_store.update('TEST')
+
+    #A 2:1 split halves every past adjusted price and doubles the volumes
+    adjusted = history.iloc[:ROWS + 1].copy()
+    adjusted[['Open', 'High', 'Low', 'Close']] /= 2
+    adjusted['Volume'] *= 2
+    adjusted.loc[ROWS, 'Stock Splits'] = 2.0
+    publish(source, adjusted)
+    stored = price_store.update('TEST')
+    assert source.starts[-1] is None
+    assert 'TEST' in price_store.redownloaded_tickers
+    pd.testing.assert_frame_equal(stored, adjusted.reset_index(drop=True), check_dtype=False)
+    pd.testing.assert_frame_equal(price_store.read('TEST'), stored)
+
+    #The next update is incremental again
+    publish(source, pd.concat([adjusted, history.iloc[ROWS + 1:ROWS + 2].assign(**{'Stock Splits': 0.0})]))
+    price_store.update_many(['TEST'])
+    assert 'TEST' not in price_store.redownloaded_tickers
+
+
+def test_dividend_on_a_new_bar_redownloads(price_store, source, history):
+    publish(source, history.iloc[:ROWS])
+    price_store.update('TEST')
+    dividend = history.iloc[:ROWS + 1].copy()
+    dividend.loc[ROWS, 'Dividends'] = 0.5
+    publish(source, dividend)
+    price_store.update('TEST')
+    assert 'TEST' in price_store.redownloaded_tickers
+    assert source.starts[-1] is None
+
+
+def test_merge_keeps_one_row_per_date(price_store, history):
+    stored = history.iloc[:ROWS].reset_index(drop=True)
+    merged = price_store.merge('TEST', stored, history.iloc[ROWS - 1:ROWS + 3])
+    assert len(merged) == ROWS + 3
+    assert merged['Date'].is_unique and merged['Date'].is_monotonic_increasing
+    assert price_store.merge('TEST', stored, history.iloc[:0]) is stored
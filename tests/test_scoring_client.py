@@ -0,0 +1,132 @@
+import io
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pandas as pd
+import pytest
+import requests
+
+from money_robot_code.scoring_client import PredictionClient
+
+
+class StubPredictionServer:
+    '''
+    Local prediction API: each deployment id answers the statuses queued for it first, then 200. Bodies with
+    more than max_rows rows are rejected with 413.
+    '''
+
+    def __init__(self, max_rows=None):
+        self.max_rows = max_rows
+        self.statuses = {}
+        self.requests = []
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                deployment_id = self.path.strip('/')
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                if self.headers['Content-Type'].startswith('text/plain'):
+                    rows = pd.read_csv(io.BytesIO(body)).to_dict(orient='records')
+                else:
+                    rows = json.loads(body)
+                with stub.lock:
+                    stub.requests.append((deployment_id, len(rows)))
+                    queued = stub.statuses.get(deployment_id, [])
+                    status, headers = queued.pop(0) if queued else (200, {})
+                if status == 200 and stub.max_rows is not None and len(rows) > stub.max_rows:
+                    status = 413
+                payload = json.dumps({'data': [{'rowId': position, 'prediction': row['VALUE']} for position, row in enumerate(rows)]}\
+                    if status == 200 else {'message': 'error'}).encode('utf-8')
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = 'http://127.0.0.1:{}/{{deployment_id}}'.format(self.server.server_address[1])
+
+    def attempts(self, deployment_id):
+        return [rows for requested_id, rows in self.requests if requested_id == deployment_id]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub():
+    stub = StubPredictionServer()
+    yield stub
+    stub.close()
+
+
+def client(stub, **settings):
+    return PredictionClient('token', api_url=stub.url, backoff=0.0, verbose=False, **settings)
+
+
+def frame(rows):
+    return pd.DataFrame({'VALUE': range(rows)})
+
+
+def test_retries_429_with_retry_after(stub):
+    stub.statuses['d1'] = [(429, {'Retry-After': '0'}), (429, {'Retry-After': '0'})]
+    with client(stub) as prediction_client:
+        predictions_df = prediction_client.score(frame(3), 'd1', 'key')
+    assert stub.attempts('d1') == [3, 3, 3]
+    assert predictions_df['prediction'].tolist() == [0, 1, 2]
+
+
+def test_retries_server_errors(stub):
+    stub.statuses['d1'] = [(503, {}), (500, {})]
+    stub.statuses['d2'] = [(502, {})] * 3
+    with client(stub, max_retries=2) as prediction_client:
+        assert len(prediction_client.score(frame(2), 'd1', 'key')) == 2
+        with pytest.raises(requests.HTTPError):
+            prediction_client.score(frame(2), 'd2', 'key')
+    assert len(stub.attempts('d1')) == 3
+    assert len(stub.attempts('d2')) == 3
+
+
+def test_client_errors_are_not_retried(stub):
+    stub.statuses['d1'] = [(401, {})]
+    with client(stub) as prediction_client:
+        with pytest.raises(requests.HTTPError):
+            prediction_client.score(frame(2), 'd1', 'key')
+    assert len(stub.attempts('d1')) == 1
+
+
+@pytest.mark.parametrize('payload_format', ['json', 'csv'])
+def test_too_large_batches_are_split(payload_format):
+    stub = StubPredictionServer(max_rows=3)
+    try:
+        with client(stub, max_rows_per_batch=10, payload_format=payload_format) as prediction_client:
+            predictions_df = prediction_client.score_many([('A', frame(10), 'd1', 'key'), ('B', frame(4), 'd2', 'key')])
+    finally:
+        stub.close()
+    #10 rows are rejected, then both halves of 5, then the quarters go through
+    assert sorted(stub.attempts('d1')) == [2, 2, 3, 3, 5, 5, 10]
+    assert sorted(stub.attempts('d2')) == [2, 2, 4]
+    assert predictions_df['dataframe_name'].tolist() == ['A'] * 10 + ['B'] * 4
+    assert predictions_df['rowId'].tolist() == list(range(10)) + list(range(4))
+    assert predictions_df['prediction'].tolist() == list(range(10)) + list(range(4))
+
+
+def test_batches_within_row_and_byte_limits(stub):
+    with client(stub, max_rows_per_batch=4, max_batch_bytes=40) as prediction_client:
+        predictions_df = prediction_client.score(frame(9), 'd1', 'key')
+    assert max(stub.attempts('d1')) <= 3
+    assert sum(stub.attempts('d1')) == 9
+    assert predictions_df['rowId'].tolist() == list(range(9))